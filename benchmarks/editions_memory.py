@@ -0,0 +1,104 @@
+"""
+Compare peak memory use of writing editions with and without streaming.
+
+The two test XForms of the language_editions tests are written for the
+requested number of synthetic sites, which alternate between two language
+lists. In "list" mode all site jobs are generated into a list before any
+archive is written, like before the jobs were streamed, and in "stream" mode
+each site's jobs are written as they are generated. Each mode runs in a fresh
+subprocess, so that the process peak RSS is comparable.
+
+Usage:
+python benchmarks/editions_memory.py --sites 500
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+from odk_tools.language_editions.editions import Editions
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+TEST_FOLDER = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'language_editions')
+XFORMS = ('Q1309_BEHAVE', 'R1309_BEHAVE')
+LANGUAGES = (('english', 'french'), ('german',))
+
+
+def run_mode(sites, stream):
+    """
+    Write the editions for the synthetic sites, and report the peak memory.
+
+    Parameters.
+    :param sites: int. Number of synthetic sites.
+    :param stream: bool. If False, generate all site jobs into a list first.
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        xform_paths = list()
+        for name in XFORMS:
+            shutil.copytree(os.path.join(TEST_FOLDER, name + '-media'),
+                            os.path.join(temp_dir, name + '-media'))
+            shutil.copy(os.path.join(TEST_FOLDER, name + '.xml'), temp_dir)
+            xform_paths.append(os.path.join(temp_dir, name + '.xml'))
+        settings = {str(10000 + x): LANGUAGES[x % len(LANGUAGES)]
+                    for x in range(sites)}
+        stream_site_jobs = Editions._iter_site_jobs
+        iter_site_jobs = stream_site_jobs
+        if not stream:
+            def iter_site_jobs(**kwargs):
+                return list(stream_site_jobs(**kwargs))
+        tracemalloc.start()
+        start = time.perf_counter()
+        with patch.object(Editions, '_read_site_languages',
+                          return_value=settings), \
+                patch.object(Editions, '_iter_site_jobs', iter_site_jobs):
+            Editions.write_language_editions(
+                xform_path=xform_paths,
+                site_languages=os.path.join(temp_dir, 'sites.xlsx'))
+        elapsed = time.perf_counter() - start
+        _, python_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    max_rss = 0
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            max_rss *= 1024
+    print("{0:.1f} {1} {2}".format(elapsed, python_peak, max_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=500)
+    parser.add_argument("--mode", choices=["list", "stream"], default=None,
+                        help="Run one mode in this process (used internally).")
+    args = parser.parse_args()
+    if args.mode is not None:
+        run_mode(sites=args.sites, stream=args.mode == "stream")
+        return
+    print("Sites: {0}".format(args.sites))
+    print("{0:<8}{1:>10}{2:>20}{3:>16}".format(
+        "mode", "seconds", "python peak (MB)", "peak RSS (MB)"))
+    for mode in ("list", "stream"):
+        command = [sys.executable, __file__, "--sites", str(args.sites),
+                   "--mode", mode]
+        output = subprocess.check_output(command, universal_newlines=True)
+        elapsed, python_peak, max_rss = output.split()
+        print("{0:<8}{1:>10}{2:>20.1f}{3:>16.1f}".format(
+            mode, elapsed, int(python_peak) / 1024 ** 2,
+            int(max_rss) / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare the speed of the golden image comparison with a per pixel loop.
+
+Pairs of the reference images from the question_images tests are copied into
+temporary folders: most pairs are the "almost identical" pair (tiny
+differences), every 10th pair is identical, and every 100th pair is clearly
+different. The folders are compared with GoldenImages.compare_folders, and a
+sample of the pairs is compared with a per pixel loop in Python, like the one
+in tests/question_images/test.py, for reference.
+
+Usage:
+python benchmarks/golden_diff.py [--images 1000] [--workers 4]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from odk_tools.question_images.images import Images
+from odk_tools.question_images.regression import GoldenImages
+
+
+REFERENCE_IMAGES = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'question_images',
+    'reference_images')
+OBSERVED = 'da2d10ye_english_all.png'
+GOLDEN = {0: 'da2d10ye_english_all_almost_identical.png',
+          10: 'da2d10ye_english_all.png', 100: 'da2d10ye_english_label.png'}
+
+
+def golden_name(index):
+    """Get the reference image to use as the golden image for the pair."""
+    for every in (100, 10):
+        if index % every == 0:
+            return GOLDEN[every]
+    return GOLDEN[0]
+
+
+def loop_compare(observed_path, golden_path):
+    """Count the differing pixels with a per pixel loop in Python."""
+    observed = Images._open_image(observed_path)
+    golden = Images._open_image(golden_path)
+    counts = [0, 0, 0]
+    for pixels in zip(observed.getdata(), golden.getdata()):
+        largest = max(abs(a - b) for a, b in zip(*pixels))
+        if largest == 0:
+            continue
+        counts[0 if largest < 3 else 1 if largest < 15 else 2] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=1000,
+                        help="Number of image pairs to compare.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of threads for comparing images.")
+    parser.add_argument("--loop-sample", type=int, default=5,
+                        help="Number of pairs to compare with the loop.")
+    args = parser.parse_args()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        observed_path = os.path.join(temp_dir, 'observed')
+        golden_path = os.path.join(temp_dir, 'golden')
+        os.makedirs(observed_path)
+        os.makedirs(golden_path)
+        for index in range(args.images):
+            name = '{0}.png'.format(index)
+            shutil.copy(os.path.join(REFERENCE_IMAGES, OBSERVED),
+                        os.path.join(observed_path, name))
+            shutil.copy(os.path.join(REFERENCE_IMAGES, golden_name(index)),
+                        os.path.join(golden_path, name))
+
+        start = time.perf_counter()
+        results = GoldenImages.compare_folders(
+            observed_path=observed_path, golden_path=golden_path,
+            report_path=os.path.join(temp_dir, 'report'),
+            workers=args.workers)
+        elapsed = time.perf_counter() - start
+        failed = len([x for x in results if x['status'] != 'pass'])
+        print("compare_folders: {0} pairs in {1:.2f}s ({2:.1f}ms per pair), "
+              "{3} failed.".format(len(results), elapsed,
+                                   elapsed * 1000 / len(results), failed))
+
+        start = time.perf_counter()
+        for index in range(1, args.loop_sample + 1):
+            name = '{0}.png'.format(index)
+            loop_compare(os.path.join(observed_path, name),
+                         os.path.join(golden_path, name))
+        elapsed = time.perf_counter() - start
+        print("per pixel loop: {0:.1f}ms per pair.".format(
+            elapsed * 1000 / args.loop_sample))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
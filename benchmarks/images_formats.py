@@ -0,0 +1,93 @@
+"""
+Compare the encode time and size of question images in each image format.
+
+The images of the example XLSForms in the question_images tests are rendered
+once, then each image is converted and encoded in memory in each of the
+IMAGE_FORMATS, as Images.write would save them. Rendering isn't included in
+the times, since it is the same for every format.
+
+Usage:
+python benchmarks/images_formats.py [--questions 50]
+"""
+import argparse
+import os
+import time
+from xlrd import open_workbook
+from odk_tools.question_images.images import Images, ImageSettings, \
+    ImageContent, IMAGE_FORMATS
+
+
+TEST_FOLDER = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'question_images')
+XLSFORMS = ('Q1302_BEHAVE.xlsx', 'Q1309_BEHAVE.xlsx')
+
+
+def render_form(xlsform_path, questions):
+    """
+    Render the question images of a form, for each language.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform.
+    :param questions: int. Maximum number of questions per language.
+    :return: list. Rendered images.
+    """
+    workbook = open_workbook(filename=xlsform_path)
+    images = list()
+    for language in ImageSettings.read(xlsform_workbook=workbook).values():
+        language = ImageContent.read(
+            xlsform_workbook=workbook, settings=language)
+        language['image_content'] = language['image_content'][:questions]
+        base_image, pixels_from_top = Images._prepare_base_image(
+            settings=language, xlsform_path=xlsform_path)
+        images.extend(x[0] for x in Images._prepare_question_images(
+            base_image=base_image, pixels_from_top=pixels_from_top,
+            settings=language, output_path='', xlsform_path=xlsform_path))
+    return images
+
+
+def encode_images(images, image_format):
+    """
+    Convert and encode the images in the format, and report time and size.
+
+    Parameters.
+    :param images: list. Rendered images, which are not modified.
+    :param image_format: str. One of IMAGE_FORMATS.
+    :return: float (seconds), int (total bytes).
+    """
+    settings = {'image_format': image_format}
+    image_path = 'image{0}'.format(IMAGE_FORMATS[image_format])
+    size = 0
+    start = time.perf_counter()
+    for image in images:
+        converted = Images._convert_image(
+            image=image.copy(), settings=settings)
+        size += len(Images._encode_image(
+            image=converted, image_path=image_path))
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=50,
+                        help="Maximum number of questions per language.")
+    args = parser.parse_args()
+    print("{0:<20}{1:<8}{2:>8}{3:>10}{4:>12}{5:>10}".format(
+        "form", "format", "images", "seconds", "size (MB)", "vs png"))
+    for name in XLSFORMS:
+        images = render_form(xlsform_path=os.path.join(TEST_FOLDER, name),
+                             questions=args.questions)
+        png_size = None
+        for image_format in IMAGE_FORMATS:
+            elapsed, size = encode_images(
+                images=images, image_format=image_format)
+            if png_size is None:
+                png_size = size
+            print("{0:<20}{1:<8}{2:>8}{3:>10.2f}{4:>12.2f}{5:>9.0f}%".format(
+                name, image_format, len(images), elapsed, size / 1024 ** 2,
+                100 * size / png_size))
+        for image in images:
+            image.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Compare peak memory use of writing question images with and without stream.
+
+XLSForms with 500 questions and the requested number of questions are
+generated from the Q1302_BEHAVE test form, keeping its image settings and
+replacing its survey sheet. Generating them needs openpyxl, which is not
+otherwise required. Each mode runs write_images on each form in a fresh
+subprocess, so that the process peak RSS is comparable, and again with
+tracemalloc for the Python peak, since tracemalloc's own memory use grows
+the RSS and slows the run.
+
+The Python peak and the process peak RSS are reported for the whole run,
+from opening the XLSForm to writing the last image. In list mode they grow
+with the size of the XLSForm, since xlrd loads all the sheets of a .xlsx
+file when it's opened. In stream mode the survey rows are parsed as they're
+reached (see XlsxRows), so the peaks should be flat: the benchmark exits with
+an error if, for the requested number of questions, the stream Python peak is
+more than FLAT_MARGIN over the peak for 500, or the stream peak RSS is more
+than RSS_MARGIN over it. The RSS also counts the memory of lxml and Pillow,
+which the Python peak doesn't.
+
+Images are not saved, so that disk speed doesn't affect the result. With
+--encode they're PNG encoded into memory, which is more realistic but slower.
+
+Usage:
+python benchmarks/images_memory.py --questions 10000 [--encode]
+"""
+import argparse
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+from odk_tools.question_images.images import Images, write_images
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+TEST_FORM = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tests', 'question_images',
+    'Q1302_BEHAVE.xlsx')
+LABEL = "Over the last 2 weeks, how often have you been bothered by the " \
+        "following problem? Question number {0}."
+HINT = "Select one answer only. If you are not sure, choose the answer " \
+       "closest to how you feel."
+BASELINE_QUESTIONS = 500
+FLAT_MARGIN = 1024 ** 2
+RSS_MARGIN = 8 * 1024 ** 2
+
+
+def make_form(questions, output_path):
+    """
+    Write a copy of the test form with the requested number of questions.
+
+    Parameters.
+    :param questions: int. Number of questions in the survey sheet.
+    :param output_path: str. Folder to write the form to. The nested images
+        of the test form are copied there too.
+    :return: str. Path to the generated XLSForm.
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(TEST_FORM)
+    survey = workbook['survey']
+    survey.delete_rows(2, survey.max_row)
+    for row in range(1, questions + 1):
+        survey.append(['select_one yes_no', 'question_{0}'.format(row),
+                       LABEL.format(row), HINT, ''])
+    xlsform_path = os.path.join(output_path, os.path.basename(TEST_FORM))
+    workbook.save(xlsform_path)
+    shutil.copytree(
+        os.path.join(os.path.dirname(TEST_FORM), 'nest_images'),
+        os.path.join(output_path, 'nest_images'))
+    return xlsform_path
+
+
+def _encode_image(image, image_path):
+    """Stand-in for Images._save_image which encodes to memory."""
+    image.save(io.BytesIO(), 'PNG', dpi=[300, 300])
+    image.close()
+
+
+def _discard_image(image, image_path):
+    """Stand-in for Images._save_image which only releases the image."""
+    image.close()
+
+
+def peak_rss():
+    """
+    Get the peak RSS of this process, in bytes, or 0 if it's not available.
+
+    On Linux, the ru_maxrss of a subprocess includes the RSS of the parent
+    when it was started, which here has the generated form loaded, so the
+    VmHWM of the process, which starts again when it's run, is used instead.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return max_rss
+
+
+def run_mode(xlsform_path, stream, encode, trace):
+    """
+    Write the images for the generated form, and report the peak memory.
+
+    Parameters.
+    :param xlsform_path: str. Path to the generated form.
+    :param stream: bool. Passed to write_images.
+    :param encode: bool. If True, PNG encode each image into memory.
+    :param trace: bool. If True, trace the Python peak, otherwise it's
+        reported as 0.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    save_image = _encode_image if encode else _discard_image
+    with patch.object(Images, '_save_image', save_image):
+        write_images(xlsform_path=xlsform_path, stream=stream)
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print("{0:.1f} {1} {2}".format(elapsed, peak, peak_rss()))
+
+
+def run_form(questions, encode):
+    """
+    Generate a form and run each mode on it in a subprocess.
+
+    Parameters.
+    :param questions: int. Number of questions in the form.
+    :param encode: bool. If True, PNG encode each image into memory.
+    :return: dict. Key is mode, value is a tuple of the Python peak and the
+        peak RSS, in bytes.
+    """
+    temp_dir = tempfile.mkdtemp()
+    peaks = dict()
+    try:
+        xlsform_path = make_form(questions=questions, output_path=temp_dir)
+        print("Questions: {0}, XLSForm size: {1:.1f} MB".format(
+            questions, os.path.getsize(xlsform_path) / 1024 ** 2))
+        print("{0:<8}{1:>10}{2:>20}{3:>16}".format(
+            "mode", "seconds", "Python peak (MB)", "peak RSS (MB)"))
+        for mode in ("list", "stream"):
+            command = [sys.executable, __file__, "--xlsform", xlsform_path,
+                       "--mode", mode]
+            if encode:
+                command.append("--encode")
+            elapsed, _, max_rss = subprocess.check_output(
+                command, universal_newlines=True).split()
+            _, peak, _ = subprocess.check_output(
+                command + ["--trace"], universal_newlines=True).split()
+            print("{0:<8}{1:>10}{2:>20.1f}{3:>16.1f}".format(
+                mode, elapsed, int(peak) / 1024 ** 2,
+                int(max_rss) / 1024 ** 2))
+            peaks[mode] = (int(peak), int(max_rss))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return peaks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--encode", action="store_true", default=False,
+                        help="PNG encode each image into memory.")
+    parser.add_argument("--mode", choices=["list", "stream"], default=None,
+                        help="Run one mode in this process (used internally).")
+    parser.add_argument("--xlsform", default=None,
+                        help="Generated form to use (used internally).")
+    parser.add_argument("--trace", action="store_true", default=False,
+                        help="Trace the Python peak (used internally).")
+    args = parser.parse_args()
+    if args.mode is not None:
+        run_mode(xlsform_path=args.xlsform, stream=args.mode == "stream",
+                 encode=args.encode, trace=args.trace)
+        return
+    baseline = run_form(questions=BASELINE_QUESTIONS, encode=args.encode)
+    requested = run_form(questions=args.questions, encode=args.encode)
+    errors = list()
+    for name, index, margin in (("Python peak", 0, FLAT_MARGIN),
+                                ("peak RSS", 1, RSS_MARGIN)):
+        growth = requested["stream"][index] - baseline["stream"][index]
+        if growth > margin:
+            errors.append("Stream {0} grew by {1:.1f} MB from {2} to {3} "
+                          "questions.".format(name, growth / 1024 ** 2,
+                                              BASELINE_QUESTIONS,
+                                              args.questions))
+    if len(errors) > 0:
+        sys.exit("\n".join(errors))
+
+
+if __name__ == '__main__':
+    main()
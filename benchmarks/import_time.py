@@ -0,0 +1,82 @@
+"""
+Check the import time of the GUI and command line entry points.
+
+Each module is imported in a fresh interpreter with "-X importtime", several
+times, and the fastest cumulative import time is compared to its budget.
+Heavy libraries (pyxform, lxml, PIL, xlrd, xmltodict) should only be imported
+when a task first needs them, so any that are imported are also reported.
+
+The exit code is 1 if any module is over budget, so this can be used in CI.
+
+Usage:
+python benchmarks/import_time.py [--repeat 5]
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+
+BUDGETS_MS = (
+    ('odk_tools.gui.gui', 150),
+    ('odk_tools.question_images.images', 100),
+    ('odk_tools.language_editions.editions', 100),
+    ('odk_tools.watcher.watcher', 150),
+)
+HEAVY_MODULES = ('pyxform', 'lxml.etree', 'PIL.Image', 'xlrd', 'xmltodict')
+CHECK_HEAVY = "import sys; print(','.join(x for x in {0!r} if x in " \
+              "sys.modules))"
+
+
+def import_time_ms(module):
+    """
+    Import the module in a new interpreter, and get the import time.
+
+    Parameters.
+    :param module: str. Name of the module to import.
+    :return: tuple (float import time in ms, list of heavy modules imported).
+    """
+    code = "import {0}; {1}".format(module, CHECK_HEAVY.format(HEAVY_MODULES))
+    if sys.version_info >= (3, 7):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        elapsed = None
+        for line in result.stderr.splitlines():
+            parts = [x.strip() for x in line.split('|')]
+            if len(parts) == 3 and parts[2] == module:
+                elapsed = int(parts[1]) / 1000
+    else:
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", code], stdout=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        elapsed = (time.perf_counter() - start) * 1000
+    heavy = [x for x in result.stdout.strip().split(',') if len(x) > 0]
+    return elapsed, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of imports to take the fastest of.")
+    args = parser.parse_args()
+    over_budget = False
+    print("{0:<40}{1:>10}{2:>10}  {3}".format(
+        "module", "ms", "budget", "heavy imports"))
+    for module, budget in BUDGETS_MS:
+        results = [import_time_ms(module) for _ in range(args.repeat)]
+        elapsed = min(x[0] for x in results)
+        heavy = results[-1][1]
+        flag = ""
+        if elapsed > budget or len(heavy) > 0:
+            over_budget = True
+            flag = " OVER BUDGET"
+        print("{0:<40}{1:>10.1f}{2:>10}  {3}{4}".format(
+            module, elapsed, budget, ", ".join(heavy) or "-", flag))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,13 @@ a = Analysis(['odk_tools/gui/gui.py'],
              pathex=['.'],
              binaries=[('bin/ODK_Validate.jar', '.')],
              datas=[('examples', 'examples'), ('docs', 'docs')],
-             hiddenimports=[],
+             hiddenimports=['PIL.Image', 'PIL.ImageDraw', 'PIL.ImageFont',
+                            'lxml.etree', 'xlrd', 'xmltodict',
+                            'pyxform.xls2xform',
+                            'odk_tools.gui.wrappers.generate_xform',
+                            'odk_tools.gui.wrappers.validate_xform',
+                            'odk_tools.gui.wrappers.generate_images',
+                            'odk_tools.gui.wrappers.generate_editions'],
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
@@ -2,10 +2,10 @@ import os
 import errno
 import argparse
 from collections import OrderedDict
-from xlrd import open_workbook
 from docx import Document
 from docx.shared import Pt, Cm
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from odk_tools.gui.workbook_cache import WORKBOOKS
 
 """
 Creates image files with xlsform question text.
@@ -231,10 +231,12 @@ def read_xlsform(filepath):
     """
     Read the xlsform file into OrderedDicts
 
+    The parsed workbook is shared with other tasks through WORKBOOKS.
+
     :param filepath:
     :return:
     """
-    workbook = open_workbook(filename=filepath)
+    workbook = WORKBOOKS.get(file_path=filepath)
     survey_raw = workbook.sheet_by_name('survey')
     choices_raw = workbook.sheet_by_name('choices')
     survey_dict = sheet_to_list_of_ordereddict(survey_raw)
@@ -265,7 +267,7 @@ def read_xlsform2(filepath):
     """
 
     # open the xlsform and read the image_settings
-    xls_workbook = open_workbook(filename=filepath)
+    xls_workbook = WORKBOOKS.get(file_path=filepath)
     xls_image_settings = xls_workbook.sheet_by_name(sheet_name='image_settings')
 
     image_settings_langs = {}
@@ -3,8 +3,6 @@ import tkinter.filedialog
 import tkinter.messagebox
 from functools import partial
 from tkinter import ttk
-from odk_tools.gui.wrappers import generate_images, generate_xform, \
-    validate_xform, generate_editions
 from odk_tools.gui import preferences
 
 
@@ -279,6 +277,7 @@ class ODKToolsGui:
         :param master: tkinter.Frame. Frame where master.output.textbox is.
         :param xlsform_path: str. Path to XLSForm to convert.
         """
+        from odk_tools.gui.wrappers import generate_xform
         result, xform_path_used, xlsform_path_used = generate_xform.wrapper(
             xlsform_path=xlsform_path.get())
         master.output.textbox.insert(tkinter.END, result)
@@ -300,6 +299,7 @@ class ODKToolsGui:
         :param master: tkinter.Frame. Frame where master.output.textbox is.
         :param xlsform_path: str. Path to XLSForm to convert.
         """
+        from odk_tools.gui.wrappers import generate_images
         result = generate_images.wrapper(
             xlsform_path=xlsform_path.get())
         master.output.textbox.insert(tkinter.END, result)
@@ -317,6 +317,7 @@ class ODKToolsGui:
           packaged with the GUI but maybe a different version is desired.
         :param xform_path: str. Path to XLSForm to convert.
         """
+        from odk_tools.gui.wrappers import validate_xform
         result = validate_xform.wrapper(
                 java_path=java_path.get(),
                 validate_path=validate_path.get(),
@@ -336,6 +337,7 @@ class ODKToolsGui:
         :param nest_in_odk_folders: int. 1=yes, 0=no. Nest in /odk/forms/*.
         :param collect_settings: str. Optional path to collect.settings file.
         """
+        from odk_tools.gui.wrappers import generate_editions
         result = generate_editions.wrapper(
                 xform_path=xform_path.get(),
                 sitelangs_path=sitelangs_path.get(),
@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import OrderedDict
+from odk_tools.lazy import lazy_import
+
+xlrd = lazy_import('xlrd')
+images = lazy_import('odk_tools.question_images.images')
+
+
+class WorkbookCache:
+    """
+    Keeps parsed XLSForm workbooks for re-use by the GUI tasks.
+
+    Workbooks are keyed on the file path, size and modification time, so a
+    workbook is parsed again only if the file was changed since it was last
+    used. The tasks that read the XLSForm with xlrd get the workbook from
+    here: Generate XForm, to update the image references, Generate Images,
+    and the docx export. So running them in turn on an unchanged XLSForm
+    parses it once. pyxform still reads the XLSForm itself when converting
+    it, since it can only be given a file.
+
+    The image settings read from a workbook are kept under the same key, so
+    the settings fonts aren't loaded again either.
+
+    Usage:
+    workbook = WORKBOOKS.get(file_path="Q1302_BEHAVE.xlsx")
+    """
+
+    def __init__(self, max_entries=4):
+        """
+        Parameters.
+        :param max_entries: int. Number of workbooks to keep. When exceeded,
+            the least recently used workbook is dropped.
+        """
+        self.max_entries = max_entries
+        self.workbooks = OrderedDict()
+        self.image_settings = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(file_path):
+        """
+        Get the cache key for the workbook file.
+
+        Parameters.
+        :param file_path: str. Path to the workbook.
+        :return: tuple. Absolute path, size and modification time.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        return file_path, stat.st_size, stat.st_mtime
+
+    def get(self, file_path):
+        """
+        Get the parsed workbook, parsing it if it's not cached or has changed.
+
+        Parameters.
+        :param file_path: str. Path to the workbook.
+        :return: xlrd workbook.
+        """
+        key = WorkbookCache._key(file_path)
+        with self.lock:
+            workbook = self.workbooks.get(key)
+            if workbook is not None:
+                self.workbooks.move_to_end(key)
+                return workbook
+        workbook = xlrd.open_workbook(filename=key[0])
+        with self.lock:
+            for old_key in [x for x in self.workbooks if x[0] == key[0]]:
+                del self.workbooks[old_key]
+                self.image_settings.pop(old_key, None)
+            self.workbooks[key] = workbook
+            while len(self.workbooks) > self.max_entries:
+                old_key, _ = self.workbooks.popitem(last=False)
+                self.image_settings.pop(old_key, None)
+        return workbook
+
+    def get_image_settings(self, file_path):
+        """
+        Get the image settings of the workbook, reading them if not cached.
+
+        Each language's settings are returned as a copy, since write_images
+        adds the language's image content to them.
+
+        Parameters.
+        :param file_path: str. Path to the workbook.
+        :return: dict[dict]. As per ImageSettings.read.
+        """
+        key = WorkbookCache._key(file_path)
+        workbook = self.get(file_path=file_path)
+        with self.lock:
+            settings = self.image_settings.get(key)
+        if settings is None:
+            settings = images.ImageSettings.read(xlsform_workbook=workbook)
+            with self.lock:
+                if key in self.workbooks:
+                    self.image_settings[key] = settings
+        return {k: dict(v) for k, v in settings.items()}
+
+    def clear(self):
+        """Drop all cached workbooks."""
+        with self.lock:
+            self.workbooks.clear()
+            self.image_settings.clear()
+
+
+WORKBOOKS = WorkbookCache()
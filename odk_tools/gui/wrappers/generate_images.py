@@ -1,4 +1,5 @@
 from odk_tools.gui import utils
+from odk_tools.gui.workbook_cache import WORKBOOKS
 from odk_tools.gui.log_capturing_handler import CapturingHandler
 import logging
 from odk_tools.question_images import images
@@ -26,7 +27,11 @@ def wrapper(xlsform_path):
         images_log.setLevel("DEBUG")
         log_capture = CapturingHandler(logger=images_log)
         content = log_capture.watcher.output
-        images.write_images(xlsform_path=valid_xlsform_path)
+        images.write_images(
+            xlsform_path=valid_xlsform_path,
+            xlsform_workbook=WORKBOOKS.get(file_path=valid_xlsform_path),
+            image_settings=WORKBOOKS.get_image_settings(
+                file_path=valid_xlsform_path))
     except Exception as e:
         header = "Generate Images task not run. Error(s) below."
         content = str(e)
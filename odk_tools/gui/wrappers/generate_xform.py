@@ -1,5 +1,9 @@
-from pyxform.xls2xform import xls2xform_convert
 from odk_tools.gui import utils, xform_patch
+from odk_tools.gui.workbook_cache import WORKBOOKS
+from odk_tools.lazy import lazy_import
+
+xls2xform = lazy_import('pyxform.xls2xform')
+images = lazy_import('odk_tools.question_images.images')
 
 
 def wrapper(xlsform_path):
@@ -10,6 +14,10 @@ def wrapper(xlsform_path):
     - XLSForm path is always required.
     - If xform_path is blank, use the XLSForm filename and path.
 
+    If the XLSForm has image settings with an image_format other than png,
+    the XForm's question image references are changed to the file names that
+    Generate Images writes. See images.update_xform_images.
+
     If any of the paths end up not being resolved, error message boxes are
     opened to indicate this clearly to the user.
 
@@ -24,11 +32,17 @@ def wrapper(xlsform_path):
         valid_xlsform_path = utils.validate_path(
             "XLSForm path", xlsform_path, ".xlsx")
         valid_xform_path = valid_xlsform_path.replace(".xlsx", ".xml")
-        content = xls2xform_convert(
+        content = xls2xform.xls2xform_convert(
             xlsform_path=valid_xlsform_path, xform_path=valid_xform_path,
             validate=False)
         content.append(xform_patch.xform_empty_question_label_patch(
             valid_xform_path))
+        updated = images.update_xform_images(
+            xform_path=valid_xform_path, xlsform_path=valid_xlsform_path,
+            xlsform_workbook=WORKBOOKS.get(file_path=valid_xlsform_path))
+        if updated > 0:
+            content.append("Changed {0} image references to the image_format "
+                           "file names.".format(updated))
     except Exception as e:
         header = "Generate XForm task not run. Error(s) below."
         content = str(e)
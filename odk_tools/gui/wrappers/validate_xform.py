@@ -1,9 +1,21 @@
+import argparse
+import json
 import os
+import re
 import subprocess
 import sys
+import time
 from odk_tools.gui import utils
 
 
+VALID_MARKERS = (">> Xform is valid!", ">> Xform parsing completed!")
+INVALID_MARKERS = (">> Xform is invalid!", ">> XForm is invalid.",
+                   ">> XML is invalid.", ">> Something broke the parser.")
+WARNING_PREFIX = "XForm Parse Warning:"
+ERROR_PREFIX = "XForm Parse Error:"
+STACK_FRAME = re.compile(r"^\s+at |^\s*\.\.\. \d+ more$")
+
+
 def get_popen_kwargs():
     """Because accidentally changing global dictionaries is all too easy."""
     return {
@@ -12,25 +24,32 @@ def get_popen_kwargs():
         'stderr': subprocess.PIPE}
 
 
-def _get_callable_java_path(popen_kwargs):
+def _call_java_version(path, popen_kwargs):
+    """Mock-able call to "java -version", returning the stderr output."""
+    cmd = '{} -version'.format(path)
+    with subprocess.Popen(cmd, **popen_kwargs) as p:
+        output = p.stderr.read()
+    return output
+
+
+def _get_java_version(popen_kwargs):
     """
-    Check if Java can be invoked from JAVA_HOME, and return the exec path.
+    Check if Java can be invoked from JAVA_HOME, and get the path and version.
 
     Parameters.
     :param popen_kwargs: dict. Options to pass through to subprocess.Popen.
-    :return: bool (working java -version), str (path to java)
+    :return: tuple (str path to java, str first line of java -version output)
     """
     found = False
     path = ''
+    output = ''
     java_home = os.environ.get('JAVA_HOME')
     if java_home is not None:
         if os.name == "nt":
             path = '"{}"'.format(os.path.join(java_home, "bin", "java.exe"))
         else:
             path = os.path.join(java_home, "bin", "java")
-        cmd = '{} -version'.format(path)
-        with subprocess.Popen(cmd, **popen_kwargs) as p:
-            output = p.stderr.read()
+        output = _call_java_version(path=path, popen_kwargs=popen_kwargs)
         found = output.startswith('java version')
     if not found:
         msg = "Java does not appear to be callable. Please either:\n" \
@@ -38,7 +57,19 @@ def _get_callable_java_path(popen_kwargs):
               "- Select the path using the 'Browse...' button, or\n" \
               "- Set the 'JAVA_HOME' environment variable and restart the GUI."
         raise ValueError(msg)
-    return utils.validate_path("Java Path", path, ".exe")
+    valid_path = utils.validate_path("Java Path", path, ".exe")
+    return valid_path, output.splitlines()[0]
+
+
+def _get_callable_java_path(popen_kwargs):
+    """
+    Check if Java can be invoked from JAVA_HOME, and return the exec path.
+
+    Parameters.
+    :param popen_kwargs: dict. Options to pass through to subprocess.Popen.
+    :return: str. Path to java.
+    """
+    return _get_java_version(popen_kwargs=popen_kwargs)[0]
 
 
 def _locate_odk_validate():
@@ -62,6 +93,126 @@ def _locate_odk_validate():
     return os.path.join(application_path, 'ODK_Validate.jar')
 
 
+def _preflight_cache_path():
+    """
+    Get the path to the validation preflight cache file for the current user.
+
+    :return: str. Path to the cache file.
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get(
+            'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'odk_tools', 'validate_preflight.json')
+
+
+def _file_mtime(path):
+    """Get the modification time of the file, or None if it's missing."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _read_preflight(cache_path):
+    """
+    Read the preflight cache entries, or an empty dict if there aren't any.
+
+    Parameters.
+    :param cache_path: str. Path to the cache file.
+    :return: dict. Cache entries, keyed on "java" and "odk_validate".
+    """
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            entries = json.load(cache_file)
+    except (OSError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    return entries
+
+
+def _write_preflight(cache_path, entries):
+    """
+    Save the preflight cache entries.
+
+    The file is replaced in one step, so that other processes don't read a
+    partly written file. Errors are ignored, since the cache only saves time.
+
+    Parameters.
+    :param cache_path: str. Path to the cache file.
+    :param entries: dict. Cache entries, keyed on "java" and "odk_validate".
+    """
+    temp_path = '{0}.{1}.tmp'.format(cache_path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(entries, cache_file, indent=2, sort_keys=True)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+def preflight_java(popen_kwargs, cache_path=None):
+    """
+    Get the java path and version from JAVA_HOME, using the preflight cache.
+
+    The cached java is used if JAVA_HOME and the modification time of the
+    java binary are the same as when it was checked, so that "java -version"
+    is only run after Java is installed, updated or moved.
+
+    Parameters.
+    :param popen_kwargs: dict. Options to pass through to subprocess.Popen.
+    :param cache_path: str. Path to the cache file. If None, a file in the
+        user's cache directory is used.
+    :return: tuple (str path to java, str java version)
+    """
+    if cache_path is None:
+        cache_path = _preflight_cache_path()
+    entries = _read_preflight(cache_path=cache_path)
+    entry = entries.get('java')
+    java_home = os.environ.get('JAVA_HOME')
+    if isinstance(entry, dict) and java_home is not None \
+            and entry.get('java_home') == java_home \
+            and entry.get('mtime') is not None \
+            and _file_mtime(entry.get('path', '')) == entry.get('mtime'):
+        return entry['path'], entry['version']
+    path, version = _get_java_version(popen_kwargs=popen_kwargs)
+    entries['java'] = {'java_home': java_home, 'path': path,
+                       'version': version, 'mtime': _file_mtime(path)}
+    _write_preflight(cache_path=cache_path, entries=entries)
+    return path, version
+
+
+def preflight_odk_validate(cache_path=None):
+    """
+    Get the path to ODK_Validate.jar, using the preflight cache.
+
+    The cached path is used if it's for the same Python (or frozen GUI)
+    executable and the jar's modification time hasn't changed.
+
+    Parameters.
+    :param cache_path: str. Path to the cache file. If None, a file in the
+        user's cache directory is used.
+    :return: str. Absolute path to "ODK_Validate.jar".
+    """
+    if cache_path is None:
+        cache_path = _preflight_cache_path()
+    entries = _read_preflight(cache_path=cache_path)
+    entry = entries.get('odk_validate')
+    if isinstance(entry, dict) \
+            and entry.get('executable') == sys.executable \
+            and entry.get('mtime') is not None \
+            and _file_mtime(entry.get('path', '')) == entry.get('mtime'):
+        return entry['path']
+    path = _locate_odk_validate()
+    entries['odk_validate'] = {'executable': sys.executable, 'path': path,
+                               'mtime': _file_mtime(path)}
+    _write_preflight(cache_path=cache_path, entries=entries)
+    return path
+
+
 def _call_odk_validate(cmd, env, popen_kwargs):
     """Mock-able call to Popen."""
     with subprocess.Popen(cmd, env=env, **popen_kwargs) as p:
@@ -69,13 +220,131 @@ def _call_odk_validate(cmd, env, popen_kwargs):
     return content
 
 
-def wrapper(java_path, validate_path, xform_path):
+def parse_validate_output(stderr, stdout, xform_path=None, seconds=None):
+    """
+    Parse the ODK_Validate output into the status, errors and warnings.
+
+    The status is "valid" or "invalid" according to the outcome message that
+    ODK_Validate prints last, or "unknown" if there isn't one. Each warning
+    or error is a message from stderr, with any indented lines that follow
+    it (such as "Problem found at nodeset") joined on to it. Java stack trace
+    lines are left out. If the form is valid, any messages that aren't
+    marked as warnings are counted as warnings too.
+
+    Parameters.
+    :param stderr: str. Standard error output of ODK_Validate.
+    :param stdout: str. Standard output of ODK_Validate.
+    :param xform_path: str. Path to the XForm that was validated.
+    :param seconds: float. How long the validation took.
+    :return: dict. With keys xform_path, status, errors, warnings, seconds.
+    """
+    status = "unknown"
+    for line in (stderr + "\n" + stdout).splitlines():
+        line = line.strip()
+        if line.startswith(VALID_MARKERS):
+            status = "valid"
+        elif line.startswith(INVALID_MARKERS):
+            status = "invalid"
+    messages = []
+    for line in stderr.splitlines():
+        text = line.strip()
+        if len(text) == 0 or text.startswith(">>") or STACK_FRAME.match(line):
+            continue
+        if text.startswith(WARNING_PREFIX):
+            messages.append(("warning", [text[len(WARNING_PREFIX):].strip()]))
+        elif text.startswith(ERROR_PREFIX):
+            messages.append(("error", [text[len(ERROR_PREFIX):].strip()]))
+        elif line[0].isspace() and len(messages) > 0:
+            messages[-1][1].append(text)
+        else:
+            messages.append(("error", [text]))
+    result = {"xform_path": xform_path, "status": status, "errors": [],
+              "warnings": [], "seconds": seconds}
+    for kind, lines in messages:
+        if kind == "error" and status != "valid":
+            key = "errors"
+        else:
+            key = "warnings"
+        message = " ".join(lines)
+        if message not in result[key]:
+            result[key].append(message)
+    return result
+
+
+def format_result(result):
+    """
+    Format a parsed validation result as a short text summary.
+
+    Parameters.
+    :param result: dict. Output of parse_validate_output.
+    :return: str. Summary with the status, timing, errors and warnings.
+    """
+    lines = ["Status: {0}".format(result["status"])]
+    if result["seconds"] is not None:
+        lines.append("Time: {0:.2f} seconds".format(result["seconds"]))
+    for key in ("errors", "warnings"):
+        lines.append("{0} ({1}):".format(key.title(), len(result[key])))
+        lines.extend("- {0}".format(x) for x in result[key])
+    return "\n".join(lines)
+
+
+def validate(java_path, validate_path, xform_path, use_cache=True):
+    """
+    Run ODK_Validate on the XForm and parse the output.
+
+    The java_path and validate_path may be blank, in which case they are
+    located as described for wrapper(). Invalid paths raise a ValueError.
+
+    Parameters.
+    :param java_path: str. Path to java binary.
+    :param validate_path: str. Path to ODK_Validate.jar.
+    :param xform_path: str. Path to XForm XML file to validate.
+    :param use_cache: bool. If True, use the preflight cache to locate java
+        and ODK_Validate.jar when the paths are blank.
+    :return: tuple (dict parsed result, list raw [stderr, stdout] output)
+    """
+    if len(java_path) == 0:
+        if use_cache:
+            valid_java_path, _ = preflight_java(
+                popen_kwargs=get_popen_kwargs())
+        else:
+            valid_java_path = _get_callable_java_path(
+                popen_kwargs=get_popen_kwargs())
+    else:
+        valid_java_path = utils.validate_path(
+            "Java path", java_path, ".exe")
+    if len(validate_path) == 0:
+        if use_cache:
+            validate_path = preflight_odk_validate()
+        else:
+            validate_path = _locate_odk_validate()
+    valid_validate_path = utils.validate_path(
+        "ODK_Validate path", validate_path, ".jar")
+    valid_xform_path = utils.validate_path("XForm path", xform_path, ".xml")
+
+    cmd = ['java', '-jar', valid_validate_path, valid_xform_path]
+    env = {'PATH': valid_java_path}
+    start = time.perf_counter()
+    content = _call_odk_validate(
+        cmd=cmd, env=env, popen_kwargs=get_popen_kwargs())
+    seconds = time.perf_counter() - start
+    stderr, stdout = content
+    result = parse_validate_output(
+        stderr=stderr, stdout=stdout, xform_path=valid_xform_path,
+        seconds=seconds)
+    return result, content
+
+
+def wrapper(java_path, validate_path, xform_path, output_format="text",
+            use_cache=True):
     """
     Return ODK_Validate result, guessing at java and odk_validate location.
 
     Calls ODK_Validate.jar using Java and the supplied XForm XML path.
     - If java_path is blank, try to find it from JAVA_HOME environment var.
     - If validate_path is blank, try to find it in the current directory.
+    The paths found for blank java_path or validate_path are saved in the
+    preflight cache, and re-used while JAVA_HOME and the files are unchanged.
     - XForm path is always required.
 
     If any of the paths end up not being resolved, error message boxes are
@@ -85,28 +354,76 @@ def wrapper(java_path, validate_path, xform_path):
     :param java_path: str. Path to java binary.
     :param validate_path: str. Path to ODK_Validate.jar.
     :param xform_path: str. Path to XForm XML file to validate.
-    :return: tuple (output header message, message content)
+    :param output_format: str. "text" for the task output message, or "json"
+        for the parsed result (with status "not run" if there was an error).
+    :param use_cache: bool. If True, use the preflight cache to locate java
+        and ODK_Validate.jar when the paths are blank.
+    :return: str. Task output message, or JSON result.
     """
     try:
         header = "Validate XForm task was run. Output below."
-        if len(java_path) == 0:
-            valid_java_path = _get_callable_java_path(
-                popen_kwargs=get_popen_kwargs())
-        else:
-            valid_java_path = utils.validate_path(
-                "Java path", java_path, ".exe")
-        if len(validate_path) == 0:
-            validate_path = _locate_odk_validate()
-        valid_validate_path = utils.validate_path(
-            "ODK_Validate path", validate_path, ".jar")
-        valid_xform_path = utils.validate_path("XForm path", xform_path, ".xml")
-
-        cmd = ['java', '-jar', valid_validate_path, valid_xform_path]
-        env = {'PATH': valid_java_path}
-        content = _call_odk_validate(
-            cmd=cmd, env=env, popen_kwargs=get_popen_kwargs())
+        result, output = validate(
+            java_path=java_path, validate_path=validate_path,
+            xform_path=xform_path, use_cache=use_cache)
+        content = [format_result(result), *output]
     except Exception as e:
         header = "Validate XForm task not run. Error(s) below."
         content = str(e)
-    result = utils.format_output(header=header, content=content)
-    return result
+        result = {"xform_path": xform_path, "status": "not run",
+                  "errors": [content], "warnings": [], "seconds": None}
+    if output_format == "json":
+        return json.dumps(result, indent=2)
+    return utils.format_output(header=header, content=content)
+
+
+def _create_parser():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Validate XForms with ODK_Validate.")
+    parser.add_argument(
+        "xform", nargs="+", help="Path to XForm XML file(s) to validate.")
+    parser.add_argument(
+        "--java", dest="java_path", default="",
+        help="Path to java binary. If not given, JAVA_HOME is used.")
+    parser.add_argument(
+        "--validate", dest="validate_path", default="",
+        help="Path to ODK_Validate.jar. If not given, the bundled copy is "
+             "used.")
+    parser.add_argument(
+        "--json", dest="json", action="store_true",
+        help="Print a JSON list of results, each with the status, errors, "
+             "warnings and time taken, instead of the text output.")
+    parser.add_argument(
+        "--no-cache", dest="use_cache", action="store_false",
+        help="Locate java and ODK_Validate.jar again, instead of using the "
+             "paths saved from a previous run.")
+    return parser
+
+
+def main_cli():
+    """
+    Collect script arguments from stdin and run validate for each XForm.
+
+    The exit code is 1 if any XForm was not valid.
+    """
+    parser = _create_parser()
+    args = parser.parse_args()
+    results = []
+    for xform_path in args.xform:
+        output = wrapper(
+            java_path=args.java_path, validate_path=args.validate_path,
+            xform_path=xform_path, output_format="json",
+            use_cache=args.use_cache)
+        result = json.loads(output)
+        results.append(result)
+        if not args.json:
+            print("{0}\n{1}\n".format(xform_path, format_result(result)))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    sys.exit(0 if all(x["status"] == "valid" for x in results) else 1)
+
+
+if __name__ == '__main__':
+    main_cli()
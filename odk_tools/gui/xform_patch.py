@@ -1,4 +1,6 @@
-import xmltodict
+from odk_tools.lazy import lazy_import
+
+xmltodict = lazy_import('xmltodict')
 
 
 def xform_empty_question_label_patch(xform_path):
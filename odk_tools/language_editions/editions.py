@@ -1,20 +1,910 @@
+import abc
 import argparse
 import os
+import functools
+import hashlib
+import itertools
+import json
+import uuid
+import io
 import logging
-from lxml import etree
-from xlrd import open_workbook
+import shutil
+import struct
+import tarfile
+import tempfile
 import zipfile
-from typing import List, Tuple, Dict
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Union, Iterable, Iterator
+from odk_tools.lazy import lazy_import
 
+etree = lazy_import('lxml.etree')
+xlrd = lazy_import('xlrd')
+images = lazy_import('odk_tools.question_images.images')
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 ZipJob = List[Tuple[str, str]]
-ETree = etree.ElementTree
+ETree = 'etree._ElementTree'
+Element = 'etree._Element'
 TupleStr = Tuple[str, ...]
+TRANSLATION_XPATH = '/*/*/xf:model/xf:itext/xf:translation'
+SID_XPATH = '/*/*/xf:model/xf:instance/*/xf:visit/xf:sid'
+SID_SEARCH_XPATH = './/xf:instance//xf:visit/xf:sid'
+SiteJob = Tuple[str, ZipJob, Tuple[str, bytes]]
+CompressedFile = namedtuple('CompressedFile', ['zinfo', 'data'])
+SpooledFile = namedtuple('SpooledFile', ['zinfo', 'path'])
+RenderedImage = namedtuple('RenderedImage', ['path', 'digest', 'compressed'])
+LanguageSet = Tuple[ZipJob, str, Tuple[bytes, bytes]]
+FormEditions = Tuple['EditionDocument', Dict[TupleStr, LanguageSet]]
+MANIFEST_NAME = 'manifest.json'
+DEPLOYMENT_NAME = 'deployment.json'
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+FIXED_MTIME = 315532800
+FIXED_ATTRIBUTES = 0o100644 << 16
+DEFLATE_LEVEL = 6
+ZIP_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+ZIP_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+ZIP_END_RECORD = struct.Struct('<4s4H2LH')
+ZIP_LIMIT = 0xFFFFFFFF
+IMAGE_URI_PREFIX = 'jr://images/'
+
+
+class EditionOutput(abc.ABC):
+    """
+    Base for the writers of a site edition, skipping files already in it.
+
+    The names of the files already in the output are kept in a set, so the
+    duplicate check for each file is a set lookup. Writers for each output
+    format implement write and writestr, and the context manager methods.
+    A writer missing write or writestr can't be created.
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Parameters.
+        :param file_path: Path to the output to create or add to.
+        """
+        self.file_path = file_path
+        self.names = set()
+        self.digest = None
+
+    def _is_new(self, archive_file: str) -> bool:
+        """
+        Check if the archive path is not yet in the archive, and reserve it.
+
+        Parameters.
+        :param archive_file: Path of the file within the archive.
+        """
+        archive_norm = os.path.normpath(archive_file)
+        if archive_norm in self.names:
+            logger.warning("Skipped duplicating file: {0}".format(archive_norm))
+            return False
+        self.names.add(archive_norm)
+        return True
+
+    @abc.abstractmethod
+    def write(self, source_file: str, archive_file: str):
+        """
+        Add a file to the output, unless the archive path is already used.
+
+        Parameters.
+        :param source_file: Path to the file to add.
+        :param archive_file: Path of the file within the output.
+        """
+
+    @abc.abstractmethod
+    def writestr(self, archive_file: str, data: bytes):
+        """
+        Add data to the output, unless the archive path is already used.
+
+        Parameters.
+        :param archive_file: Path of the file within the output.
+        :param data: File content to add.
+        """
+
+    def write_compressed(self, compressed: Union[CompressedFile, SpooledFile]):
+        """
+        Add an already compressed file, unless the archive path is used.
+
+        Outputs that aren't zip files add the decompressed data.
+
+        Parameters.
+        :param compressed: Entry info and compressed data from
+            Editions._compress_file, or the SpooledFile it was written to.
+        """
+        if isinstance(compressed, SpooledFile):
+            compressed = Editions._read_spooled(compressed)
+        self.writestr(compressed.zinfo.filename,
+                      zlib.decompress(compressed.data, -15))
+
+    def _write_digest(self) -> Union[str, None]:
+        """
+        Write the SHA-256 digest of the archive to the "[archive].sha256" file.
+
+        :return: The digest, or None if there is no archive.
+        """
+        if not os.path.isfile(self.file_path):
+            return None
+        digest = Editions._hash_file(self.file_path)
+        digest_line = '{0}  {1}\n'.format(
+            digest, os.path.basename(self.file_path))
+        with open('{0}.sha256'.format(self.file_path), 'w',
+                  encoding='utf-8', newline='\n') as digest_file:
+            digest_file.write(digest_line)
+        return digest
+
+    def write_jobs(self, jobs: ZipJob, xform: Tuple[str, bytes]):
+        """
+        Add the files for a form's zip jobs, followed by the XForm.
+
+        Parameters.
+        :param jobs: Source and archive path pairs for the form's files, or
+            CompressedFile or SpooledFile entries.
+        :param xform: Archive path and content of the XForm.
+        """
+        for job in jobs:
+            if isinstance(job, (CompressedFile, SpooledFile)):
+                self.write_compressed(job)
+            else:
+                self.write(*job)
+        self.writestr(*xform)
+
+
+class EditionArchive(EditionOutput):
+    """
+    Writes a site edition zip archive, skipping files already in it.
+
+    The names of the files already in the archive, if any, are read from the
+    central directory into a set, so the duplicate check for each file is a
+    set lookup. Files added while the archive is open are kept by reference
+    (source path, spooled file, or data for the XForm) until it's closed, and
+    each file is only read when it's written. The entries are written in
+    order of their paths, with a fixed timestamp and attributes, and are
+    compressed with fixed settings, so the same content gives the same
+    archive bytes. Files that were compressed once for many sites are copied
+    into the archive as they are, with the CRC-32 and sizes from their entry
+    info, so they aren't compressed again for each site. See _write_zip. A
+    SHA-256 digest of the archive is written next to it, in a
+    "[archive].sha256" file in the format of sha256sum.
+
+    If the added files all sort after the files already in the archive, and
+    those were written the same way, the added files are appended. Otherwise
+    the archive is written again, with the existing files read one at a time,
+    to a temporary file which replaces it. Either way, the jobs for many forms
+    can be merged into one archive over many runs.
+
+    Usage:
+    with EditionArchive(file_path="61221.zip") as archive:
+        archive.write_jobs(jobs=jobs, xform=xform)
+    digest = archive.digest
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Parameters.
+        :param file_path: Path to the zip archive to create or add to.
+        """
+        super().__init__(file_path=file_path)
+        self.zip_file = None
+        self.entries = dict()
+
+    def __enter__(self):
+        self.entries = dict()
+        self.names = set()
+        if os.path.isfile(self.file_path):
+            self.zip_file = zipfile.ZipFile(file=self.file_path, mode="r")
+            self.names = {
+                os.path.normpath(x) for x in self.zip_file.namelist()}
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None and len(self.entries) > 0:
+                self._write_archive()
+        finally:
+            if self.zip_file is not None:
+                self.zip_file.close()
+                self.zip_file = None
+        if exc_type is None:
+            self.digest = self._write_digest()
+            self.entries = dict()
+
+    def write(self, source_file: str, archive_file: str):
+        """
+        Add a file to the archive, unless the archive path is already used.
+
+        Parameters.
+        :param source_file: Path to the file to add.
+        :param archive_file: Path of the file within the archive.
+        """
+        if self._is_new(archive_file):
+            self.entries[Editions._archive_name(archive_file)] = source_file
+
+    def writestr(self, archive_file: str, data: bytes):
+        """
+        Add data to the archive, unless the archive path is already used.
+
+        Parameters.
+        :param archive_file: Path of the file within the archive.
+        :param data: File content to add.
+        """
+        if self._is_new(archive_file):
+            self.entries[Editions._archive_name(archive_file)] = data
+
+    def write_compressed(self, compressed: Union[CompressedFile, SpooledFile]):
+        """
+        Add an already compressed file, unless the archive path is used.
+
+        The data of a SpooledFile is read when the archive is written.
+
+        Parameters.
+        :param compressed: Entry info and compressed data from
+            Editions._compress_file, or the SpooledFile it was written to.
+        """
+        if self._is_new(compressed.zinfo.filename):
+            self.entries[compressed.zinfo.filename] = compressed
+
+    def copy_from(self, zip_file: zipfile.ZipFile, zinfo: zipfile.ZipInfo):
+        """
+        Add a file from another zip file, unless the archive path is used.
+
+        The file is read from the zip file when the archive is written, so
+        the zip file must stay open until then.
+
+        Parameters.
+        :param zip_file: Zip file open for reading.
+        :param zinfo: Entry info from the zip file's central directory.
+        """
+        if self._is_new(zinfo.filename):
+            self.entries[zinfo.filename] = (zip_file, zinfo.filename)
+
+    @staticmethod
+    def _compressed_entry(archive_name: str, entry: object) -> CompressedFile:
+        """
+        Read an entry and get its compressed data, compressing it if needed.
+
+        Parameters.
+        :param archive_name: Path of the file within the archive.
+        :param entry: Source file path, data, CompressedFile, SpooledFile, or
+            (zip file, archive path) of a file in another zip file.
+        """
+        if isinstance(entry, SpooledFile):
+            return Editions._read_spooled(entry)
+        if isinstance(entry, CompressedFile):
+            return entry
+        if isinstance(entry, tuple):
+            data = entry[0].read(entry[1])
+        elif isinstance(entry, bytes):
+            data = entry
+        else:
+            with open(entry, 'rb') as source:
+                data = source.read()
+        return Editions._compress_data(archive_file=archive_name, data=data)
+
+    @staticmethod
+    def _encode_name(zinfo: zipfile.ZipInfo) -> Tuple[bytes, int]:
+        """
+        Encode the entry name, as ASCII if possible, otherwise as UTF-8.
+
+        Parameters.
+        :param zinfo: Entry info.
+        :return: The encoded name, and the general purpose flags for it.
+        """
+        try:
+            return zinfo.filename.encode('ascii'), zinfo.flag_bits
+        except UnicodeEncodeError:
+            return zinfo.filename.encode('utf-8'), zinfo.flag_bits | 0x800
+
+    @staticmethod
+    def _dos_date_time(zinfo: zipfile.ZipInfo) -> Tuple[int, int]:
+        """
+        Get the MS-DOS date and time of the entry.
+
+        Parameters.
+        :param zinfo: Entry info.
+        """
+        year, month, day, hours, minutes, seconds = zinfo.date_time
+        return (year - 1980) << 9 | month << 5 | day, \
+            hours << 11 | minutes << 5 | seconds // 2
+
+    @staticmethod
+    def _local_header(zinfo: zipfile.ZipInfo) -> bytes:
+        """
+        Make the local file header of an entry, as per the zip format.
+
+        Parameters.
+        :param zinfo: Entry info, with the CRC-32 and sizes.
+        """
+        name, flags = EditionArchive._encode_name(zinfo)
+        dos_date, dos_time = EditionArchive._dos_date_time(zinfo)
+        return ZIP_LOCAL_HEADER.pack(
+            b'PK\x03\x04', zinfo.extract_version, zinfo.reserved, flags,
+            zinfo.compress_type, dos_time, dos_date, zinfo.CRC,
+            zinfo.compress_size, zinfo.file_size, len(name), 0) + name
+
+    @staticmethod
+    def _central_header(zinfo: zipfile.ZipInfo, offset: int) -> bytes:
+        """
+        Make the central directory header of an entry, as per the zip format.
+
+        Parameters.
+        :param zinfo: Entry info, with the CRC-32 and sizes.
+        :param offset: Position of the entry's local file header.
+        """
+        name, flags = EditionArchive._encode_name(zinfo)
+        dos_date, dos_time = EditionArchive._dos_date_time(zinfo)
+        return ZIP_CENTRAL_HEADER.pack(
+            b'PK\x01\x02', zinfo.create_version, zinfo.create_system,
+            zinfo.extract_version, zinfo.reserved, flags,
+            zinfo.compress_type, dos_time, dos_date, zinfo.CRC,
+            zinfo.compress_size, zinfo.file_size, len(name),
+            len(zinfo.extra), len(zinfo.comment), 0, zinfo.internal_attr,
+            zinfo.external_attr, offset) + name + zinfo.extra + zinfo.comment
+
+    @staticmethod
+    def _write_zip(zip_out: io.BufferedWriter,
+                   entries: Iterable[Tuple[str, object]],
+                   existing: List[zipfile.ZipInfo]=()):
+        """
+        Write the entries and the central directory to an open zip file.
+
+        Each entry's compressed data is copied as is after its local header,
+        so the data compressed once for many sites is not compressed again.
+        The zip64 extensions aren't written, so a zip file too large for them
+        raises zipfile.LargeZipFile.
+
+        Parameters.
+        :param zip_out: File to write to, positioned where the first entry
+            is written.
+        :param entries: Archive path and entry, as per _compressed_entry.
+        :param existing: Entry info of the files already in the zip file,
+            before the position, for the central directory.
+        """
+        central = [EditionArchive._central_header(x, x.header_offset)
+                   for x in existing]
+        for archive_name, entry in entries:
+            compressed = EditionArchive._compressed_entry(
+                archive_name=archive_name, entry=entry)
+            offset = zip_out.tell()
+            zinfo = compressed.zinfo
+            if max(offset, zinfo.compress_size, zinfo.file_size) > ZIP_LIMIT:
+                raise zipfile.LargeZipFile(
+                    "Zip file too large: {0}".format(archive_name))
+            zip_out.write(EditionArchive._local_header(zinfo))
+            zip_out.write(compressed.data)
+            central.append(EditionArchive._central_header(zinfo, offset))
+        central_offset = zip_out.tell()
+        for header in central:
+            zip_out.write(header)
+        central_size = zip_out.tell() - central_offset
+        if len(central) > 0xFFFF or central_offset > ZIP_LIMIT:
+            raise zipfile.LargeZipFile("Too many files in the zip file.")
+        zip_out.write(ZIP_END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, len(central), len(central), central_size,
+            central_offset, 0))
+
+    @staticmethod
+    def _entries_end(zip_path: str, zinfo: zipfile.ZipInfo) -> int:
+        """
+        Get the position after an entry's data, from its local file header.
+
+        Parameters.
+        :param zip_path: Path to the zip file.
+        :param zinfo: Entry info from the zip file's central directory.
+        """
+        with open(zip_path, 'rb') as zip_file:
+            zip_file.seek(zinfo.header_offset)
+            header = ZIP_LOCAL_HEADER.unpack(
+                zip_file.read(ZIP_LOCAL_HEADER.size))
+        return zinfo.header_offset + ZIP_LOCAL_HEADER.size + header[-2] + \
+            header[-1] + zinfo.compress_size
+
+    def _can_append(self) -> bool:
+        """
+        Check if the added files can be appended to the existing archive.
+
+        This is the case if the existing entries are in order and have the
+        fixed metadata, and the added files all sort after them, so that
+        appending gives the same bytes as writing the archive again.
+        """
+        if self.zip_file is None or len(self.zip_file.comment) > 0:
+            return False
+        existing = self.zip_file.infolist()
+        names = [x.filename for x in existing]
+        if len(names) == 0 or names != sorted(names) or \
+                min(self.entries) <= names[-1]:
+            return False
+        return all(x.date_time == FIXED_DATE_TIME and
+                   x.external_attr == FIXED_ATTRIBUTES and
+                   x.create_system == 3 and
+                   x.compress_type == zipfile.ZIP_DEFLATED and
+                   x.flag_bits & 0x08 == 0 and
+                   len(x.extra) == 0 and len(x.comment) == 0
+                   for x in existing)
+
+    def _write_archive(self):
+        """
+        Write the added files, in order, appending to or replacing the archive.
+        """
+        if self._can_append():
+            existing = self.zip_file.infolist()
+            self.zip_file.close()
+            self.zip_file = None
+            with open(self.file_path, 'r+b') as zip_out:
+                zip_out.seek(EditionArchive._entries_end(
+                    zip_path=self.file_path, zinfo=existing[-1]))
+                EditionArchive._write_zip(
+                    zip_out=zip_out, existing=existing,
+                    entries=((x, self.entries[x])
+                             for x in sorted(self.entries)))
+                zip_out.truncate()
+            return
+        existing = set()
+        if self.zip_file is not None:
+            existing = set(self.zip_file.namelist())
+        temp_path = '{0}.{1}.tmp'.format(self.file_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as zip_out:
+                EditionArchive._write_zip(
+                    zip_out=zip_out,
+                    entries=((x, self.entries.get(x, (self.zip_file, x)))
+                             for x in sorted(existing.union(self.entries))))
+            if self.zip_file is not None:
+                self.zip_file.close()
+                self.zip_file = None
+            os.replace(temp_path, self.file_path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+
+class EditionTar(EditionOutput):
+    """
+    Writes a site edition as an uncompressed tar archive.
+
+    Like EditionArchive, the files added while the archive is open are kept
+    until it's closed, then all files are written in order of their paths,
+    with fixed timestamps, owners and permissions, to a temporary file which
+    replaces the archive. Only the paths and XForm content are kept; the
+    media files are read from their source files as they are written. A
+    SHA-256 digest is written next to the archive.
+
+    Usage:
+    with EditionTar(file_path="61221.tar") as archive:
+        archive.write_jobs(jobs=jobs, xform=xform)
+    """
+
+    def __init__(self, file_path: str):
+        """
+        Parameters.
+        :param file_path: Path to the tar archive to create or add to.
+        """
+        super().__init__(file_path=file_path)
+        self.tar_file = None
+        self.entries = dict()
+
+    def __enter__(self):
+        self.entries = dict()
+        self.names = set()
+        if os.path.isfile(self.file_path):
+            self.tar_file = tarfile.open(name=self.file_path, mode="r")
+            self.names = {
+                os.path.normpath(x) for x in self.tar_file.getnames()}
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None and len(self.entries) > 0:
+                self._write_archive()
+        finally:
+            if self.tar_file is not None:
+                self.tar_file.close()
+                self.tar_file = None
+        if exc_type is None:
+            self.digest = self._write_digest()
+            self.entries = dict()
+
+    def write(self, source_file: str, archive_file: str):
+        if self._is_new(archive_file):
+            self.entries[Editions._archive_name(archive_file)] = \
+                (source_file, None)
+
+    def writestr(self, archive_file: str, data: bytes):
+        if self._is_new(archive_file):
+            self.entries[Editions._archive_name(archive_file)] = (None, data)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _tar_header(archive_name: str, size: int) -> bytes:
+        """
+        Create the member header for a file, with fixed metadata.
+
+        Building a header in tarfile is slow compared to writing the file,
+        and the same media file is in many site archives, so the headers are
+        kept for re-use.
+
+        Parameters.
+        :param archive_name: Path of the file within the archive.
+        :param size: Size of the file.
+        """
+        tarinfo = tarfile.TarInfo(name=archive_name)
+        tarinfo.size = size
+        tarinfo.mtime = FIXED_MTIME
+        tarinfo.mode = 0o644
+        return tarinfo.tobuf(
+            format=tarfile.PAX_FORMAT, encoding='utf-8',
+            errors='surrogateescape')
+
+    @staticmethod
+    def _write_member(tar_out: io.BufferedWriter, archive_name: str,
+                      source: io.BufferedIOBase, size: int):
+        """
+        Write a member header and the file data, padded to a whole block.
+
+        Parameters.
+        :param tar_out: File to write to.
+        :param archive_name: Path of the file within the archive.
+        :param source: File to copy the data from.
+        :param size: Size of the file.
+        """
+        tar_out.write(EditionTar._tar_header(archive_name, size))
+        shutil.copyfileobj(source, tar_out)
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder > 0:
+            tar_out.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def _write_archive(self):
+        """
+        Write the existing and added files, in order, to replace the archive.
+
+        The archive is written the same way as by tarfile, with two zero
+        blocks at the end, padded to a whole record.
+        """
+        existing = dict()
+        if self.tar_file is not None:
+            existing = {x.name: x for x in self.tar_file.getmembers()
+                        if x.isfile()}
+        temp_path = '{0}.{1}.tmp'.format(self.file_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as tar_out:
+                for name in sorted(set(existing).union(self.entries)):
+                    if name in self.entries:
+                        source_file, data = self.entries[name]
+                    else:
+                        source_file, data = None, self.tar_file.extractfile(
+                            existing[name]).read()
+                    if source_file is None:
+                        EditionTar._write_member(
+                            tar_out, name, io.BytesIO(data), len(data))
+                        continue
+                    with open(source_file, 'rb') as source:
+                        EditionTar._write_member(
+                            tar_out, name, source,
+                            os.fstat(source.fileno()).st_size)
+                tar_out.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+                remainder = tar_out.tell() % tarfile.RECORDSIZE
+                if remainder > 0:
+                    tar_out.write(
+                        tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+            if self.tar_file is not None:
+                self.tar_file.close()
+                self.tar_file = None
+            os.replace(temp_path, self.file_path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+
+class EditionDirectory(EditionOutput):
+    """
+    Writes a site edition as a folder of files, ready to copy to a device.
+
+    Media files are hard linked to their source files where possible, so
+    that no data is copied, and are copied if the link can't be made (for
+    example if the folders are on different drives). The images script
+    replaces a hard linked file rather than writing into it, which breaks
+    the link, so the edition folders keep the old images until they are
+    written again, e.g. with a rebuild. The SHA-256 digests of the files are
+    written next to the folder. See _write_digest.
+
+    Usage:
+    with EditionDirectory(file_path="editions/61221") as folder:
+        folder.write_jobs(jobs=jobs, xform=xform)
+    """
+
+    def __enter__(self):
+        self.names = set()
+        for base, dirs, files in os.walk(self.file_path):
+            for file in files:
+                self.names.add(os.path.normpath(os.path.relpath(
+                    os.path.join(base, file), self.file_path)))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.digest = self._write_digest()
+
+    def _write_digest(self) -> Union[str, None]:
+        """
+        Write the SHA-256 digest of each file to the "[folder].sha256" file.
+
+        The lines are in the format of sha256sum, in order of the file paths
+        relative to the folder, so the folder can be checked by running
+        "sha256sum -c" in it. The digest of the folder is the digest of the
+        lines, so it only depends on the paths and content of the files.
+
+        :return: The digest, or None if there is no folder.
+        """
+        if not os.path.isdir(self.file_path):
+            return None
+        files = list()
+        for base, dirs, file_names in os.walk(self.file_path):
+            for file_name in file_names:
+                file_path = os.path.join(base, file_name)
+                files.append((os.path.relpath(file_path, self.file_path)
+                              .replace(os.sep, '/'), file_path))
+        digest_lines = ''.join(
+            '{0}  {1}\n'.format(Editions._hash_file(file_path), name)
+            for name, file_path in sorted(files))
+        with open('{0}.sha256'.format(self.file_path), 'w',
+                  encoding='utf-8', newline='\n') as digest_file:
+            digest_file.write(digest_lines)
+        return hashlib.sha256(digest_lines.encode('utf-8')).hexdigest()
+
+    def _output_path(self, archive_file: str) -> str:
+        """
+        Get the path to write a file to, creating its folder if needed.
+
+        Parameters.
+        :param archive_file: Path of the file within the output folder.
+        """
+        output_path = os.path.join(
+            self.file_path, *Editions._archive_name(archive_file).split('/'))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        return output_path
+
+    def write(self, source_file: str, archive_file: str):
+        if self._is_new(archive_file):
+            output_path = self._output_path(archive_file)
+            try:
+                os.link(source_file, output_path)
+            except OSError:
+                shutil.copyfile(source_file, output_path)
+
+    def writestr(self, archive_file: str, data: bytes):
+        if self._is_new(archive_file):
+            with open(self._output_path(archive_file), 'wb') as output:
+                output.write(data)
+
+
+OUTPUT_FORMATS = OrderedDict((
+    ('zip', (EditionArchive, '.zip')), ('tar', (EditionTar, '.tar')),
+    ('directory', (EditionDirectory, ''))))
+
+
+class EditionDocument:
+    """
+    A parsed XForm, pre-serialized as a template for the site editions.
+
+    Site editions only differ in which translations are kept, which of them
+    is marked as the default, and the SID default value. So the document is
+    serialized once with marker comments around each translation and a
+    placeholder in the SID, and split into the parts that are the same for
+    every site, the bytes of each translation (with and without the default
+    attribute), and the SID. Each site edition is then a join of those parts.
+
+    Usage:
+    document = EditionDocument(document=etree.parse("Q1309_BEHAVE.xml"))
+    xform = document.serialize(site_code="61221", languages=("english",))
+    """
+
+    def __init__(self, document: ETree):
+        """
+        Parameters.
+        :param document: Parsed XForm.
+        """
+        self.document = document
+        self.namespaces = Editions._map_xf_to_xform_namespace(document)
+        self.translations = Editions._find_translations(
+            document, self.namespaces)
+        self.sid = Editions._find_sid(document, self.namespaces)
+        self.languages = [t.attrib['lang'] for t in self.translations]
+        self.has_sid = len(self.sid) == 1
+        self.sid_text = self.sid[0].text if self.has_sid else None
+        self.segments = self._build_template()
+
+    def _build_template(self) -> List[Tuple[str, object]]:
+        """
+        Split the serialized document into invariant and per-site segments.
+
+        The document is left unchanged afterwards.
+
+        :return: Segments of (kind, value), where the kind is "bytes" for
+            invariant bytes, "translation" for the (without default, with
+            default) bytes of a translation, or "sid" for the SID text.
+        """
+        token = 'edition-{0}'.format(uuid.uuid4().hex)
+        markers = list()
+        for index, translation in enumerate(self.translations):
+            parent = translation.getparent()
+            start = etree.Comment('{0}-start-{1}'.format(token, index))
+            end = etree.Comment('{0}-end-{1}'.format(token, index))
+            parent.insert(parent.index(translation), start)
+            parent.insert(parent.index(translation) + 1, end)
+            markers.extend((start, end))
+        attributes = [(t, t.items()) for t in self.translations]
+        if self.has_sid:
+            self.sid[0].text = token
+        try:
+            for translation in self.translations:
+                translation.attrib['default'] = 'true()'
+            with_default = etree.tostring(self.document)
+            for translation in self.translations:
+                del translation.attrib['default']
+            without_default = etree.tostring(self.document)
+        finally:
+            for marker in markers:
+                marker.getparent().remove(marker)
+            for translation, items in attributes:
+                translation.attrib.clear()
+                translation.attrib.update(items)
+            if self.has_sid:
+                self.sid[0].text = self.sid_text
+
+        segments = list()
+        position = 0
+        with_position = 0
+        for index in range(len(self.translations)):
+            start = '<!--{0}-start-{1}-->'.format(token, index).encode()
+            end = '<!--{0}-end-{1}-->'.format(token, index).encode()
+            start_at = without_default.index(start, position)
+            end_at = without_default.index(end, start_at)
+            with_start_at = with_default.index(start, with_position)
+            with_end_at = with_default.index(end, with_start_at)
+            segments.append(('bytes', without_default[position:start_at]))
+            segments.append(('translation', (
+                without_default[start_at + len(start):end_at],
+                with_default[with_start_at + len(start):with_end_at])))
+            position = end_at + len(end)
+            with_position = with_end_at + len(end)
+        segments.append(('bytes', without_default[position:]))
+
+        token_bytes = token.encode()
+        template = list()
+        for kind, value in segments:
+            if kind == 'bytes' and token_bytes in value:
+                before, after = value.split(token_bytes, 1)
+                template.extend(
+                    (('bytes', before), ('sid', None), ('bytes', after)))
+            else:
+                template.append((kind, value))
+        return template
+
+    @staticmethod
+    def _escape_text(text: str) -> bytes:
+        """
+        Serialize element text the same way as etree.tostring does.
+
+        Parameters.
+        :param text: Text to serialize.
+        """
+        element = etree.Element('sid')
+        element.text = text
+        return etree.tostring(element)[len(b'<sid>'):-len(b'</sid>')]
+
+    def split_edition(self, languages: TupleStr) -> Tuple[bytes, bytes]:
+        """
+        Join the parts of the edition for the languages, except for the SID.
+
+        Parameters.
+        :param languages: Languages to keep, with the first as the default.
+        :return: The edition bytes before and after the SID text. If the
+            XForm has no SID, the first is the whole edition and the second
+            is empty.
+        """
+        parts = [list(), list()]
+        current = parts[0]
+        translation_index = 0
+        for kind, value in self.segments:
+            if kind == 'bytes':
+                current.append(value)
+            elif kind == 'sid':
+                current = parts[1]
+            else:
+                language = self.languages[translation_index]
+                translation_index += 1
+                if language in languages:
+                    current.append(value[language == languages[0]])
+        return b''.join(parts[0]), b''.join(parts[1])
+
+    def serialize_split(self, site_code: str, edition: Tuple[bytes, bytes]
+                        ) -> bytes:
+        """
+        Serialize the edition of the XForm for a site, from split_edition.
+
+        Parameters.
+        :param site_code: Site code to add to the SID.
+        :param edition: Output of split_edition for the site's languages.
+        """
+        Editions._log_sid(site_code, len(self.sid), self.has_sid)
+        if not self.has_sid:
+            return edition[0]
+        sid = EditionDocument._escape_text(
+            '{0}{1}-'.format(self.sid_text, site_code))
+        return b''.join((edition[0], sid, edition[1]))
+
+    def serialize(self, site_code: str, languages: TupleStr) -> bytes:
+        """
+        Serialize the edition of the XForm for a site.
+
+        Parameters.
+        :param site_code: Site code to add to the SID.
+        :param languages: Languages to keep, with the first as the default.
+        """
+        return self.serialize_split(
+            site_code=site_code, edition=self.split_edition(languages))
 
 
 class Editions:
 
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _compile_xpath(path: str, namespaces: Tuple[Tuple[str, str], ...]
+                       ) -> 'etree.XPath':
+        """
+        Compile an XPath query, reusing it for documents with the same map.
+
+        Parameters.
+        :param path: XPath query.
+        :param namespaces: Sorted (prefix, URI) pairs used in the query.
+        """
+        return etree.XPath(path, namespaces=dict(namespaces))
+
+    @staticmethod
+    def _xpath(document: ETree, path: str, namespaces: Dict[str, str]
+               ) -> List[Element]:
+        """
+        Evaluate a compiled XPath query against the document root.
+
+        Parameters.
+        :param document: Document to query.
+        :param path: XPath query.
+        :param namespaces: Namespaces in the document.
+        """
+        query = Editions._compile_xpath(path, tuple(sorted(namespaces.items())))
+        return query(document.getroot())
+
+    @staticmethod
+    def _find_translations(document: ETree, namespaces: Dict[str, str]
+                           ) -> List[Element]:
+        """
+        Find the itext translation elements, which are children of the model.
+
+        Parameters.
+        :param document: Document to search.
+        :param namespaces: Namespaces in the document.
+        """
+        return Editions._xpath(document, TRANSLATION_XPATH, namespaces)
+
+    @staticmethod
+    def _find_sid(document: ETree, namespaces: Dict[str, str]
+                  ) -> List[Element]:
+        """
+        Find the SID element in the visit group of the primary instance.
+
+        The visit group is usually a direct child of the instance root, so
+        that path is checked first, before searching the whole instance.
+
+        Parameters.
+        :param document: Document to search.
+        :param namespaces: Namespaces in the document.
+        """
+        sid = Editions._xpath(document, SID_XPATH, namespaces)
+        if len(sid) == 0:
+            sid = Editions._xpath(document, SID_SEARCH_XPATH, namespaces)
+        return sid
+
     @staticmethod
     def _map_xf_to_xform_namespace(document: ETree) -> Dict[str, str]:
         """
@@ -23,137 +913,412 @@ class Editions:
         Parameters
         :param document: Document to read namespaces from.
         """
-        root_element = document.getroot()
-        namespaces = {k: v for k, v in root_element.nsmap.items() if k}
-        namespaces['xf'] = root_element.nsmap[None]
-        return namespaces
+        root_element = document.getroot()
+        namespaces = {k: v for k, v in root_element.nsmap.items() if k}
+        namespaces['xf'] = root_element.nsmap[None]
+        return namespaces
+
+    @staticmethod
+    def _update_xform_languages(
+            document: ETree, namespaces: Dict[str, str], languages: TupleStr,
+            translations: List[Element]=None) -> ETree:
+        """
+        Remove translations that are not listed, and mark the first as default.
+
+        Parameters
+        :param document: Document to remove from.
+        :param namespaces: Namespaces in the document.
+        :param languages: Languages to keep.
+        :param translations: Translation elements, if already found.
+        """
+        if translations is None:
+            translations = Editions._find_translations(document, namespaces)
+        for t in translations:
+            if t.attrib['lang'] not in languages:
+                t.getparent().remove(t)
+
+            if t.attrib['lang'] == languages[0]:
+                t.attrib['default'] = 'true()'
+            else:
+                if 'default' in t.attrib:
+                    del t.attrib['default']
+        return document
+
+    @staticmethod
+    def _add_site_to_default_sid(
+            document: ETree, namespaces: Dict[str, str], site_code: str,
+            sid: List[Element]=None) -> ETree:
+        """
+        Find the SID form element and append the site code to the default value.
+
+        Parameters.
+        :param document: Document to update.
+        :param namespaces: Namespaces in the document.
+        :param site_code: Site code to add.
+        :param sid: SID elements, if already found.
+        """
+        if sid is None:
+            sid = Editions._find_sid(document, namespaces)
+        results = len(sid)
+        appended = False
+        if results == 1:
+            sid[0].text = '{0}{1}-'.format(sid[0].text, site_code)
+            appended = True
+        Editions._log_sid(site_code, results, appended)
+        return document
+
+    @staticmethod
+    def _log_sid(site_code: str, results: int, appended: bool):
+        """
+        Log the outcome of adding the site code to the SID, for user info.
+
+        Parameters.
+        :param site_code: Site code added.
+        :param results: Number of SID elements found.
+        :param appended: True if the site code was added.
+        """
+        log_msg = 'Add to sid. Site code: {0}, SIDs found: {1}, Appended: {2}'
+        logger.info(log_msg.format(site_code, results, appended))
+
+    @staticmethod
+    def _read_site_languages(file_path: str) -> Dict[str, TupleStr]:
+        """
+        Read the list of sites and required languages from an XLSX file.
+
+        - Look in the first sheet of the workbook.
+        - First column is a '/' separated list of languages for the site.
+        - Third column is the site code.
+
+        Parameters.
+        :params file_path: Path to site languages spreadsheet.
+        """
+        workbook = xlrd.open_workbook(filename=file_path)
+        sheet = workbook.sheet_by_index(0)
+        site_settings = dict()
+        for row in sheet._cell_values[1:]:
+            languages = tuple(x.strip() for x in row[0].lower().split('/'))
+            site_code = str(int(row[2]))
+            site_settings[site_code] = languages
+        return site_settings
+
+    @staticmethod
+    def _run_zip_jobs(output_path: str, zip_jobs: Iterable[SiteJob],
+                      output_format: str='zip') -> Dict[str, str]:
+        """
+        Execute the provided zip jobs by creating and populating a zip file.
+
+        The jobs are written as they are taken from the iterable, so they can
+        be generated one at a time. Consecutive jobs for the same site are
+        written in one open of the site's archive, so the jobs for all forms
+        for a site should be together, as from _iter_site_jobs. If a site's
+        jobs are not together, the archive is opened again to append to it.
+
+        :param output_path: Path to write the site zip files to.
+        :param zip_jobs: Zip jobs to execute.
+        :param output_format: One of OUTPUT_FORMATS. If not "zip", the site
+            files are written to a tar file or folder instead.
+        :return: The SHA-256 digest of each site's zip file, by site code.
+        """
+        os.makedirs(output_path, exist_ok=True)
+        writer = OUTPUT_FORMATS[output_format][0]
+        digests = dict()
+        site_jobs = itertools.groupby(zip_jobs, key=lambda x: x[0])
+        for site_code, form_jobs in site_jobs:
+            zip_name = Editions._site_output_path(
+                output_path=output_path, site_code=site_code,
+                output_format=output_format)
+            with writer(file_path=zip_name) as archive:
+                for _, jobs, xform in form_jobs:
+                    archive.write_jobs(jobs=jobs, xform=xform)
+            digests[site_code] = archive.digest
+            logger.info('Wrote site archive: {0}, sha256: {1}'.format(
+                zip_name, archive.digest))
+        return digests
+
+    @staticmethod
+    def _site_output_path(output_path: str, site_code: str,
+                          output_format: str='zip') -> str:
+        """
+        Get the path of a site's zip file, tar file or folder.
+
+        Parameters.
+        :param output_path: Path the site outputs are written to.
+        :param site_code: Site code.
+        :param output_format: One of OUTPUT_FORMATS.
+        """
+        return os.path.join(output_path, "{0}{1}".format(
+            site_code, OUTPUT_FORMATS[output_format][1]))
+
+    @staticmethod
+    def _scan_media(source_path: str) -> ZipJob:
+        """
+        Prepare path (to, from) pairs for all files in the media folder.
+
+        Parameters.
+        :param source_path: Path to copy files from.
+        """
+        media = []
+        source_parent = os.path.dirname(source_path)
+        for base, dirs, files in os.walk(source_path):
+            for file in files:
+                file_path = os.path.join(base, file)
+                arch_path = os.path.relpath(file_path, source_parent)
+                media.append((file_path, arch_path))
+        return media
+
+    @staticmethod
+    def _filter_media(media: ZipJob, languages: TupleStr) -> ZipJob:
+        """
+        Filter the media path pairs to files named for any of the languages.
+
+        The archive path is checked rather than the source path, since the
+        source of a rendered image may be a spooled file with another name.
+
+        Parameters.
+        :param media: Path pairs from _scan_media.
+        :param languages: Languages to filter the files lists for.
+        """
+        zip_jobs = []
+        for file_path, arch_path in media:
+            file_name = os.path.splitext(os.path.basename(arch_path))[0]
+            if any(file_name.endswith(lang) for lang in languages):
+                zip_jobs.append((file_path, arch_path))
+        return zip_jobs
+
+    @staticmethod
+    def _prepare_zip_jobs(source_path: str, languages: TupleStr) -> ZipJob:
+        """
+        Prepare path (to, from) pairs for use in ZipFile write job.
+
+        Parameters.
+        :param source_path: Path to copy files from.
+        :param languages: Languages to filter the files lists for.
+        """
+        return Editions._filter_media(
+            media=Editions._scan_media(source_path), languages=languages)
+
+    @staticmethod
+    def _media_path(xform_path: str) -> str:
+        """
+        Get the path of the "[xform]-media" folder next to the XForm.
+
+        Parameters.
+        :param xform_path: Path to xform being processed.
+        """
+        xform_name = os.path.splitext(os.path.basename(xform_path))[0]
+        return os.path.join(
+            os.path.dirname(xform_path), '{0}-media'.format(xform_name))
+
+    @staticmethod
+    def _scan_form_media(xform_path: str,
+                         rendered: Dict[str, RenderedImage]=None) -> ZipJob:
+        """
+        List the XForm's media files, including rendered images.
+
+        Rendered images are read from where they were written, in place of a
+        file of the same name in the media folder. Rendered images that are
+        not in the media folder are added after the files found there.
+
+        Parameters.
+        :param xform_path: Path to xform being processed.
+        :param rendered: Output of _render_images.
+        """
+        media_path = Editions._media_path(xform_path)
+        media = Editions._scan_media(source_path=media_path)
+        if rendered:
+            source_parent = os.path.dirname(xform_path)
+            scanned = set(x[0] for x in media)
+            media = [(rendered[x].path if x in rendered else x, y)
+                     for x, y in media]
+            media.extend(
+                (y.path, os.path.relpath(x, source_parent))
+                for x, y in rendered.items()
+                if os.path.dirname(x) == media_path and x not in scanned)
+        return media
 
     @staticmethod
-    def _update_xform_languages(document: ETree, namespaces: Dict[str, str],
-                                languages: TupleStr) -> ETree:
+    def _prepare_form(xform_path: str, rendered: Dict[str, RenderedImage]=None
+                      ) -> Tuple[EditionDocument, ZipJob]:
         """
-        Remove translations that are not listed, and mark the first as default.
+        Parse the XForm and list its media files, for use by each site.
 
-        Parameters
-        :param document: Document to remove from.
-        :param namespaces: Namespaces in the document.
-        :param languages: Languages to keep.
+        Parameters.
+        :param xform_path: Path to xform being processed.
+        :param rendered: Output of _render_images.
         """
-        translations = document.getroot().xpath(
-            './/xf:translation', namespaces=namespaces)
-        for t in translations:
-            if t.attrib['lang'] not in languages:
-                t.getparent().remove(t)
-
-            if t.attrib['lang'] == languages[0]:
-                t.attrib['default'] = 'true()'
-            else:
-                if 'default' in t.attrib:
-                    del t.attrib['default']
-        return document
+        media = Editions._scan_form_media(
+            xform_path=xform_path, rendered=rendered)
+        document = etree.parse(xform_path)
+        Editions._update_image_references(document=document, media=media)
+        return EditionDocument(document=document), media
 
     @staticmethod
-    def _add_site_to_default_sid(document: ETree, namespaces: Dict[str, str],
-                                 site_code: str) -> ETree:
+    def _prepare_forms(xform_paths: List[str],
+                       rendered: Dict[str, RenderedImage]=None
+                       ) -> Dict[str, Tuple[EditionDocument, ZipJob]]:
         """
-        Find the SID form element and append the site code to the default value.
+        Prepare the XForms concurrently, as per _prepare_form.
 
         Parameters.
-        :param document: Document to update.
-        :param namespaces: Namespaces in the document.
-        :param site_code: Site code to add.
+        :param xform_paths: Paths to the XForms.
+        :param rendered: Output of _render_images.
+        :return: Output of _prepare_form, by XForm path.
         """
-        sid_xpath = './/xf:instance//xf:visit/xf:sid'
-        sid = document.getroot().xpath(sid_xpath, namespaces=namespaces)
-        results = len(sid)
-        log_msg = 'Add to sid. Site code: {0}, SIDs found: {1}, Appended: {2}'
-        appended = False
-        if results == 1:
-            sid[0].text = '{0}{1}-'.format(sid[0].text, site_code)
-            appended = True
-        logger.info(log_msg.format(site_code, results, appended))
-        return document
+        max_workers = min(len(xform_paths), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            forms = executor.map(lambda x: Editions._prepare_form(
+                xform_path=x, rendered=rendered), xform_paths)
+            return OrderedDict(zip(xform_paths, forms))
 
     @staticmethod
-    def _read_site_languages(file_path: str) -> Dict[str, TupleStr]:
+    def _update_image_references(document: ETree, media: ZipJob) -> int:
         """
-        Read the list of sites and required languages from an XLSX file.
+        Point image references to media files written in another image format.
 
-        - Look in the first sheet of the workbook.
-        - First column is a '/' separated list of languages for the site.
-        - Third column is the site code.
+        If a "jr://images/" reference is to a file that isn't in the media
+        folder, but there is a file with the same name and the extension of
+        another image format, such as "q1_english.webp" instead of
+        "q1_english.png", the reference is changed to that file. The image
+        formats are only looked up if there are references to missing files.
 
         Parameters.
-        :params file_path: Path to site languages spreadsheet.
+        :param document: Parsed XForm, which is updated in place.
+        :param media: Path pairs from _scan_form_media.
+        :return: Number of references changed.
         """
-        workbook = open_workbook(filename=file_path)
-        sheet = workbook.sheet_by_index(0)
-        site_settings = dict()
-        for row in sheet._cell_values[1:]:
-            languages = tuple(x.strip() for x in row[0].lower().split('/'))
-            site_code = str(int(row[2]))
-            site_settings[site_code] = languages
-        return site_settings
+        media_names = set(os.path.basename(x[1]) for x in media)
+        missing = [x for x in document.iter()
+                   if isinstance(x.text, str) and
+                   x.text.startswith(IMAGE_URI_PREFIX) and
+                   x.text[len(IMAGE_URI_PREFIX):] not in media_names]
+        if len(missing) == 0:
+            return 0
+        extensions = set(images.IMAGE_FORMATS.values())
+        image_names = dict()
+        for name in sorted(media_names):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in extensions:
+                image_names.setdefault(stem, name)
+        updated = 0
+        for node in missing:
+            name = node.text[len(IMAGE_URI_PREFIX):]
+            image_name = image_names.get(os.path.splitext(name)[0])
+            if image_name is not None:
+                node.text = IMAGE_URI_PREFIX + image_name
+                updated += 1
+        if updated > 0:
+            logger.info('Updated {0} image references to the media '
+                        'files.'.format(updated))
+        return updated
 
     @staticmethod
-    def _run_zip_jobs(output_path: str,
-                      zip_jobs: List[Tuple[str, ZipJob, Tuple[str, str]]]):
+    def _render_images(xform_paths: List[str], xlsform_paths: List[str],
+                       spool_path: str, write_media: bool=False,
+                       compress: bool=True) -> Dict[str, RenderedImage]:
         """
-        Execute the provided zip jobs by creating and populating a zip file.
+        Render the question images of each XLSForm, for the matching XForm.
 
-        :param zip_jobs: Zip jobs to execute.
+        Each XLSForm is matched to the XForm with the same file name, and the
+        images are named for that XForm's media folder. Each image is rendered
+        once, and is then used by the language sets that include it in place
+        of a file of the same name in the media folder.
+
+        Each image is written out as it is encoded, and only its path and
+        digest are kept, so memory use doesn't grow with the number of
+        images. For zip files, each image is compressed in memory and only
+        the compressed entry is written to the spool folder, for the site
+        writers to add. For other outputs, the image is written to the
+        spool folder, and added the same way as the other media files. If
+        write_media is True, the images are also saved to the media folder,
+        and the images of any output profiles are saved with them; otherwise
+        the profile images aren't rendered, since they aren't in the editions.
+
+        Parameters.
+        :param xform_paths: Paths to the XForms.
+        :param xlsform_paths: Paths to the XLSForms to render images for.
+        :param spool_path: Path to a temporary folder to write the images to,
+            in a "[xform]-media" folder, if they are not saved to the media
+            folder.
+        :param write_media: If True, the images are saved to the media folder.
+        :param compress: If True, the images are compressed for zip files.
+        :return: The path the image data (or compressed data) was written to,
+            its SHA-256 digest, and the SpooledFile if it was compressed, by
+            image path.
         """
-        compress = zipfile.ZIP_DEFLATED
-        os.makedirs(output_path, exist_ok=True)
-        dupe_msg = "Skipped duplicating file: {0}"
-        for site_code, jobs, xform in zip_jobs:
-            zip_name = os.path.join(output_path, "{0}.zip".format(site_code))
-            existing_zip_items = list()
-            if os.path.isfile(zip_name):
-                with zipfile.ZipFile(file=zip_name, mode="r") as existing_zip:
-                    for zip_item in existing_zip.namelist():
-                        existing_zip_items.append(os.path.normpath(zip_item))
-            with zipfile.ZipFile(
-                    file=zip_name, mode="a", compression=compress) as zip_file:
-                for source_file, archive_file in jobs:
-                    archive_norm = os.path.normpath(archive_file)
-                    if archive_norm in existing_zip_items:
-                        logger.warning(dupe_msg.format(archive_norm))
-                    else:
-                        zip_file.write(source_file, archive_file)
-                xform_filename, xform_data = xform
-                xform_norm = os.path.normpath(xform_filename)
-                if xform_norm in existing_zip_items:
-                    logger.warning(dupe_msg.format(xform_norm))
-                else:
-                    zip_file.writestr(*xform)
+        xforms = {os.path.splitext(os.path.basename(x))[0]: x
+                  for x in xform_paths}
+        rendered = OrderedDict()
+        for xlsform_path in xlsform_paths:
+            xform_path = xforms[os.path.splitext(
+                os.path.basename(xlsform_path))[0]]
+            media_path = Editions._media_path(xform_path)
+            form_spool = os.path.join(
+                spool_path, os.path.basename(media_path))
+            os.makedirs(form_spool, exist_ok=True)
+            count = len(rendered)
+            for image_path, data in images.render_images(
+                    xlsform_path=xlsform_path, output_path=media_path,
+                    write_media=write_media, profiles=write_media):
+                if os.path.dirname(image_path) != media_path:
+                    continue
+                source_file = image_path
+                spooled = None
+                if compress:
+                    spooled = Editions._spool_compressed(
+                        compressed=Editions._compress_data(
+                            archive_file=os.path.relpath(
+                                image_path, os.path.dirname(xform_path)),
+                            data=data),
+                        spool_path=form_spool)
+                    if not write_media:
+                        source_file = spooled.path
+                elif not write_media:
+                    source_file = os.path.join(
+                        form_spool, os.path.basename(image_path))
+                    with open(source_file, 'wb') as spool_file:
+                        spool_file.write(data)
+                rendered[image_path] = RenderedImage(
+                    path=source_file, digest=hashlib.sha256(data).hexdigest(),
+                    compressed=spooled)
+            logger.info('Rendered {0} images for XForm: {1}'.format(
+                len(rendered) - count, os.path.basename(xform_path)))
+        return rendered
 
     @staticmethod
-    def _prepare_zip_jobs(source_path: str, languages: TupleStr) -> ZipJob:
+    def _prepare_archive_paths(xform_path: str, media: ZipJob,
+                               languages: TupleStr, nest_in_odk_folders: int=0,
+                               collect_settings: str=None
+                               ) -> Tuple[ZipJob, str]:
         """
-        Prepare path (to, from) pairs for use in ZipFile write job.
+        Prepare the media zip jobs and XForm archive path for some languages.
 
         Parameters.
-        :param source_path: Path to copy files from.
-        :param languages: Languages to filter the files lists for.
+        :param xform_path: Path to xform being processed.
+        :param media: Path pairs from _scan_media.
+        :param languages: Languages to filter the media files for.
+        :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
+        :param collect_settings: Path to collect.settings file to include
+            in nested output folders.
         """
-        zip_jobs = []
-        source_parent = os.path.dirname(source_path)
-        for base, dirs, files in os.walk(source_path):
-            for file in files:
-                file_name = os.path.splitext(file)[0]
-                for lang in languages:
-                    if file_name.endswith(lang):
-                        file_path = os.path.join(base, file)
-                        arch_path = os.path.relpath(file_path, source_parent)
-                        zip_jobs.append((file_path, arch_path))
-        return zip_jobs
+        xform_file_name = os.path.basename(xform_path)
+        jobs = Editions._filter_media(media=media, languages=languages)
+        if nest_in_odk_folders == 1:
+            nest_prefix = ('odk', 'forms')
+            jobs = [(x, os.path.join(*nest_prefix, y)) for x, y in jobs]
+            xform_file_name = os.path.join(
+                *nest_prefix, os.path.basename(xform_path))
+        if collect_settings is not None:
+            arch_path = os.path.join(
+                'odk', os.path.basename(collect_settings))
+            jobs.append((collect_settings, arch_path))
+        return jobs, xform_file_name
 
     @staticmethod
     def _prepare_site_job(xform_path: str, site_code: str,
                           languages: TupleStr, nest_in_odk_folders: int=0,
-                          collect_settings: str=None
-                          ) -> Tuple[ZipJob, Tuple[str, str]]:
+                          collect_settings: str=None,
+                          form: Tuple[EditionDocument, ZipJob]=None
+                          ) -> Tuple[ZipJob, Tuple[str, bytes]]:
         """
         Prepare the zip jobs and xform for a site.
 
@@ -164,37 +1329,634 @@ class Editions:
         :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
         :param collect_settings: Path to collect.settings file to include
             in nested output folders.
+        :param form: Parsed XForm and media from _prepare_form. If None, the
+            XForm is parsed and the media folder is scanned.
         """
         log_msg = 'Preparing files for site: {0}, languages: {1}'
         logger.info(log_msg.format(site_code, languages))
 
-        xform_file_name = os.path.basename(xform_path)
-        xform_name = os.path.splitext(xform_file_name)[0]
-        xform_media_path = os.path.join(
-            os.path.dirname(xform_path), '{0}-media'.format(xform_name))
-        jobs = Editions._prepare_zip_jobs(
-            source_path=xform_media_path, languages=languages)
-
-        xform = etree.parse(xform_path)
-        nsp = Editions._map_xf_to_xform_namespace(xform)
-        xform = Editions._update_xform_languages(xform, nsp, languages)
-        xform = Editions._add_site_to_default_sid(xform, nsp, site_code)
-        xform = etree.tostring(xform)
-
-        if nest_in_odk_folders == 1:
-            nest_prefix = ('odk', 'forms')
-            jobs = [(x, os.path.join(*nest_prefix, y)) for x, y in jobs]
-            xform_file_name = os.path.join(
-                *nest_prefix, os.path.basename(xform_path))
-        if collect_settings is not None:
-            arch_path = os.path.join(
-                'odk', os.path.basename(collect_settings))
-            jobs.append((collect_settings, arch_path))
+        if form is None:
+            form = Editions._prepare_form(xform_path=xform_path)
+        document, media = form
+        jobs, xform_file_name = Editions._prepare_archive_paths(
+            xform_path=xform_path, media=media, languages=languages,
+            nest_in_odk_folders=nest_in_odk_folders,
+            collect_settings=collect_settings)
+        xform = document.serialize(site_code=site_code, languages=languages)
 
         logger.info('Finished preparing site.')
 
         return jobs, (xform_file_name, xform)
 
+    @staticmethod
+    def _group_sites(settings: Dict[str, TupleStr]
+                     ) -> Dict[TupleStr, List[str]]:
+        """
+        Group the site codes by their languages, in the order first seen.
+
+        The order of the languages is kept as is, since the first language is
+        the default, so sites with the same languages in a different order
+        are in different groups.
+
+        Parameters.
+        :param settings: Site codes and the languages for each site.
+        """
+        groups = OrderedDict()
+        for site_code, languages in settings.items():
+            groups.setdefault(languages, list()).append(site_code)
+        return groups
+
+    @staticmethod
+    def _archive_name(archive_file: str) -> str:
+        """
+        Normalise an archive path the same way as ZipFile.write does.
+
+        Parameters.
+        :param archive_file: Path of the file within the archive.
+        :return: Relative path, with "/" as the separator.
+        """
+        archive_name = os.path.normpath(os.path.splitdrive(archive_file)[1])
+        return archive_name.lstrip(os.sep).replace(os.sep, '/')
+
+    @staticmethod
+    def _fixed_zinfo(archive_file: str, sizes: zipfile.ZipInfo=None
+                     ) -> zipfile.ZipInfo:
+        """
+        Create the entry info for a deflated file, with fixed metadata.
+
+        The timestamp, attributes and system are fixed, so that the entry
+        doesn't depend on when or where the archive was made.
+
+        Parameters.
+        :param archive_file: Path of the file within the archive.
+        :param sizes: Entry info to copy the sizes and CRC-32 from, for
+            adding the same compressed data under this archive path.
+        """
+        zinfo = zipfile.ZipInfo(
+            Editions._archive_name(archive_file), FIXED_DATE_TIME)
+        zinfo.create_system = 3
+        zinfo.external_attr = FIXED_ATTRIBUTES
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        if sizes is not None:
+            zinfo.file_size = sizes.file_size
+            zinfo.compress_size = sizes.compress_size
+            zinfo.CRC = sizes.CRC
+        return zinfo
+
+    @staticmethod
+    def _compress_data(archive_file: str, data: bytes) -> CompressedFile:
+        """
+        Deflate file content once, for adding to many site archives.
+
+        Parameters.
+        :param archive_file: Path of the file within the archive.
+        :param data: File content.
+        """
+        zinfo = Editions._fixed_zinfo(archive_file)
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        zinfo.file_size = len(data)
+        zinfo.compress_size = len(compressed)
+        zinfo.CRC = zlib.crc32(data) & 0xFFFFFFFF
+        return CompressedFile(zinfo=zinfo, data=compressed)
+
+    @staticmethod
+    def _compress_file(source_file: str, archive_file: str) -> CompressedFile:
+        """
+        Read and deflate a file once, for adding to many site archives.
+
+        Parameters.
+        :param source_file: Path to the file to compress.
+        :param archive_file: Path of the file within the archive.
+        """
+        with open(source_file, 'rb') as source:
+            data = source.read()
+        return Editions._compress_data(archive_file=archive_file, data=data)
+
+    @staticmethod
+    def _spool_compressed(compressed: CompressedFile, spool_path: str
+                          ) -> SpooledFile:
+        """
+        Write the compressed data of a file to the spool folder.
+
+        Parameters.
+        :param compressed: Entry info and compressed data.
+        :param spool_path: Path to a temporary folder to write the data to.
+        :return: The entry info, and the path the data was written to.
+        """
+        handle, path = tempfile.mkstemp(suffix='.deflate', dir=spool_path)
+        with os.fdopen(handle, 'wb') as spool_file:
+            spool_file.write(compressed.data)
+        return SpooledFile(zinfo=compressed.zinfo, path=path)
+
+    @staticmethod
+    def _read_spooled(spooled: SpooledFile) -> CompressedFile:
+        """
+        Read the compressed data of a file from the spool folder.
+
+        Parameters.
+        :param spooled: Output of _spool_compressed.
+        """
+        with open(spooled.path, 'rb') as spool_file:
+            return CompressedFile(zinfo=spooled.zinfo, data=spool_file.read())
+
+    @staticmethod
+    def _prepare_language_set(
+            xform_path: str, languages: TupleStr,
+            form: Tuple[EditionDocument, ZipJob], nest_in_odk_folders: int=0,
+            collect_settings: str=None,
+            compressed: Dict[str, CompressedFile]=None, compress: bool=True,
+            spool_path: str=None, spooled: Dict[str, SpooledFile]=None
+            ) -> Tuple[ZipJob, str, Tuple[bytes, bytes]]:
+        """
+        Prepare the compressed files and XForm edition for a set of languages.
+
+        Parameters.
+        :param xform_path: Path to xform being processed.
+        :param languages: Languages of the sites using this set.
+        :param form: Parsed XForm and media from _prepare_form.
+        :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
+        :param collect_settings: Path to collect.settings file to include
+            in nested output folders.
+        :param compressed: Files already compressed for other language sets of
+            the form, by source path. Files compressed here are added to it.
+        :param compress: If False, the files are not compressed, and the
+            jobs are source and archive path pairs, for outputs other than zip.
+        :param spool_path: Path to a temporary folder. If given, the
+            compressed data is written there, and the jobs are SpooledFile
+            entries, so that it isn't kept in memory.
+        :param spooled: Rendered images already compressed and spooled by
+            _render_images, by source path. These are added under the
+            archive path for this form.
+        :return: The CompressedFile (or SpooledFile) jobs, the XForm archive
+            path, and the XForm edition from EditionDocument.split_edition.
+        """
+        if compressed is None:
+            compressed = dict()
+        if spooled is None:
+            spooled = dict()
+        document, media = form
+        jobs, xform_file_name = Editions._prepare_archive_paths(
+            xform_path=xform_path, media=media, languages=languages,
+            nest_in_odk_folders=nest_in_odk_folders,
+            collect_settings=collect_settings)
+        if not compress:
+            return jobs, xform_file_name, document.split_edition(languages)
+        compressed_jobs = list()
+        for source_file, archive_file in jobs:
+            if source_file not in compressed:
+                image = spooled.get(source_file)
+                if image is not None:
+                    compressed_file = SpooledFile(zinfo=Editions._fixed_zinfo(
+                        archive_file, sizes=image.zinfo), path=image.path)
+                else:
+                    compressed_file = Editions._compress_file(
+                        source_file=source_file, archive_file=archive_file)
+                    if spool_path is not None:
+                        compressed_file = Editions._spool_compressed(
+                            compressed=compressed_file, spool_path=spool_path)
+                compressed[source_file] = compressed_file
+            compressed_jobs.append(compressed[source_file])
+        return compressed_jobs, xform_file_name, \
+            document.split_edition(languages)
+
+    @staticmethod
+    def _prepare_form_editions(xform_path: str, settings: Dict[str, TupleStr],
+                               nest_in_odk_folders: int=0,
+                               collect_settings: str=None,
+                               compress: bool=True,
+                               rendered: Dict[str, RenderedImage]=None,
+                               form: Tuple[EditionDocument, ZipJob]=None,
+                               spool_path: str=None) -> FormEditions:
+        """
+        Prepare the language sets for an XForm, parsing and scanning it once.
+
+        Sites with the same languages share the media files, which are
+        compressed once per form, and the XForm edition, which is joined once
+        per set of languages. Only the SID is added for each site, when the
+        site jobs are generated by _iter_site_jobs. If a spool folder is
+        given, the compressed files are kept there rather than in memory.
+
+        Parameters.
+        :param xform_path: Path to xform being processed.
+        :param settings: Site codes and the languages for each site.
+        :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
+        :param collect_settings: Path to collect.settings file to include
+            in nested output folders.
+        :param compress: If False, the files are not compressed, as per
+            _prepare_language_set.
+        :param rendered: Output of _render_images.
+        :param form: Parsed XForm and media from _prepare_form. If None, the
+            XForm is parsed and the media folder is scanned.
+        :param spool_path: Path to a temporary folder for the compressed
+            files, as per _prepare_language_set.
+        :return: The parsed XForm, and the output of _prepare_language_set
+            for each set of languages.
+        """
+        if form is None:
+            form = Editions._prepare_form(
+                xform_path=xform_path, rendered=rendered)
+        compressed = dict()
+        spooled = {x.path: x.compressed for x in (rendered or dict()).values()
+                   if x.compressed is not None}
+        language_sets = dict()
+        for languages, site_codes in Editions._group_sites(settings).items():
+            log_msg = 'Preparing files for languages: {0}, sites: {1}'
+            logger.info(log_msg.format(languages, len(site_codes)))
+            for site_code in site_codes:
+                log_msg = 'Preparing files for site: {0}, languages: {1}'
+                logger.info(log_msg.format(site_code, languages))
+            language_sets[languages] = Editions._prepare_language_set(
+                xform_path=xform_path, languages=languages, form=form,
+                nest_in_odk_folders=nest_in_odk_folders,
+                collect_settings=collect_settings, compressed=compressed,
+                compress=compress, spool_path=spool_path, spooled=spooled)
+        return form[0], language_sets
+
+    @staticmethod
+    def _iter_site_jobs(settings: Dict[str, TupleStr],
+                        forms: List[FormEditions]) -> Iterator[SiteJob]:
+        """
+        Generate the site jobs for each site in turn, for all the forms.
+
+        Each site's XForm editions are serialized when the site is reached,
+        so only the current site's editions are in memory at once. If the
+        compressed media files were spooled, they are also only read when
+        the site is written, so memory is bounded by the largest site
+        rather than by all the forms' media.
+
+        Parameters.
+        :param settings: Site codes and the languages for each site.
+        :param forms: Output of _prepare_form_editions for each XForm.
+        """
+        for site_code, languages in settings.items():
+            for document, language_sets in forms:
+                jobs, xform_file_name, edition = language_sets[languages]
+                xform = document.serialize_split(
+                    site_code=site_code, edition=edition)
+                yield site_code, jobs, (xform_file_name, xform)
+
+    @staticmethod
+    def _read_manifest(manifest_path: str) -> Dict[str, dict]:
+        """
+        Read the build manifest, or an empty one if there isn't a valid one.
+
+        Parameters.
+        :param manifest_path: Path to the manifest file.
+        :return: Manifest with "sites", the input digest for each site
+            archive, and "files", the [mtime, size, digest] of each input
+            file by its absolute path.
+        """
+        try:
+            with open(manifest_path, encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            manifest = dict()
+        if not isinstance(manifest, dict):
+            manifest = dict()
+        for key in ('sites', 'files'):
+            if not isinstance(manifest.get(key), dict):
+                manifest[key] = dict()
+        return manifest
+
+    @staticmethod
+    def _write_manifest(manifest_path: str, manifest: Dict[str, dict]):
+        """
+        Save the build manifest.
+
+        The file is replaced in one step, so that a partly written manifest
+        is never read. If it can't be saved, all sites are rebuilt next time.
+
+        Parameters.
+        :param manifest_path: Path to the manifest file.
+        :param manifest: Manifest, as per _read_manifest.
+        """
+        temp_path = '{0}.{1}.tmp'.format(manifest_path, os.getpid())
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+            os.replace(temp_path, manifest_path)
+        except OSError as e:
+            logger.warning('Could not save build manifest: {0}'.format(e))
+
+    @staticmethod
+    def _file_digest(file_path: str, files: Dict[str, list]) -> str:
+        """
+        Get the SHA-256 digest of a file's content.
+
+        The digest is re-used from the manifest files if the file's mtime and
+        size are unchanged, otherwise the file is read and the entry updated.
+
+        Parameters.
+        :param file_path: Path to the file.
+        :param files: Manifest files, as per _read_manifest.
+        """
+        abs_path = os.path.abspath(file_path)
+        stat = os.stat(abs_path)
+        entry = files.get(abs_path)
+        if entry is not None and entry[0:2] == [stat.st_mtime, stat.st_size]:
+            return entry[2]
+        digest = Editions._hash_file(abs_path)
+        files[abs_path] = [stat.st_mtime, stat.st_size, digest]
+        return digest
+
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """
+        Calculate the SHA-256 digest of a file's content.
+
+        Parameters.
+        :param file_path: Path to the file.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(1024 ** 2), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _site_digests(xform_paths: List[str], settings: Dict[str, TupleStr],
+                      nest_in_odk_folders: int=0, collect_settings: str=None,
+                      files: Dict[str, list]=None,
+                      rendered: Dict[str, RenderedImage]=None,
+                      forms: Dict[str, Tuple[EditionDocument, ZipJob]]=None,
+                      output_format: str='zip') -> Dict[str, str]:
+        """
+        Get a digest of the inputs of each site archive.
+
+        The digest covers the site code, languages, nesting option and output
+        format (since all formats share one manifest), and
+        for each XForm, the edition for the site's languages and the archive
+        path and content of each file added for them (including
+        collect.settings). The edition is hashed without the site's SID, as
+        per EditionDocument.split_edition, so a change to the text of one
+        language only changes the digests of the sites with that language.
+        Each media file is read at most once.
+
+        Parameters.
+        :param xform_paths: Paths to the XForms.
+        :param settings: Site codes and the languages for each site.
+        :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
+        :param collect_settings: Path to collect.settings file to include
+            in nested output folders.
+        :param files: Manifest files, as per _read_manifest. Updated with the
+            digests of the files read.
+        :param rendered: Output of _render_images. The digests of the
+            rendered images are used instead of hashing their files.
+        :param forms: Output of _prepare_forms. If None, the XForms are
+            parsed and their media folders scanned here.
+        :param output_format: One of OUTPUT_FORMATS.
+        """
+        if files is None:
+            files = dict()
+        if rendered is None:
+            rendered = dict()
+        if forms is None:
+            forms = Editions._prepare_forms(
+                xform_paths=xform_paths, rendered=rendered)
+        rendered_digests = {x.path: x.digest for x in rendered.values()}
+        groups = dict()
+        digests = dict()
+        for site_code, languages in settings.items():
+            if languages not in groups:
+                inputs = list()
+                for xform_path in xform_paths:
+                    document, media = forms[xform_path]
+                    jobs, xform_file_name = Editions._prepare_archive_paths(
+                        xform_path=xform_path, media=media,
+                        languages=languages,
+                        nest_in_odk_folders=nest_in_odk_folders,
+                        collect_settings=collect_settings)
+                    edition_digest = [hashlib.sha256(x).hexdigest() for x
+                                      in document.split_edition(languages)]
+                    edition_digest.append(document.sid_text)
+                    job_digests = [[archive_file, rendered_digests.get(
+                        source_file) or Editions._file_digest(
+                        source_file, files)] for source_file, archive_file
+                        in jobs]
+                    inputs.append(
+                        [xform_file_name, edition_digest, job_digests])
+                groups[languages] = inputs
+            site_inputs = [site_code, languages, nest_in_odk_folders,
+                           output_format, groups[languages]]
+            digests[site_code] = hashlib.sha256(
+                json.dumps(site_inputs).encode('utf-8')).hexdigest()
+        return digests
+
+    @staticmethod
+    def _archive_files(zip_path: str) -> Dict[str, List[int]]:
+        """
+        Read the files in a zip file from its central directory.
+
+        Parameters.
+        :param zip_path: Path to the zip file.
+        :return: The [CRC-32, size] of each file by its archive path. Empty
+            if the zip file doesn't exist.
+        """
+        if not os.path.isfile(zip_path):
+            return dict()
+        with zipfile.ZipFile(zip_path) as zip_file:
+            return {x.filename: [x.CRC, x.file_size]
+                    for x in zip_file.infolist()}
+
+    @staticmethod
+    def _read_deployment(previous_path: str, site_codes: Iterable[str]
+                         ) -> Dict[str, Dict[str, List[int]]]:
+        """
+        Read the files in each site zip file of a previous deployment.
+
+        Parameters.
+        :param previous_path: Path to a folder with the previous site zip
+            files, or to the "deployment.json" file written with a delta.
+        :param site_codes: Site codes to read the files for.
+        :return: The output of _archive_files for each site. Sites that
+            weren't in the previous deployment have no files, as do all sites
+            if the path doesn't exist.
+        """
+        if not os.path.exists(previous_path):
+            logger.warning('Previous deployment not found, so all files are '
+                           'added: {0}'.format(previous_path))
+            return {x: dict() for x in site_codes}
+        if os.path.isdir(previous_path):
+            return {x: Editions._archive_files(os.path.join(
+                previous_path, "{0}.zip".format(x))) for x in site_codes}
+        with open(previous_path, encoding='utf-8') as deployment_file:
+            sites = json.load(deployment_file)['sites']
+        return {x: sites.get(x, dict()) for x in site_codes}
+
+    @staticmethod
+    def _write_delta(zip_path: str, previous_files: Dict[str, List[int]],
+                     delta_path: str) -> Dict[str, List[str]]:
+        """
+        Write a delta zip file with the files added or changed since before.
+
+        Files are compared by their CRC-32 and size, from the central
+        directories, and the changed files are copied from the site zip
+        file. The delta zip file is named the same as the site zip file, and
+        the archive paths of the files to remove are written next to it in a
+        "[site].removed.txt" file, one per line. Neither is written if there
+        are no differences.
+
+        Parameters.
+        :param zip_path: Path to the site zip file just written.
+        :param previous_files: Output of _archive_files for the site's
+            previous zip file.
+        :param delta_path: Path to write the delta files to.
+        :return: The archive paths "added", "changed" and "removed".
+        """
+        delta = {'added': list(), 'changed': list(), 'removed': list()}
+        delta_zip = os.path.join(delta_path, os.path.basename(zip_path))
+        removed_name = '{0}.removed.txt'.format(
+            os.path.splitext(delta_zip)[0])
+        for old_path in (delta_zip, delta_zip + '.sha256', removed_name):
+            if os.path.isfile(old_path):
+                os.remove(old_path)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            current = zip_file.infolist()
+            for zinfo in current:
+                previous = previous_files.get(zinfo.filename)
+                if previous is None:
+                    delta['added'].append(zinfo.filename)
+                elif list(previous) != [zinfo.CRC, zinfo.file_size]:
+                    delta['changed'].append(zinfo.filename)
+            current_names = {x.filename for x in current}
+            delta['removed'] = sorted(
+                x for x in previous_files if x not in current_names)
+            to_copy = set(delta['added'] + delta['changed'])
+            if len(to_copy) > 0:
+                os.makedirs(delta_path, exist_ok=True)
+                with EditionArchive(file_path=delta_zip) as delta_archive:
+                    for zinfo in current:
+                        if zinfo.filename in to_copy:
+                            delta_archive.copy_from(
+                                zip_file=zip_file, zinfo=zinfo)
+        if len(delta['removed']) > 0:
+            os.makedirs(delta_path, exist_ok=True)
+            with open(removed_name, 'w', encoding='utf-8',
+                      newline='\n') as removed_file:
+                removed_file.writelines(
+                    '{0}\n'.format(x) for x in delta['removed'])
+        log_msg = 'Delta for {0}: added {1}, changed {2}, removed {3}.'
+        logger.info(log_msg.format(
+            os.path.basename(zip_path), len(delta['added']),
+            len(delta['changed']), len(delta['removed'])))
+        return delta
+
+    @staticmethod
+    def _write_deltas(output_path: str, site_codes: Iterable[str],
+                      previous: Dict[str, Dict[str, List[int]]]):
+        """
+        Write the delta files for the sites, and the files of the deployment.
+
+        The delta files are written to a "delta" folder in the output folder,
+        along with a "deployment.json" file listing the files in each site
+        zip file, which can be used for the next delta instead of keeping a
+        copy of the site zip files. Every site's delta is written again, even
+        if its zip file wasn't rebuilt, since it may still differ from the
+        previous deployment.
+
+        Parameters.
+        :param output_path: Path the site zip files were written to.
+        :param site_codes: Site codes of all the sites in the deployment.
+        :param previous: Output of _read_deployment for the previous
+            deployment.
+        """
+        delta_path = os.path.join(output_path, 'delta')
+        for site_code in site_codes:
+            zip_name = os.path.join(output_path, "{0}.zip".format(site_code))
+            Editions._write_delta(
+                zip_path=zip_name, previous_files=previous[site_code],
+                delta_path=delta_path)
+        sites = {x: Editions._archive_files(os.path.join(
+            output_path, "{0}.zip".format(x))) for x in site_codes}
+        os.makedirs(delta_path, exist_ok=True)
+        deployment_path = os.path.join(delta_path, DEPLOYMENT_NAME)
+        with open(deployment_path, 'w', encoding='utf-8') as deployment_file:
+            json.dump({'sites': sites}, deployment_file, indent=2,
+                      sort_keys=True)
+
+    @staticmethod
+    def _write_editions(
+            xform_paths: List[str], settings: Dict[str, TupleStr],
+            output_path: str, nest_in_odk_folders: int=0,
+            collect_settings: str=None, rebuild: bool=False,
+            previous: Dict[str, Dict[str, List[int]]]=None,
+            output_format: str='zip',
+            rendered: Dict[str, RenderedImage]=None, spool_path: str=None):
+        """
+        Write the site editions, and the manifest and deltas if requested.
+
+        Parameters.
+        :param xform_paths: Paths to the XForms.
+        :param settings: Site codes and the languages for each site.
+        :param output_path: Path to write the site editions to.
+        :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
+        :param collect_settings: Path to collect.settings file to include
+            in nested output folders.
+        :param rebuild: If True, only write the sites whose inputs changed,
+            as per write_language_editions.
+        :param previous: Output of _read_deployment. If given, the deltas
+            are written.
+        :param output_format: One of OUTPUT_FORMATS.
+        :param rendered: Output of _render_images.
+        :param spool_path: Path to a temporary folder for the compressed
+            media files, as per _prepare_form_editions.
+        """
+        all_site_codes = list(settings.keys())
+        prepared = dict()
+        if rebuild:
+            os.makedirs(output_path, exist_ok=True)
+            manifest_path = os.path.join(output_path, MANIFEST_NAME)
+            manifest = Editions._read_manifest(manifest_path)
+            prepared = Editions._prepare_forms(
+                xform_paths=xform_paths, rendered=rendered)
+            digests = Editions._site_digests(
+                xform_paths=xform_paths, settings=settings,
+                nest_in_odk_folders=nest_in_odk_folders,
+                collect_settings=collect_settings, files=manifest['files'],
+                rendered=rendered, forms=prepared,
+                output_format=output_format)
+            changed = OrderedDict()
+            for site_code, languages in settings.items():
+                zip_name = Editions._site_output_path(
+                    output_path=output_path, site_code=site_code,
+                    output_format=output_format)
+                if manifest['sites'].get(site_code) == digests[site_code] \
+                        and os.path.exists(zip_name):
+                    continue
+                changed[site_code] = languages
+                if os.path.isdir(zip_name):
+                    shutil.rmtree(zip_name)
+                elif os.path.isfile(zip_name):
+                    os.remove(zip_name)
+            logger.info('Rebuilding {0} changed sites, skipped {1}.'.format(
+                len(changed), len(settings) - len(changed)))
+            settings = changed
+
+        if len(settings) > 0:
+            max_workers = min(len(xform_paths), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                forms = list(executor.map(
+                    lambda x: Editions._prepare_form_editions(
+                        xform_path=x, settings=settings,
+                        nest_in_odk_folders=nest_in_odk_folders,
+                        collect_settings=collect_settings,
+                        compress=output_format == 'zip', rendered=rendered,
+                        form=prepared.get(x), spool_path=spool_path),
+                    xform_paths))
+            prepared = None
+            logger.info('Writing {0} site archives.'.format(len(settings)))
+            zip_jobs = Editions._iter_site_jobs(settings=settings, forms=forms)
+            Editions._run_zip_jobs(output_path, zip_jobs, output_format)
+        if rebuild:
+            manifest['sites'].update(
+                {x: digests[x] for x in settings.keys()})
+            Editions._write_manifest(manifest_path, manifest)
+        if previous is not None:
+            Editions._write_deltas(
+                output_path=output_path, site_codes=all_site_codes,
+                previous=previous)
+
     @staticmethod
     def _path_error_format(
             resource_name: str, expected: str, actual: str, ):
@@ -204,28 +1966,69 @@ class Editions:
 
     @staticmethod
     def write_language_editions(
-            xform_path: str, site_languages: str, nest_in_odk_folders: int=0,
-            collect_settings: str=None):
+            xform_path: Union[str, List[str]], site_languages: str,
+            nest_in_odk_folders: int=0, collect_settings: str=None,
+            rebuild: bool=False, delta_from: str=None,
+            output_format: str='zip',
+            xlsform_path: Union[str, List[str]]=None,
+            write_media: bool=False):
         """
         Coordinate the other class methods to create xform language editions.
 
+        The XForms are prepared concurrently, with each XForm parsed and its
+        media folder scanned once. The site jobs are then generated and
+        written one site at a time, so each site's XForm editions are
+        released once its zip file is written. The media files compressed
+        for the zip files are kept in a temporary folder in the "editions"
+        folder, and read for each site, so memory use is bounded by the
+        largest site, not by the number of forms or media files.
+
         Parameters.
-        :param xform_path: Path to XForm file. It is assumed that the
-            "xform-media" folder is in the same directory as the Xform.
+        :param xform_path: Path to XForm file, or a list of paths. It is
+            assumed that the "xform-media" folder is in the same directory as
+            the Xform. The editions are written to the "editions" folder in
+            the same directory as the first XForm.
         :param site_languages: Path to XLSX file specifying the sites to
             create editions for, and which languages each should get.
         :param nest_in_odk_folders: 1=yes, 0=no. Nest output in /odk/forms/*.
         :param collect_settings: Path to collect.settings file to include
             in nested output folders.
+        :param rebuild: If True, only the site zip files whose inputs have
+            changed since the last rebuild are written, and they are written
+            from scratch instead of being added to. The inputs of each site
+            are recorded in a "manifest.json" file in the "editions" folder.
+        :param delta_from: Path to a folder with the site zip files of a
+            previous deployment, or to the "deployment.json" file written with
+            a previous delta. If given, a delta zip file with the files added
+            or changed since then, and a list of the files removed, is written
+            for each site zip file, to the "editions/delta" folder.
+        :param output_format: One of OUTPUT_FORMATS: "zip" for a zip file per
+            site, "tar" for an uncompressed tar file per site, or "directory"
+            for a folder per site, with the media files hard linked. Deltas
+            are only written for zip files.
+        :param xlsform_path: Path to the XLSForm of an XForm, or a list of
+            paths. If given, the question images of each XLSForm are rendered
+            and added to the editions of the XForm with the same file name,
+            instead of the images in the XForm's media folder. The images are
+            written to a temporary folder in the "editions" folder as they
+            are rendered, unless write_media is True.
+        :param write_media: If True, the rendered images are also saved to
+            the XForm's media folder.
         """
-        xform_path = os.path.abspath(xform_path)
+        if isinstance(xform_path, str):
+            xform_path = [xform_path]
+        xform_paths = [os.path.abspath(x) for x in xform_path]
+        if isinstance(xlsform_path, str):
+            xlsform_path = [xlsform_path]
+        xlsform_paths = [os.path.abspath(x) for x in xlsform_path or []]
         site_languages = os.path.abspath(site_languages)
 
-        xform_path_ext = os.path.splitext(xform_path)[1].upper()
-        if xform_path_ext != ".XML":
-            raise ValueError(Editions._path_error_format(
-                resource_name="XForm", expected=".XML extension",
-                actual=xform_path_ext))
+        for path in xform_paths:
+            xform_path_ext = os.path.splitext(path)[1].upper()
+            if xform_path_ext != ".XML":
+                raise ValueError(Editions._path_error_format(
+                    resource_name="XForm", expected=".XML extension",
+                    actual=xform_path_ext))
         site_languages_ext = os.path.splitext(site_languages)[1].upper()
         if site_languages_ext != ".XLSX":
             raise ValueError(Editions._path_error_format(
@@ -238,20 +2041,53 @@ class Editions:
                     resource_name="Collect Settings",
                     expected="collect.settings file",
                     actual=collect_settings_base))
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Expected output format to be one of {0}, got "
+                             "{1}.".format(", ".join(OUTPUT_FORMATS),
+                                           output_format))
+        if delta_from is not None and output_format != 'zip':
+            raise ValueError("Deltas can only be written for the zip output "
+                             "format, got {0}.".format(output_format))
+        xform_names = [os.path.splitext(os.path.basename(x))[0]
+                       for x in xform_paths]
+        for path in xlsform_paths:
+            xlsform_name, xlsform_path_ext = os.path.splitext(
+                os.path.basename(path))
+            if xlsform_path_ext.upper() != ".XLSX":
+                raise ValueError(Editions._path_error_format(
+                    resource_name="XLSForm", expected=".XLSX extension",
+                    actual=xlsform_path_ext.upper()))
+            if xlsform_name not in xform_names:
+                raise ValueError(Editions._path_error_format(
+                    resource_name="XLSForm",
+                    expected="the file name of one of the XForms",
+                    actual=xlsform_name))
 
         settings = Editions._read_site_languages(site_languages)
-        output_path = os.path.join(os.path.dirname(xform_path), 'editions')
-
-        zip_jobs = list()
-        for site_code, languages in settings.items():
-            jobs, xform = Editions._prepare_site_job(
-                xform_path=xform_path, site_code=site_code, languages=languages,
+        output_path = os.path.join(os.path.dirname(xform_paths[0]), 'editions')
+        all_site_codes = list(settings.keys())
+        previous = None
+        if delta_from is not None:
+            previous = Editions._read_deployment(
+                previous_path=delta_from, site_codes=all_site_codes)
+        os.makedirs(output_path, exist_ok=True)
+        spool_path = tempfile.mkdtemp(prefix='.spool-', dir=output_path)
+        try:
+            rendered = None
+            if len(xlsform_paths) > 0:
+                rendered = Editions._render_images(
+                    xform_paths=xform_paths, xlsform_paths=xlsform_paths,
+                    spool_path=spool_path, write_media=write_media,
+                    compress=output_format == 'zip')
+            Editions._write_editions(
+                xform_paths=xform_paths, settings=settings,
+                output_path=output_path,
                 nest_in_odk_folders=nest_in_odk_folders,
-                collect_settings=collect_settings)
-            zip_jobs.append((site_code, jobs, xform))
-
-        logger.info('Running {0} zip jobs.'.format(len(zip_jobs)))
-        Editions._run_zip_jobs(output_path, zip_jobs)
+                collect_settings=collect_settings, rebuild=rebuild,
+                previous=previous, output_format=output_format,
+                rendered=rendered, spool_path=spool_path)
+        finally:
+            shutil.rmtree(spool_path, ignore_errors=True)
         logger.info('Zip jobs finished.')
 
 
@@ -261,8 +2097,10 @@ def _create_parser():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "xform",
-        help="Path to xform xml file to split by language.")
+        "xform", nargs="+",
+        help="Path to xform xml file to split by language. Multiple xforms "
+             "may be given, in which case each site zip file includes the "
+             "editions of all of them.")
     parser.add_argument(
         "sitelangs",
         help="Path to xlsx file with sites and languages specified.")
@@ -275,6 +2113,35 @@ def _create_parser():
     parser.add_argument(
         "--collect_settings", dest='collect_settings', default=None,
         help="Path to collect.settings file to add to the nested zip file.")
+    parser.add_argument(
+        "--rebuild", dest="rebuild", action="store_true", default=False,
+        help="Only write the zip files for sites whose XForms, languages, "
+             "media files or collect.settings have changed since the last "
+             "rebuild, replacing them instead of adding to them.")
+    parser.add_argument(
+        "--delta", dest="delta_from", default=None,
+        help="Path to a folder with the site zip files of a previous "
+             "deployment, or to the 'deployment.json' file from a previous "
+             "delta. A zip file with only the added or changed files, and a "
+             "list of the removed files, is written for each site to the "
+             "'editions/delta' folder.")
+    parser.add_argument(
+        "--format", dest="output_format", choices=list(OUTPUT_FORMATS),
+        default="zip",
+        help="Output for each site: a zip file (the default), an "
+             "uncompressed tar file, or a folder with the media files hard "
+             "linked (or copied, if they can't be linked), for copying to "
+             "devices with adb push or rsync.")
+    parser.add_argument(
+        "--images", dest="xlsform", nargs="+", default=None,
+        help="Path to the XLSForm of an xform, with the same file name. The "
+             "question images are rendered and added to the site zip files "
+             "directly, instead of the images in the [xform]-media folder.")
+    parser.add_argument(
+        "--write_media", dest="write_media", action="store_true",
+        default=False,
+        help="With --images, also save the rendered images to the "
+             "[xform]-media folder.")
     return parser
 
 
@@ -287,7 +2154,10 @@ def main_cli():
     logger.addHandler(logging.StreamHandler())
     Editions.write_language_editions(
         xform_path=args.xform, site_languages=args.sitelangs,
-        nest_in_odk_folders=args.nested, collect_settings=args.collect_settings)
+        nest_in_odk_folders=args.nested,
+        collect_settings=args.collect_settings, rebuild=args.rebuild,
+        delta_from=args.delta_from, output_format=args.output_format,
+        xlsform_path=args.xlsform, write_media=args.write_media)
 
 
 if __name__ == '__main__':
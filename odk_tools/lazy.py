@@ -0,0 +1,60 @@
+import importlib
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module, and imports it when an attribute is first used.
+
+    This keeps heavy libraries such as pyxform, lxml, PIL and xlrd from being
+    imported when a module that uses them is imported, so that the GUI window
+    and command line help appear quickly. The import is done under a lock so
+    that the first use can be from any thread.
+
+    Attributes set on the stand-in (e.g. by unittest.mock.patch) take
+    precedence over those of the imported module.
+
+    Usage:
+    etree = lazy_import("lxml.etree")
+    document = etree.parse("Q1309_BEHAVE.xml")  # lxml.etree imported here.
+    """
+
+    def __init__(self, name):
+        """
+        Parameters.
+        :param name: str. Full name of the module to import, e.g. PIL.Image.
+        """
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def _load(self):
+        """
+        Import the module, if not already imported.
+
+        :return: module. The imported module.
+        """
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    def __getattr__(self, name):
+        if name.startswith('_lazy_'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """
+    Get a stand-in for the module which imports it on first attribute use.
+
+    Parameters.
+    :param name: str. Full name of the module to import, e.g. PIL.Image.
+    :return: LazyModule.
+    """
+    return LazyModule(name)
@@ -0,0 +1,347 @@
+import os
+import glob
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from odk_tools.gui.log_capturing_handler import CapturingHandler
+from odk_tools.lazy import lazy_import
+from odk_tools.question_images import images
+from odk_tools.question_images.cache import ImageCache
+from odk_tools.question_images.images import Images, ImageSettings, \
+    ImageContent
+
+xlrd = lazy_import('xlrd')
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+FONT_KWARGS_KEYS = ('label_font_kwargs', 'hint_font_kwargs')
+COUNT_KEYS = ('images', 'written', 'skipped', 'overflowed', 'failed')
+_WORKER_CACHES = dict()
+
+
+def find_xlsforms(paths):
+    """
+    Find the XLSForms in the given files, folders or glob patterns.
+
+    Folders are searched for ".xlsx" files (not in sub-folders). Excel lock
+    files (named like "~$Form.xlsx") are left out, as are duplicates.
+
+    Parameters.
+    :param paths: list. Paths to XLSForms or folders, or glob patterns.
+    :return: list. Paths to XLSForms.
+    """
+    found = list()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, '*.xlsx')))
+        elif any(x in path for x in '*?['):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        found.extend(x for x in matches
+                     if not os.path.basename(x).startswith('~$'))
+    unique = dict()
+    for path in found:
+        unique.setdefault(os.path.abspath(path), path)
+    return list(unique.values())
+
+
+def _prepare_form_tasks(xlsform_path, chunk_size):
+    """
+    Read an XLSForm and split its questions into render tasks.
+
+    Each task is the settings for a language, with the image content limited
+    to a chunk of its questions. Fonts are removed from the settings so that
+    they can be sent to another process, see _render_chunk.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform.
+    :param chunk_size: int. Maximum number of questions per task.
+    :return: list. Settings for each task.
+    """
+    xlsform_workbook = xlrd.open_workbook(filename=xlsform_path)
+    all_settings = ImageSettings.read(xlsform_workbook=xlsform_workbook)
+    tasks = list()
+    for index, language in all_settings.items():
+        language = ImageContent.read(
+            xlsform_workbook=xlsform_workbook, settings=language)
+        content = language.pop('image_content')
+        for key in FONT_KWARGS_KEYS:
+            language.pop(key)
+        for start in range(0, len(content), chunk_size):
+            task = dict(language)
+            task['image_content'] = content[start:start + chunk_size]
+            tasks.append(task)
+    return tasks
+
+
+def _worker_cache(cache_options):
+    """
+    Get the image cache for the options, creating it once per process.
+
+    Parameters.
+    :param cache_options: dict. ImageCache keyword arguments.
+    :return: ImageCache.
+    """
+    key = tuple(sorted(cache_options.items()))
+    cache = _WORKER_CACHES.get(key)
+    if cache is None:
+        cache = ImageCache(**cache_options)
+        _WORKER_CACHES[key] = cache
+    return cache
+
+
+def _empty_result(settings=None):
+    """
+    Make a task result with no images written, and the number to write.
+
+    The counts are of image files, so each question counts once for its
+    image and once for each output profile's image.
+
+    Parameters.
+    :param settings: dict. Settings and image content of the task, or None
+        for a task with no images.
+    :return: dict (counts as per COUNT_KEYS, lists of errors and warnings,
+        and image digests), int (number of image files per question).
+    """
+    result = dict({x: 0 for x in COUNT_KEYS}, errors=list(), warnings=list(),
+                  digests=dict())
+    files = 1
+    if settings is not None:
+        files += len(ImageSettings._parse_profiles(
+            settings.get('image_profiles', '')))
+        result['images'] = len(settings['image_content']) * files
+    return result, files
+
+
+def _render_chunk(xlsform_path, settings, cache_options=None):
+    """
+    Write the images for a render task. This runs in a worker process.
+
+    Fonts are loaded with ImageSettings._load_font, and nested images are
+    opened with Images._open_resized_image, which both keep what they load
+    for the life of the worker process, so they are shared by all the tasks
+    and forms that the worker renders.
+
+    Any error in the task, such as a font that can't be loaded or a nested
+    image that can't be read, is recorded and all the task's images are
+    counted as failed, so one bad chunk doesn't stop the other chunks.
+
+    The warnings logged while rendering, such as text overflows, are
+    returned with the result, since the worker's loggers have no handlers.
+    The image digests are returned too, for write_many_images to save once
+    per form, so the workers don't all write the form's digests file.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform.
+    :param settings: dict. Settings and image content from _prepare_form_tasks.
+    :param cache_options: dict. ImageCache keyword arguments, or None to not
+        use a cache.
+    :return: dict. Counts of image files, as per COUNT_KEYS, lists of
+        errors and warnings, and image digests as per Images.write.
+    """
+    settings = dict(settings)
+    result, files = _empty_result(settings=settings)
+    cache = None
+    capture = CapturingHandler(logger=images.logger)
+    capture.setLevel(logging.WARNING)
+    try:
+        for key, label_or_hint in zip(FONT_KWARGS_KEYS, ('label', 'hint')):
+            settings[key] = ImageSettings._get_font_kwargs(
+                settings, label_or_hint)
+        if cache_options is not None:
+            cache = _worker_cache(cache_options=cache_options)
+        counts = Images.write(xlsform_path=xlsform_path, settings=settings,
+                              cache=cache, writers=1,
+                              digests=result['digests'])
+    except Exception as e:
+        result['failed'] = result['images']
+        result['errors'].append(str(e))
+    else:
+        result['written'] = counts['written']
+        result['skipped'] = counts['cached'] * files
+        result['overflowed'] = counts['overflowed'] * files
+    finally:
+        images.logger.removeHandler(capture)
+    result['warnings'] = capture.watcher.output
+    return result
+
+
+def _add_result(summary, xlsform_path, result, digests=None):
+    """
+    Add a task result to the summary for a form, and log its messages.
+
+    Parameters.
+    :param summary: dict. Key is xlsform path, value is the form result.
+    :param xlsform_path: str. Path to xlsform.
+    :param result: dict. Task result, as per _render_chunk.
+    :param digests: dict. If provided, key is xlsform path, value is updated
+        with the image digests of the task.
+    """
+    form = summary.setdefault(xlsform_path, dict(
+        {x: 0 for x in COUNT_KEYS}, errors=list()))
+    for key in COUNT_KEYS:
+        form[key] += result[key]
+    for error in result['errors']:
+        if error not in form['errors']:
+            form['errors'].append(error)
+            logger.error("{0}: {1}".format(xlsform_path, error))
+    for warning in result['warnings']:
+        logger.warning("{0}: {1}".format(xlsform_path, warning))
+    if digests is not None:
+        digests.setdefault(xlsform_path, dict()).update(result['digests'])
+
+
+def write_many_images(xlsform_paths, workers=None, chunk_size=20,
+                      cache_options=None):
+    """
+    Write images for all languages and questions of many XLSForms at once.
+
+    All forms are read first, and their questions for each language are split
+    into chunks. The chunks of all forms are then sent to one shared process
+    pool, where each worker takes the next chunk as soon as it is free, so a
+    large form doesn't leave the other workers idle once the small forms are
+    done. If a worker process crashes, the chunks that were waiting for the
+    pool are counted as failed.
+
+    The image digests of each form are saved once all its chunks are done.
+    See Images.write.
+
+    Parameters.
+    :param xlsform_paths: list. Paths to xlsforms to process.
+    :param workers: int. Number of worker processes. If None, the number of
+        CPUs is used. If 0, the chunks are rendered in this process.
+    :param chunk_size: int. Maximum number of questions per chunk.
+    :param cache_options: dict. ImageCache keyword arguments for an optional
+        cache of rendered images, shared by all forms and workers.
+    :return: dict. Key is xlsform path, value is a dict of the counts of
+        image files (as per COUNT_KEYS) and a list of errors.
+    """
+    summary = dict()
+    digests = dict()
+    tasks = list()
+    for xlsform_path in xlsform_paths:
+        summary[xlsform_path] = dict({x: 0 for x in COUNT_KEYS}, errors=list())
+        try:
+            form_tasks = _prepare_form_tasks(
+                xlsform_path=xlsform_path, chunk_size=chunk_size)
+        except Exception as e:
+            result, _ = _empty_result()
+            result['errors'].append("Could not read XLSForm: {0}".format(e))
+            _add_result(summary, xlsform_path, result)
+            continue
+        tasks.extend((xlsform_path, x) for x in form_tasks)
+    logger.info("Rendering {0} forms in {1} chunks.".format(
+        len(xlsform_paths), len(tasks)))
+
+    if workers == 0:
+        for xlsform_path, settings in tasks:
+            _add_result(summary, xlsform_path, _render_chunk(
+                xlsform_path=xlsform_path, settings=settings,
+                cache_options=cache_options), digests=digests)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(xlsform_path, settings, executor.submit(
+                _render_chunk, xlsform_path, settings, cache_options))
+                for xlsform_path, settings in tasks]
+            for xlsform_path, settings, future in futures:
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    result, _ = _empty_result(settings=settings)
+                    result['failed'] = result['images']
+                    result['errors'].append(
+                        "Worker process failed: {0}".format(e))
+                _add_result(summary, xlsform_path, result, digests=digests)
+    for xlsform_path, form_digests in digests.items():
+        Images._update_digests(
+            output_path=Images._get_output_directory(xlsform_path),
+            digests=form_digests)
+    return summary
+
+
+def format_summary(summary):
+    """
+    Format the write_many_images result as a table, with a total row.
+
+    Parameters.
+    :param summary: dict. Output of write_many_images.
+    :return: str. Summary table.
+    """
+    row_fmt = "{:<40}" + "{:>12}" * len(COUNT_KEYS)
+    lines = [row_fmt.format("form", *COUNT_KEYS)]
+    totals = {x: 0 for x in COUNT_KEYS}
+    for xlsform_path, form in summary.items():
+        name = os.path.basename(xlsform_path)
+        if len(form['errors']) > 0:
+            name = "{0} (errors: {1})".format(name, len(form['errors']))
+        lines.append(row_fmt.format(name, *(form[x] for x in COUNT_KEYS)))
+        for key in COUNT_KEYS:
+            totals[key] += form[key]
+    lines.append(row_fmt.format(
+        "total ({0} forms)".format(len(summary)),
+        *(totals[x] for x in COUNT_KEYS)))
+    return "\n".join(lines)
+
+
+def _create_parser():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Write question images for many XLSForms at once.")
+    parser.add_argument(
+        "xlsforms", nargs="+",
+        help="XLSForm files, folders containing XLSForms, or glob patterns "
+             "(e.g. 'study/Q13*.xlsx'). The images for each XLSForm are "
+             "written to a [XFormName]-media folder next to it.")
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument(
+        "--chunk-size", dest="chunk_size", type=int, default=20,
+        help="Number of questions that a worker renders at a time.")
+    parser.add_argument(
+        "--cache", dest="cache", action="store_true", default=False,
+        help="Re-use identical images rendered before, for any form, from a "
+             "cache folder in the user's cache directory, or the folder given "
+             "with --cache-dir.")
+    parser.add_argument(
+        "--cache-dir", dest="cache_dir", default=None,
+        help="Folder for the image cache. Implies --cache.")
+    parser.add_argument(
+        "--cache-size", dest="cache_size", type=int, default=512,
+        help="Size cap for the image cache in MB. When exceeded, the least "
+             "recently used images are removed.")
+    parser.add_argument(
+        "--cache-link", dest="cache_link", action="store_true", default=False,
+        help="Hard link images from the cache instead of copying them.")
+    return parser
+
+
+def main_cli():
+    """
+    Collect script arguments from stdin and run write_many_images.
+    """
+    parser = _create_parser()
+    args = parser.parse_args()
+    logger.addHandler(logging.StreamHandler())
+    xlsform_paths = find_xlsforms(paths=args.xlsforms)
+    if len(xlsform_paths) == 0:
+        parser.error("No XLSForms found.")
+    cache_options = None
+    if args.cache or args.cache_dir is not None:
+        cache_options = {'cache_path': args.cache_dir,
+                         'max_size': args.cache_size * 1024 ** 2,
+                         'link': args.cache_link}
+    summary = write_many_images(
+        xlsform_paths=xlsform_paths, workers=args.workers,
+        chunk_size=args.chunk_size, cache_options=cache_options)
+    print(format_summary(summary=summary))
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,215 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import logging
+from odk_tools.lazy import lazy_import
+
+PIL = lazy_import('PIL')
+EVICT_TO = 0.9
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class ImageCache:
+    """
+    Content-addressed store of rendered question images.
+
+    Images are stored under a hash of all the inputs used to render them, so
+    that identical question images in different forms, form versions or
+    languages can be copied (or hard linked) from the cache instead of being
+    rendered again. The least recently used images are removed once the total
+    size of the cache exceeds the size cap, down to EVICT_TO of the cap, so
+    the cache isn't listed again for each image stored after that.
+
+    An entry's modification time is its last used time. A copied entry is
+    touched when it's used, but a hard linked one isn't, since that would
+    change the modification time of the output image too, which the image
+    digests depend on. Entries that are still linked to an output image are
+    removed after the others.
+    """
+
+    def __init__(self, cache_path=None, max_size=512 * 1024 ** 2, link=False):
+        """
+        Parameters.
+        :param cache_path: str. Folder to store images in. If None, a folder
+            in the user's cache directory is used.
+        :param max_size: int. Size cap for the cache, in bytes.
+        :param link: bool. If True, hard link cached images to the output
+            path instead of copying them, where possible.
+        """
+        if cache_path is None:
+            cache_path = ImageCache._default_path()
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.link = link
+        self.total_size = None
+        os.makedirs(self.cache_path, exist_ok=True)
+
+    @staticmethod
+    def _default_path():
+        """
+        Get the path to the default cache folder for the current user.
+
+        :return: str. Path to the cache folder.
+        """
+        if os.name == 'nt':
+            base = os.environ.get(
+                'LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            base = os.environ.get(
+                'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'),
+                                               '.cache'))
+        return os.path.join(base, 'odk_tools', 'images')
+
+    @staticmethod
+    def render_key(*digests):
+        """
+        Combine the render input digests into a cache key.
+
+        The Pillow version is included since it can slightly change the
+        rendered output, e.g. text anti-aliasing. Older Pillow releases such
+        as 3.4 only have it as PIL.PILLOW_VERSION.
+
+        Parameters.
+        :param digests: str. Digests of the render inputs.
+        :return: str. Cache key.
+        """
+        pillow_version = getattr(PIL, '__version__', None) or \
+            PIL.PILLOW_VERSION
+        key_hash = hashlib.sha256()
+        for value in (pillow_version,) + digests:
+            key_hash.update(value.encode('utf-8'))
+            key_hash.update(b'\0')
+        return key_hash.hexdigest()
+
+    def _entry_path(self, key, extension='.png'):
+        """
+        Get the path to the cache entry for a key.
+
+        Parameters.
+        :param key: str. Cache key.
+        :param extension: str. File extension of the image.
+        :return: str. Path to the cache entry.
+        """
+        return os.path.join(self.cache_path, key[:2], key + extension)
+
+    def lookup(self, key, extension='.png'):
+        """
+        Get the path to the cached image for the key, without using it.
+
+        Parameters.
+        :param key: str. Cache key.
+        :param extension: str. File extension of the image.
+        :return: str. Path to the cache entry, or None if it's not cached.
+        """
+        entry_path = self._entry_path(key=key, extension=extension)
+        if not os.path.isfile(entry_path):
+            return None
+        return entry_path
+
+    def fetch(self, key, image_path):
+        """
+        Put the cached image for the key at the image path, if it's cached.
+
+        Parameters.
+        :param key: str. Cache key.
+        :param image_path: str. Path to put the image.
+        :return: bool. True if the image was cached.
+        """
+        entry_path = self._entry_path(
+            key=key, extension=os.path.splitext(image_path)[1])
+        if not os.path.isfile(entry_path):
+            return False
+        if os.path.isfile(image_path):
+            os.remove(image_path)
+        linked = False
+        if self.link:
+            try:
+                os.link(entry_path, image_path)
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            shutil.copyfile(entry_path, image_path)
+            os.utime(entry_path)
+        return True
+
+    def store(self, key, image_path):
+        """
+        Copy the image into the cache, then evict old images if over the cap.
+
+        The image is written to a temporary file first so that concurrent
+        readers never see a partially written cache entry.
+
+        Parameters.
+        :param key: str. Cache key.
+        :param image_path: str. Path to the rendered image.
+        """
+        entry_path = self._entry_path(
+            key=key, extension=os.path.splitext(image_path)[1])
+        if os.path.isfile(entry_path):
+            return
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(entry_path), suffix='.tmp')
+        os.close(handle)
+        try:
+            shutil.copyfile(image_path, temp_path)
+            os.replace(temp_path, entry_path)
+        except OSError:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise
+        if self.total_size is not None:
+            self.total_size += os.path.getsize(entry_path)
+        self.evict()
+
+    def _entries(self):
+        """
+        List the cache entries.
+
+        :return: list. Tuples of (linked, last used time, size, path) for
+            each entry, where linked is True if the entry is hard linked to
+            an output image.
+        """
+        entries = list()
+        for base, dirs, files in os.walk(self.cache_path):
+            for file in files:
+                if file.endswith('.tmp'):
+                    continue
+                entry_path = os.path.join(base, file)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_nlink > 1, stat.st_mtime,
+                                stat.st_size, entry_path))
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used images if over the size cap.
+
+        Images are removed until the total size is EVICT_TO of the cap. The
+        total size is only calculated by listing the cache on first use or
+        when the cap is exceeded, otherwise it is kept as a running total.
+        """
+        if self.total_size is None:
+            self.total_size = sum(x[2] for x in self._entries())
+        if self.total_size <= self.max_size:
+            return
+        entries = sorted(self._entries())
+        self.total_size = sum(x[2] for x in entries)
+        for _, _, size, entry_path in entries:
+            if self.total_size <= self.max_size * EVICT_TO:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            self.total_size -= size
+        logger.info("Image cache reduced to {0} bytes.".format(
+            self.total_size))
@@ -1,13 +1,34 @@
+import io
 import os
+import filecmp
 import re
 import argparse
 import textwrap
-from PIL import ImageFont
-from PIL import Image
-from PIL import ImageDraw
-from xlrd import open_workbook
+import hashlib
+import json
+import functools
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 import logging
+from odk_tools.lazy import lazy_import
+from odk_tools.question_images.cache import ImageCache
+from odk_tools.question_images.xlsx_rows import RowsSheet, XlsxRows
+
+ImageFont = lazy_import('PIL.ImageFont')
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+features = lazy_import('PIL.features')
+xlrd = lazy_import('xlrd')
+etree = lazy_import('lxml.etree')
+IMAGE_FORMATS = OrderedDict((
+    ('png', '.png'), ('png8', '.png'), ('webp', '.webp')))
+IMAGE_URI_PREFIX = 'jr://images/'
+DIGESTS_EXTENSION = '.digests.json'
+SAVE_OPTIONS = {'.png': ('PNG', {'dpi': [300, 300]}),
+                '.webp': ('WEBP', {'lossless': True})}
 
 
 logger = logging.getLogger(__name__)
@@ -18,25 +39,318 @@ class Images:
     """Prepares and writes images for a given language's settings."""
 
     @staticmethod
-    def write(xlsform_path, settings):
+    def write(xlsform_path, settings, cache=None, writers=2, queue_size=8,
+              digests=None):
         """
         Create images for all questions in the provided settings.
 
         Files will be placed in a folder adjacent to the xlsform.
 
+        If a cache is provided, images that have been rendered before with
+        identical inputs are taken from the cache instead of being rendered,
+        and newly rendered images are added to the cache as soon as they are
+        saved, so the cache keys waiting to be stored stay bounded.
+
+        Images are encoded and saved by writer threads while the next images
+        are rendered. See _save_images.
+
+        If the settings have output profiles, the images for each profile are
+        saved to the profile's folder. See _get_profile_directory.
+
+        The render inputs of each image that is saved or taken from the cache
+        are added to the digests file next to the output folder, so plan can
+        tell which existing images would change. See _record_digest.
+
         Parameters.
         :param xlsform_path: str. Path to xlsform.
         :param settings: dict.
+        :param cache: ImageCache. Optional cache of rendered images.
+        :param writers: int. Number of threads to encode and save images.
+        :param queue_size: int. Number of rendered images that may wait to
+            be saved before rendering pauses.
+        :param digests: dict. If provided, the image digests are added to this
+            instead of the digests file, for the caller to save them with
+            _update_digests.
+        :return: dict. Number of images "written" (including the images of
+            any output profiles), questions taken from the cache ("cached"),
+            and with text outside the margins ("overflowed").
         """
         output_path = Images._create_output_directory(xlsform_path)
+        Images._create_profile_directories(
+            output_path=output_path, settings=settings)
+        counts = {'written': 0, 'cached': 0, 'overflowed': 0}
+        save_digests = digests is None
+        if save_digests:
+            digests = dict()
+        settings, render_keys = Images._fetch_cached_images(
+            xlsform_path=xlsform_path, settings=settings,
+            output_path=output_path, cache=cache, digests=digests,
+            counts=counts)
+        base_image, pixels_from_top = Images._prepare_base_image(
+            settings=settings, xlsform_path=xlsform_path)
+        image_generator = Images._prepare_question_images(
+            base_image=base_image, pixels_from_top=pixels_from_top,
+            settings=settings, output_path=output_path,
+            xlsform_path=xlsform_path, counts=counts)
+        store_lock = threading.Lock()
+
+        def store(image_path):
+            key = render_keys.pop(image_path)
+            with store_lock:
+                if cache is not None:
+                    cache.store(key=key, image_path=image_path)
+                Images._record_digest(
+                    digests=digests, output_path=output_path,
+                    image_path=image_path, key=key)
+
+        try:
+            counts['written'] = Images._save_images(
+                images=image_generator, writers=writers,
+                queue_size=queue_size, on_saved=store)
+        finally:
+            if save_digests:
+                Images._update_digests(
+                    output_path=output_path, digests=digests)
+        return counts
+
+    @staticmethod
+    def _save_images(images, writers=2, queue_size=8, on_saved=None):
+        """
+        Save images from the generator using writer threads.
+
+        Rendered images are put on a bounded queue, which the writer threads
+        take from to encode and save, so that rendering and saving overlap.
+        When the queue is full, rendering waits for a writer, so at most
+        queue_size + writers rendered images are held in memory.
+
+        If an image can't be saved, no more images are rendered or saved, and
+        the error is raised once the writers have stopped.
+
+        Each writer counts the images it saved in its own slot, so the counts
+        aren't updated by more than one thread.
+
+        Parameters.
+        :param images: iterable. Tuples of (image, image_path).
+        :param writers: int. Number of writer threads.
+        :param queue_size: int. Maximum number of images waiting to be saved.
+        :param on_saved: callable. Optional function called with the path of
+            each saved image, from the writer thread.
+        :return: int. Number of images saved.
+        """
+        jobs = queue.Queue(maxsize=queue_size)
+        writers = max(1, writers)
+        saved = [0] * writers
+        errors = list()
+
+        def writer(index):
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                image, image_path = job
+                if len(errors) > 0:
+                    continue
+                try:
+                    Images._save_image(image=image, image_path=image_path)
+                    saved[index] += 1
+                    if on_saved is not None:
+                        on_saved(image_path)
+                except Exception as e:
+                    errors.append((image_path, e))
+
+        threads = [threading.Thread(target=writer, args=(x,), daemon=True)
+                   for x in range(writers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for image, image_path in images:
+                if len(errors) > 0:
+                    break
+                jobs.put((image, image_path))
+        finally:
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+        if len(errors) > 0:
+            image_path, error = errors[0]
+            raise OSError("Could not save image. image name ({0}), "
+                          "error ({1})".format(os.path.basename(image_path),
+                                               error)) from error
+        return sum(saved)
+
+    @staticmethod
+    def render(xlsform_path, settings, output_path, writers=2, queue_size=8):
+        """
+        Create images for all questions in the provided settings, in memory.
+
+        The images are encoded in memory instead of being saved, with the
+        same options as _save_image, so the data is the same as the files that
+        write would save. See _encode_images.
+
+        Parameters.
+        :param xlsform_path: str. Path to xlsform.
+        :param settings: dict.
+        :param output_path: str. Path of the folder the images are named for.
+        :param writers: int. Number of threads to encode images.
+        :param queue_size: int. Number of rendered images that may wait to
+            be encoded before rendering pauses.
+        :return: generator. Tuples of (image path, image data), in the
+            order of the questions.
+        """
         base_image, pixels_from_top = Images._prepare_base_image(
             settings=settings, xlsform_path=xlsform_path)
         image_generator = Images._prepare_question_images(
             base_image=base_image, pixels_from_top=pixels_from_top,
             settings=settings, output_path=output_path,
             xlsform_path=xlsform_path)
-        for image, image_path in image_generator:
-            Images._save_image(image=image, image_path=image_path)
+        return Images._encode_images(
+            images=image_generator, writers=writers, queue_size=queue_size)
+
+    @staticmethod
+    def _encode_images(images, writers=2, queue_size=8):
+        """
+        Encode images from the generator using a pool of threads.
+
+        Like _save_images, the next images are rendered while earlier images
+        are encoded, and at most queue_size + 1 images wait to be encoded.
+        Unlike _save_images, the encoded images are yielded in order.
+
+        Parameters.
+        :param images: iterable. Tuples of (image, image_path).
+        :param writers: int. Number of encoding threads.
+        :param queue_size: int. Maximum number of images waiting to be
+            encoded.
+        :return: generator. Tuples of (image path, image data).
+        """
+        def result(pending_image):
+            image_path, future = pending_image
+            try:
+                return image_path, future.result()
+            except Exception as e:
+                raise OSError("Could not encode image. image name ({0}), "
+                              "error ({1})".format(
+                                os.path.basename(image_path), e)) from e
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, writers)) as executor:
+            for image, image_path in images:
+                pending.append((image_path, executor.submit(
+                    Images._encode_image, image, image_path)))
+                if len(pending) > queue_size:
+                    yield result(pending.popleft())
+            while len(pending) > 0:
+                yield result(pending.popleft())
+
+    @staticmethod
+    def _fetch_cached_images(xlsform_path, settings, output_path, cache,
+                             digests=None, counts=None):
+        """
+        Put cached images in the output path, and list the ones to render.
+
+        If the image content is a list, the cache is checked for all images
+        now. Otherwise, each image is checked as the content is iterated, and
+        the render keys are added as the images to render are reached.
+
+        Parameters.
+        :param xlsform_path: str. Path to xlsform.
+        :param settings: dict. Image settings and content for a language.
+        :param output_path: str. Path to write images to.
+        :param cache: ImageCache. Cache of rendered images, or None to render
+            all the images.
+        :param digests: dict. If provided, updated with the digest of each
+            image taken from the cache, as per _record_digest.
+        :param counts: dict. If provided, the "cached" count is increased for
+            each image taken from the cache.
+        :return: dict (copy of settings, with image_content limited to the
+            images to render), dict (render key for each image path to
+            render).
+        """
+        cache_keys = dict()
+        render_content = Images._iter_uncached_content(
+            xlsform_path=xlsform_path, settings=settings,
+            output_path=output_path, cache=cache, cache_keys=cache_keys,
+            digests=digests, counts=counts)
+        if isinstance(settings['image_content'], list):
+            render_content = list(render_content)
+        settings = dict(settings)
+        settings['image_content'] = render_content
+        return settings, cache_keys
+
+    @staticmethod
+    def _iter_uncached_content(xlsform_path, settings, output_path, cache,
+                               cache_keys, digests=None, counts=None):
+        """
+        Put cached images in the output path, and yield the ones to render.
+
+        Parameters.
+        :param xlsform_path: str. Path to xlsform.
+        :param settings: dict. Image settings and content for a language.
+        :param output_path: str. Path to write images to.
+        :param cache: ImageCache. Cache of rendered images, or None.
+        :param cache_keys: dict. Updated with the render key for each image
+            path to render, including the paths of any output profiles. A
+            question is only taken from the cache if all its images are.
+        :param digests: dict. As per _fetch_cached_images.
+        :param counts: dict. If provided, the "cached" count is increased for
+            each image taken from the cache.
+        :return: generator. Questions to render.
+        """
+        settings_digest = Images._settings_digest(
+            settings=settings, xlsform_path=xlsform_path)
+        profiles = ImageSettings._parse_profiles(
+            settings.get('image_profiles', ''))
+        fetched = 0
+        for question in settings['image_content']:
+            keys = Images._question_render_keys(
+                image_path=Images._get_image_path(
+                    output_path=output_path, settings=settings,
+                    question=question),
+                settings_digest=settings_digest,
+                question_digest=Images._question_digest(
+                    question=question, xlsform_path=xlsform_path),
+                profiles=profiles)
+            if cache is not None and all(
+                    cache.fetch(key=key, image_path=path)
+                    for path, key in keys):
+                fetched += 1
+                if counts is not None:
+                    counts['cached'] += 1
+                if digests is not None:
+                    for path, key in keys:
+                        Images._record_digest(
+                            digests=digests, output_path=output_path,
+                            image_path=path, key=key)
+            else:
+                cache_keys.update(keys)
+                yield question
+        if cache is not None:
+            logger.info("Used {0} cached images for language: {1}.".format(
+                fetched, settings['language']))
+
+    @staticmethod
+    def _question_render_keys(image_path, settings_digest, question_digest,
+                              profiles):
+        """
+        Get the render key of a question image and its profile images.
+
+        The keys are the same as the ImageCache keys for the images.
+
+        Parameters.
+        :param image_path: str. Output path of the question image.
+        :param settings_digest: str. As per _settings_digest.
+        :param question_digest: str. As per _question_digest.
+        :param profiles: list. Name and width of each output profile.
+        :return: list. Tuples of (image path, render key).
+        """
+        keys = [(image_path,
+                 ImageCache.render_key(settings_digest, question_digest))]
+        for name, width in profiles:
+            keys.append((Images._get_profile_path(
+                image_path=image_path, profile_name=name),
+                ImageCache.render_key(settings_digest, question_digest,
+                                      name, str(width))))
+        return keys
 
     @staticmethod
     def _save_image(image, image_path):
@@ -45,12 +359,63 @@ class Images:
 
         Separate function for easier mock-out.
 
+        If the path is hard linked to another file, e.g. from an ImageCache,
+        the link is removed first so that the other file is not overwritten.
+
+        The format is chosen by the file extension, see SAVE_OPTIONS.
+
         Parameters.
         :param image: PIL.Image. Image object to save.
         :param image_path: str. Path to save image to.
         """
-        image.save(image_path, 'PNG', dpi=[300, 300])
+        if os.path.isfile(image_path) and os.stat(image_path).st_nlink > 1:
+            os.remove(image_path)
+        image_format, options = Images._save_options(image_path=image_path)
+        image.save(image_path, image_format, **options)
+        image.close()
+
+    @staticmethod
+    def _save_options(image_path):
+        """
+        Get the Pillow format name and save options for an image path.
+
+        Parameters.
+        :param image_path: str. Path to save image to.
+        :return: str (format name), dict (save options).
+        """
+        return SAVE_OPTIONS[os.path.splitext(image_path)[1].lower()]
+
+    @staticmethod
+    def _encode_image(image, image_path):
+        """
+        Encode the image, with the same format and options as _save_image.
+
+        Parameters.
+        :param image: PIL.Image. Image object to encode.
+        :param image_path: str. Path the image would be saved to.
+        :return: bytes. Image data.
+        """
+        output = io.BytesIO()
+        image_format, options = Images._save_options(image_path=image_path)
+        image.save(output, image_format, **options)
         image.close()
+        return output.getvalue()
+
+    @staticmethod
+    def _save_image_data(data, image_path):
+        """
+        Save encoded image data to the provided path.
+
+        As with _save_image, a hard link at the path is removed first.
+
+        Parameters.
+        :param data: bytes. Image data from _encode_image.
+        :param image_path: str. Path to save image to.
+        """
+        if os.path.isfile(image_path) and os.stat(image_path).st_nlink > 1:
+            os.remove(image_path)
+        with open(image_path, 'wb') as image_file:
+            image_file.write(data)
 
     @staticmethod
     def _prepare_base_image(settings, xlsform_path):
@@ -85,7 +450,7 @@ class Images:
 
     @staticmethod
     def _prepare_question_images(base_image, pixels_from_top, settings,
-                                 output_path, xlsform_path):
+                                 output_path, xlsform_path, counts=None):
         """
         Add relevant text and image elements to a base image.
 
@@ -98,47 +463,601 @@ class Images:
         :param settings: dict. Questions and their content for a language.
         :param output_path: str. Path to write images to.
         :param xlsform_path: str.
+        :param counts: dict. If provided, the "overflowed" count is increased
+            for each image with text outside the margins.
         :return: PIL.Image (question image) and str (image output path).
         """
+        layouts = Images._layout_question_images(
+            image_size=base_image.size, pixels_from_top=pixels_from_top,
+            settings=settings, output_path=output_path,
+            xlsform_path=xlsform_path)
+        profiles = Images._prepare_profiles(
+            base_image=base_image, settings=settings)
+        for layout in layouts:
+            if counts is not None and len(layout['overflows']) > 0:
+                counts['overflowed'] += 1
+            question_image = Images._render_layout(
+                base_image=Images._crop_image(
+                    image=base_image, size=layout['image_size']),
+                layout=layout, settings=settings, xlsform_path=xlsform_path)
+            yield Images._convert_image(
+                image=question_image, settings=settings), layout['image_path']
+            for name, scale, profile_image in profiles:
+                question_image = Images._render_layout(
+                    base_image=Images._crop_image(
+                        image=profile_image, size=Images._scale_size(
+                            size=layout['image_size'], scale=scale)),
+                    layout=layout, settings=settings,
+                    xlsform_path=xlsform_path, scale=scale)
+                yield Images._convert_image(
+                    image=question_image, settings=settings), \
+                    Images._get_profile_path(
+                        image_path=layout['image_path'], profile_name=name)
+
+    @staticmethod
+    def _convert_image(image, settings):
+        """
+        Convert a rendered image for the image_format setting, if needed.
+
+        For "png8", the image is reduced to a palette of up to 256 colours, so
+        it is saved as an 8-bit palette PNG.
+
+        Parameters.
+        :param image: PIL.Image. Rendered question image.
+        :param settings: dict. Image settings for a language.
+        :return: PIL.Image. The image, or a converted copy of it.
+        """
+        if settings.get('image_format', 'png') != 'png8':
+            return image
+        converted = image.quantize(colors=256)
+        image.close()
+        return converted
+
+    @staticmethod
+    def _crop_image(image, size):
+        """
+        Get a copy of the image, cropped from the top left to the size.
+
+        Parameters.
+        :param image: PIL.Image. Image to copy.
+        :param size: tuple. Width and height to crop to.
+        :return: PIL.Image. Cropped copy of the image.
+        """
+        if tuple(size) == image.size:
+            return image.copy()
+        return image.crop((0, 0) + tuple(size))
+
+    @staticmethod
+    def _scale_size(size, scale):
+        """
+        Scale a width and height, or a position, rounding to whole pixels.
+
+        Parameters.
+        :param size: tuple. Width and height, or x and y.
+        :param scale: float. Factor to scale by.
+        :return: tuple. Scaled width and height.
+        """
+        return tuple(int(round(x * scale)) for x in size)
+
+    @staticmethod
+    def _prepare_profiles(base_image, settings):
+        """
+        Resize the base image for each output profile.
+
+        The layout of each question is calculated once, for the image_width
+        and image_height, and then drawn at each profile's scale. The base
+        image, including any logo, is resized rather than drawn again.
+
+        Parameters.
+        :param base_image: PIL.Image. Base image from _prepare_base_image.
+        :param settings: dict. Image settings for a language.
+        :return: list. Tuples of (profile name, scale, resized base image).
+        """
+        profiles = list()
+        for name, width in ImageSettings._parse_profiles(
+                settings.get('image_profiles', '')):
+            scale = width / base_image.size[0]
+            profile_image = Images._resize_image(
+                base_image, Images._scale_size(base_image.size, scale))
+            profiles.append((name, scale, profile_image))
+        return profiles
+
+    @staticmethod
+    def _layout_question_images(image_size, pixels_from_top, settings,
+                                output_path, xlsform_path):
+        """
+        Calculate where each question's text and image elements will be placed.
+
+        No pixels are drawn or encoded here. Text is measured with the font
+        metrics, and nested images are measured from their file header only.
+
+        The layout dict for each question contains:
+        - image_path: str. Intended output path of the question image.
+        - elements: list. Items to draw, in order, each being either a
+          ('text', font_kwargs settings key, [(x, y, line), ...]) or an
+          ('image', nest image path, (x, y), (width, height)) tuple.
+        - pixels_from_top: int. Final vertical offset after all elements.
+        - image_size: tuple. Width and height of the question image, which
+          is less than the image_size parameter if it is cropped. See
+          _crop_size.
+        - overflows: list. (dimension, size, line) for text outside margins.
+
+        Parameters.
+        :param image_size: tuple. Width and height of the question image.
+        :param pixels_from_top: int. current pixels from top (0 if no logo).
+        :param settings: dict. Questions and their content for a language.
+        :param output_path: str. Path that images would be written to.
+        :param xlsform_path: str. Path to xlsform.
+        :return: dict. Layout for each question.
+        """
         pixels_from_top_base = pixels_from_top
         for question in settings['image_content']:
-            question_image = base_image.copy()
             pixels_from_top = pixels_from_top_base
-            question_path = os.path.join(
-                output_path, '{0}_{1}.png'.format(
-                    question['file_name_column'], settings['language']))
-
-            if len(question['text_label_column']) > 0:
-                question_image, pixels_from_top = \
-                    Images._draw_text(
-                        base_image=question_image,
-                        pixels_from_top=pixels_from_top,
-                        pixels_before=settings['text_label_pixels_before'],
-                        pixels_between=settings['text_label_pixels_line'],
-                        **settings['label_font_kwargs'],
-                        text=question['text_label_column'],
-                        image_name=question_path)
-            if len(question['text_hint_column']) > 0:
-                question_image, pixels_from_top = \
-                    Images._draw_text(
-                        base_image=question_image,
-                        pixels_from_top=pixels_from_top,
-                        pixels_before=settings['text_hint_pixels_before'],
-                        pixels_between=settings['text_hint_pixels_line'],
-                        **settings['hint_font_kwargs'],
-                        text=question['text_hint_column'],
-                        image_name=question_path)
+            layout = {'image_path': Images._get_image_path(
+                output_path=output_path, settings=settings, question=question),
+                'elements': list(), 'overflows': list()}
+
+            text_items = (('label', 'text_label_column'),
+                          ('hint', 'text_hint_column'))
+            for label_or_hint, column in text_items:
+                if len(question[column]) > 0:
+                    lines, pixels_from_top, overflows = Images._layout_text(
+                        image_size=image_size, pixels_from_top=pixels_from_top,
+                        pixels_before=settings['text_{0}_pixels_before'.format(
+                            label_or_hint)],
+                        pixels_between=settings['text_{0}_pixels_line'.format(
+                            label_or_hint)],
+                        font=settings['{0}_font_kwargs'.format(
+                            label_or_hint)]['font'],
+                        text=question[column])
+                    layout['elements'].append(
+                        ('text', '{0}_font_kwargs'.format(label_or_hint),
+                         lines))
+                    layout['overflows'].extend(overflows)
             if len(question['nest_image_column']) > 0:
-                nest = Images._locate_and_open_image(
+                nest_path = Images._locate_image_path(
                     image_path=question['nest_image_column'],
                     xlsform_path=xlsform_path)
-                question_image, pixels_from_top = Images._paste_image(
-                    base_image=question_image, pixels_from_top=pixels_from_top,
-                    paste_image=nest,
+                position, size, pixels_from_top = Images._layout_paste(
+                    image_size=image_size, pixels_from_top=pixels_from_top,
+                    paste_size=Images._read_image_size(image_path=nest_path),
                     pixels_before=settings['nest_image_pixels_before'],
                     max_height=None)
+                layout['elements'].append(
+                    ('image', nest_path, position, size))
+
+            layout['pixels_from_top'] = pixels_from_top
+            layout['image_size'] = Images._crop_size(
+                image_size=image_size, pixels_from_top=pixels_from_top,
+                settings=settings)
+            yield layout
+
+    @staticmethod
+    def _crop_size(image_size, pixels_from_top, settings):
+        """
+        Get the size of a question image, cropped to its content if enabled.
+
+        If the image_crop setting is 1, the height is reduced to the final
+        pixels_from_top plus the image_crop_margin, but not to less than the
+        image_crop_min_height. The image is never made taller.
+
+        Parameters.
+        :param image_size: tuple. Width and height of the base image.
+        :param pixels_from_top: int. Final vertical offset after all elements.
+        :param settings: dict. Image settings for a language.
+        :return: tuple. Width and height of the question image.
+        """
+        if settings.get('image_crop', 0) != 1:
+            return image_size
+        width, height = image_size
+        crop_height = max(pixels_from_top + settings['image_crop_margin'],
+                          settings['image_crop_min_height'], 1)
+        return width, min(height, crop_height)
+
+    @staticmethod
+    def _get_image_path(output_path, settings, question):
+        """
+        Get the output path for a question image.
+
+        The file extension is the one for the image_format setting, as per
+        IMAGE_FORMATS.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :param settings: dict. Image settings for a language.
+        :param question: dict. Image content for a question.
+        :return: str. Path to write the question image to.
+        """
+        return os.path.join(output_path, '{0}_{1}{2}'.format(
+            question['file_name_column'], settings['language'],
+            IMAGE_FORMATS[settings.get('image_format', 'png')]))
+
+    @staticmethod
+    def _get_profile_directory(output_path, profile_name):
+        """
+        Get the output directory for the images of an output profile.
+
+        Each profile's images are in a folder named for the profile, next to
+        the output path, in a folder with the same name as the output path,
+        e.g. "phone/Q1302_BEHAVE-media". So the profile folder can be used
+        with a copy of the XForm, for example to write the editions.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :param profile_name: str. Name of the output profile.
+        :return: str. Path to write the profile's images to.
+        """
+        parent, output_folder = os.path.split(output_path)
+        return os.path.join(parent, profile_name, output_folder)
+
+    @staticmethod
+    def _get_profile_path(image_path, profile_name):
+        """
+        Get the output path for a question image in an output profile.
+
+        Parameters.
+        :param image_path: str. Output path of the question image.
+        :param profile_name: str. Name of the output profile.
+        :return: str. Path to write the profile's question image to.
+        """
+        output_path, file_name = os.path.split(image_path)
+        return os.path.join(Images._get_profile_directory(
+            output_path=output_path, profile_name=profile_name), file_name)
+
+    @staticmethod
+    def _create_profile_directories(output_path, settings):
+        """
+        Create the output directory of each output profile, if any.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :param settings: dict. Image settings for a language.
+        """
+        for name, _ in ImageSettings._parse_profiles(
+                settings.get('image_profiles', '')):
+            os.makedirs(Images._get_profile_directory(
+                output_path=output_path, profile_name=name), exist_ok=True)
+
+    @staticmethod
+    def _render_layout(base_image, layout, settings, xlsform_path, scale=1):
+        """
+        Draw the elements of a question layout onto the base image.
+
+        Any text overflows found during layout are logged here, so that the
+        warnings appear as each image is rendered.
+
+        If the scale is not 1, for an output profile, the element positions
+        and sizes are scaled, and the text is drawn with the fonts loaded at
+        the scaled size. Overflows are then not logged again.
+
+        Parameters.
+        :param base_image: PIL.Image. Image to draw onto.
+        :param layout: dict. Question layout from _layout_question_images.
+        :param settings: dict. Image settings for a language.
+        :param xlsform_path: str. Path to xlsform.
+        :param scale: float. Factor to scale the layout by.
+        :return: PIL.Image. The modified base_image.
+        """
+        drawer = ImageDraw.Draw(base_image)
+        for element in layout['elements']:
+            if element[0] == 'text':
+                _, font_kwargs_key, lines = element
+                font_kwargs = settings[font_kwargs_key]
+                font = font_kwargs['font']
+                if scale != 1:
+                    font = ImageSettings._load_font(
+                        font=font.path, size=max(1, int(round(
+                            font.size * scale))))
+                for x, y, line in lines:
+                    drawer.text(Images._scale_size((x, y), scale), line,
+                                font=font, fill=font_kwargs['font_color'])
+            else:
+                _, nest_path, position, size = element
+                size = tuple(max(1, x) for x in Images._scale_size(
+                    size, scale))
+                nest = Images._open_resized_image(
+                    image_path=Images._locate_image_path(
+                        image_path=nest_path, xlsform_path=xlsform_path),
+                    size=size)
+                base_image.paste(nest, Images._scale_size(position, scale))
+        if scale == 1:
+            Images._log_overflows(
+                image_name=layout['image_path'],
+                overflows=layout['overflows'])
+        return base_image
+
+    @staticmethod
+    def plan(xlsform_path, settings, cache=None):
+        """
+        Calculate the layout of all question images without rendering them.
+
+        Each image that would be written, including the images of any output
+        profiles, is compared with the existing file, if there is one, by the
+        render inputs recorded when the file was written, see write. If there
+        is no record for the file and the cache has the image for the same
+        render inputs, the existing file is compared with the cached image.
+        Otherwise, the existing file is counted as changed. Nothing is
+        rendered.
+
+        Parameters.
+        :param xlsform_path: str. Path to xlsform.
+        :param settings: dict. Image settings and content for a language.
+        :param cache: ImageCache. Optional cache of rendered images.
+        :return: list. Layout dict for each question image, as per
+            _layout_question_images, plus an 'images' dict with the status of
+            each image path that would be written: "new", "changed" or
+            "unchanged".
+        """
+        output_path = Images._get_output_directory(xlsform_path)
+        image_size = (settings['image_width'], settings['image_height'])
+        pixels_from_top = 0
+        if len(settings['logo_image_path']) > 0:
+            logo_path = Images._locate_image_path(
+                image_path=settings['logo_image_path'],
+                xlsform_path=xlsform_path)
+            _, _, pixels_from_top = Images._layout_paste(
+                image_size=image_size, pixels_from_top=pixels_from_top,
+                paste_size=Images._read_image_size(image_path=logo_path),
+                pixels_before=settings['logo_image_pixels_before'],
+                max_height=settings['logo_image_height'])
+        layouts = list(Images._layout_question_images(
+            image_size=image_size, pixels_from_top=pixels_from_top,
+            settings=settings, output_path=output_path,
+            xlsform_path=xlsform_path))
+        profiles = ImageSettings._parse_profiles(
+            settings.get('image_profiles', ''))
+        settings_digest = Images._settings_digest(
+            settings=settings, xlsform_path=xlsform_path)
+        digests = Images._read_digests(output_path=output_path)
+        for question, layout in zip(settings['image_content'], layouts):
+            keys = Images._question_render_keys(
+                image_path=layout['image_path'],
+                settings_digest=settings_digest,
+                question_digest=Images._question_digest(
+                    question=question, xlsform_path=xlsform_path),
+                profiles=profiles)
+            layout['images'] = OrderedDict()
+            for image_path, key in keys:
+                status = 'new'
+                if os.path.isfile(image_path):
+                    status = Images._digest_status(
+                        digests=digests, output_path=output_path,
+                        image_path=image_path, key=key)
+                if status is None and cache is not None:
+                    entry_path = cache.lookup(
+                        key=key, extension=os.path.splitext(image_path)[1])
+                    if entry_path is not None and filecmp.cmp(
+                            image_path, entry_path, shallow=False):
+                        status = 'unchanged'
+                layout['images'][image_path] = status or 'changed'
+        return layouts
+
+    @staticmethod
+    def _get_digests_path(output_path):
+        """
+        Get the path of the image digests file for the output folder.
+
+        The file is next to the output folder rather than in it, so it isn't
+        copied with the images, e.g. "Q1302_BEHAVE-media.digests.json".
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :return: str. Path of the digests file.
+        """
+        return '{0}{1}'.format(output_path, DIGESTS_EXTENSION)
+
+    @staticmethod
+    def _digest_name(output_path, image_path):
+        """
+        Get the name of an image in the digests file.
+
+        The name is relative to the folder of the output folder, so that it
+        includes the profile folder for the images of output profiles.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :param image_path: str. Path of the image.
+        :return: str. Image name, with forward slashes.
+        """
+        return os.path.relpath(
+            image_path, os.path.dirname(output_path)).replace(os.sep, '/')
+
+    @staticmethod
+    def _digest_entry(image_path, key):
+        """
+        Get the digest entry for an image file and its render key.
+
+        The file size and modification time are included so that an image
+        changed since it was written doesn't match the entry.
+
+        Parameters.
+        :param image_path: str. Path of the image.
+        :param key: str. Render key, as per _question_render_keys.
+        :return: list. Render key, file size and modification time (ns).
+        """
+        stat = os.stat(image_path)
+        return [key, stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def _record_digest(digests, output_path, image_path, key):
+        """
+        Add the digest entry of an image that was just written.
+
+        If the image file doesn't exist, e.g. it was removed since, there is
+        nothing to record.
+
+        Parameters.
+        :param digests: dict. Digest entries, by image name.
+        :param output_path: str. Path to write images to.
+        :param image_path: str. Path of the image.
+        :param key: str. Render key, as per _question_render_keys.
+        """
+        try:
+            entry = Images._digest_entry(image_path=image_path, key=key)
+        except FileNotFoundError:
+            return
+        digests[Images._digest_name(
+            output_path=output_path, image_path=image_path)] = entry
+
+    @staticmethod
+    def _digest_status(digests, output_path, image_path, key):
+        """
+        Compare an existing image with its entry in the digests.
+
+        Parameters.
+        :param digests: dict. Digest entries, by image name.
+        :param output_path: str. Path to write images to.
+        :param image_path: str. Path of the existing image.
+        :param key: str. Render key the image would be written for.
+        :return: str. "unchanged" if the image was written for the key and
+            not changed since, "changed" if not, or None if there's no entry.
+        """
+        entry = digests.get(Images._digest_name(
+            output_path=output_path, image_path=image_path))
+        if entry is None:
+            return None
+        if entry == Images._digest_entry(image_path=image_path, key=key):
+            return 'unchanged'
+        return 'changed'
+
+    @staticmethod
+    def _read_digests(output_path):
+        """
+        Read the image digests file for the output folder.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :return: dict. Digest entries, by image name. Empty if the file is
+            missing or can't be read.
+        """
+        try:
+            with open(Images._get_digests_path(output_path),
+                      encoding='utf-8') as digests_file:
+                digests = json.load(digests_file)
+        except (OSError, ValueError):
+            return dict()
+        if not isinstance(digests, dict):
+            return dict()
+        return digests
+
+    @staticmethod
+    def _update_digests(output_path, digests):
+        """
+        Add digest entries to the image digests file for the output folder.
+
+        The file is written to a temporary file first, then replaced, so that
+        a plan run at the same time doesn't read a partial file.
+
+        Parameters.
+        :param output_path: str. Path to write images to.
+        :param digests: dict. Digest entries to add, by image name.
+        """
+        if len(digests) == 0:
+            return
+        all_digests = Images._read_digests(output_path=output_path)
+        all_digests.update(digests)
+        digests_path = Images._get_digests_path(output_path)
+        temp_path = '{0}.{1}.tmp'.format(digests_path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as digests_file:
+            json.dump(all_digests, digests_file, sort_keys=True)
+        os.replace(temp_path, digests_path)
+
+    @staticmethod
+    def _settings_digest(settings, xlsform_path):
+        """
+        Hash the language settings that affect the appearance of every image.
+
+        Settings that only select content or name files are excluded, and the
+        logo is included by the content of the image file, not its path. The
+        output profiles are excluded, since they are in the cache key of each
+        profile's images instead, and in the Watcher image digests.
 
-            yield question_image, question_path
+        Parameters.
+        :param settings: dict. Image settings for a language.
+        :param xlsform_path: str. Path to xlsform.
+        :return: str. Hex digest of the settings.
+        """
+        ignore = ('language', 'file_name_column', 'type_ignore_list',
+                  'logo_image_path', 'text_label_column', 'text_hint_column',
+                  'nest_image_column', 'image_profiles')
+        values = [(k, settings[k]) for k in
+                  sorted(ImageSettings._supported_settings())
+                  if k not in ignore and k in settings]
+        optional = ImageSettings._optional_settings()
+        values.extend((k, settings[k]) for k in sorted(optional)
+                      if k not in ignore and
+                      settings.get(k, optional[k][1]) != optional[k][1])
+        if len(settings['logo_image_path']) > 0:
+            logo_path = Images._locate_image_path(
+                image_path=settings['logo_image_path'],
+                xlsform_path=xlsform_path)
+            values.append(('logo_image', Images._file_digest(logo_path)))
+        return Images._value_digest(values)
+
+    @staticmethod
+    def _question_digest(question, xlsform_path):
+        """
+        Hash the question content that affects the appearance of its image.
+
+        Parameters.
+        :param question: dict. Image content for a question.
+        :param xlsform_path: str. Path to xlsform.
+        :return: str. Hex digest of the question content.
+        """
+        values = [question['text_label_column'], question['text_hint_column']]
+        if len(question['nest_image_column']) > 0:
+            nest_path = Images._locate_image_path(
+                image_path=question['nest_image_column'],
+                xlsform_path=xlsform_path)
+            values.append(Images._file_digest(nest_path))
+        return Images._value_digest(values)
+
+    @staticmethod
+    def _value_digest(values):
+        """
+        Hash a JSON serializable object.
+
+        Parameters.
+        :param values: list. Values to hash.
+        :return: str. Hex digest of the values.
+        """
+        serialized = json.dumps(values, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(serialized).hexdigest()
+
+    @staticmethod
+    def _file_digest(file_path):
+        """
+        Hash the content of a file.
+
+        Parameters.
+        :param file_path: str. Path to file to hash.
+        :return: str. Hex digest of the file content.
+        """
+        stat = os.stat(file_path)
+        return Images._file_digest_cached(
+            file_path=os.path.abspath(file_path), mtime=stat.st_mtime,
+            size=stat.st_size)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _file_digest_cached(file_path, mtime, size):
+        """
+        Hash the content of a file, re-using the result for unchanged files.
+
+        The same nested image is often used by many questions, so this avoids
+        reading it for each one. The mtime and size are only part of the key.
+
+        Parameters.
+        :param file_path: str. Absolute path to file to hash.
+        :param mtime: float. Modification time of the file.
+        :param size: int. Size of the file.
+        :return: str. Hex digest of the file content.
+        """
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as hash_file:
+            for chunk in iter(lambda: hash_file.read(65536), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
 
     @staticmethod
     def _create_output_directory(xlsform_path):
@@ -156,12 +1075,23 @@ class Images:
         :param xlsform_path: str. Path to input XLSX file.
         :return: str. Path to the output directory that was created.
         """
-        output_folder = '{0}-media'.format(
-            os.path.splitext(os.path.basename(xlsform_path))[0])
-        output_path = os.path.join(os.path.dirname(xlsform_path), output_folder)
+        output_path = Images._get_output_directory(xlsform_path)
         os.makedirs(output_path, exist_ok=True)
         return output_path
 
+    @staticmethod
+    def _get_output_directory(xlsform_path):
+        """
+        Get the path of the output directory for the xlsform's image files.
+
+        Parameters.
+        :param xlsform_path: str. Path to input XLSX file.
+        :return: str. Path to the output directory.
+        """
+        output_folder = '{0}-media'.format(
+            os.path.splitext(os.path.basename(xlsform_path))[0])
+        return os.path.join(os.path.dirname(xlsform_path), output_folder)
+
     @staticmethod
     def _create_blank_image(width, height, color):
         """
@@ -190,11 +1120,32 @@ class Images:
         :param image_margin: int. Pixel width of border to reserve.
         :return: PIL.Image (modified base_image), int (new vertical offset).
         """
-        pixels_from_top += pixels_before
-        base_image_x, base_image_y = base_image.size
+        position, size, pixels_from_top = Images._layout_paste(
+            image_size=base_image.size, pixels_from_top=pixels_from_top,
+            paste_size=paste_image.size, pixels_before=pixels_before,
+            max_height=max_height, image_margin=image_margin)
+        base_image.paste(Images._resize_image(paste_image, size), position)
+        return base_image, pixels_from_top
+
+    @staticmethod
+    def _layout_paste(image_size, pixels_from_top, paste_size,
+                      pixels_before, max_height=None, image_margin=10):
+        """
+        Calculate the position and size of an image to paste onto another.
 
-        paste_image_copy = paste_image.copy()
-        paste_image_x, paste_image_y = paste_image.size
+        Parameters.
+        :param image_size: tuple. Width and height of the image to paste onto.
+        :param pixels_from_top: int. Current pixel vertical offset.
+        :param paste_size: tuple. Width and height of the image to paste.
+        :param pixels_before: int. Pixel spacing from previous element.
+        :param max_height: int. Max pixel height for resizing paste_image.
+        :param image_margin: int. Pixel width of border to reserve.
+        :return: tuple (paste x/y position), tuple (resized width/height),
+            int (new vertical offset).
+        """
+        pixels_from_top += pixels_before
+        base_image_x, base_image_y = image_size
+        paste_image_x, paste_image_y = paste_size
 
         if max_height is None:
             max_height = base_image_y - pixels_from_top
@@ -204,13 +1155,102 @@ class Images:
 
         resize_x = min(base_image_x - image_margin * 2, paste_image_x)
         resize_y = min(max_height, paste_image_y)
-        paste_image_copy.thumbnail((resize_x, resize_y))
-        resized_x, resized_y = paste_image_copy.size
+        resized_x, resized_y = Images._fit_size(
+            size=paste_size, box=(resize_x, resize_y))
 
         paste_position_x = int((base_image_x - resized_x) / 2)
-        base_image.paste(paste_image_copy, (paste_position_x, pixels_from_top))
+        position = (paste_position_x, pixels_from_top)
         pixels_from_top += resized_y
-        return base_image, pixels_from_top
+        return position, (resized_x, resized_y), pixels_from_top
+
+    @staticmethod
+    def _fit_size(size, box):
+        """
+        Shrink a size to fit within a box, preserving the aspect ratio.
+
+        This is the same calculation as PIL.Image.thumbnail(), so that the
+        resized dimensions are known without having to resize the image.
+
+        Parameters.
+        :param size: tuple. Width and height to shrink.
+        :param box: tuple. Maximum width and height.
+        :return: tuple. Shrunk width and height.
+        """
+        x, y = size
+        if x > box[0]:
+            y = int(max(y * box[0] / x, 1))
+            x = int(box[0])
+        if y > box[1]:
+            x = int(max(x * box[1] / y, 1))
+            y = int(box[1])
+        return x, y
+
+    @staticmethod
+    def _resize_image(image, size):
+        """
+        Return a copy of the image resized to the size, e.g. from _fit_size.
+
+        Parameters.
+        :param image: PIL.Image. Image to resize.
+        :param size: tuple. Width and height to resize to.
+        :return: PIL.Image. Resized copy of the image.
+        """
+        if tuple(size) == image.size:
+            return image.copy()
+        return image.resize(size, Image.BICUBIC)
+
+    @staticmethod
+    def _open_resized_image(image_path, size):
+        """
+        Open an image resized to the size, re-using it for unchanged files.
+
+        The same nested image is often used by many questions and languages,
+        so this avoids decoding and resizing it for each one. The returned
+        image is shared, so it must not be modified or closed.
+
+        Parameters.
+        :param image_path: str. Path to image to open.
+        :param size: tuple. Width and height to resize to.
+        :return: PIL.Image. Resized image.
+        """
+        stat = os.stat(image_path)
+        return Images._open_resized_image_cached(
+            image_path=os.path.abspath(image_path), mtime=stat.st_mtime,
+            file_size=stat.st_size, size=tuple(size))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _open_resized_image_cached(image_path, mtime, file_size, size):
+        """
+        Open and resize an image. The mtime and file_size are only the key.
+
+        Parameters.
+        :param image_path: str. Absolute path to image to open.
+        :param mtime: float. Modification time of the file.
+        :param file_size: int. Size of the file.
+        :param size: tuple. Width and height to resize to.
+        :return: PIL.Image. Resized image.
+        """
+        image = Images._open_image_cached(
+            image_path=image_path, mtime=mtime, file_size=file_size)
+        return Images._resize_image(image, size)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _open_image_cached(image_path, mtime, file_size):
+        """
+        Open an image, re-using it for each size it is resized to.
+
+        With output profiles, a nested image is resized to a size for each
+        profile, and this avoids decoding it again for each size.
+
+        Parameters.
+        :param image_path: str. Absolute path to image to open.
+        :param mtime: float. Modification time of the file.
+        :param file_size: int. Size of the file.
+        :return: PIL.Image. Opened image, which must not be modified.
+        """
+        return Images._open_image(image_path=image_path)
 
     @staticmethod
     def _draw_text(base_image, pixels_from_top, pixels_before, pixels_between,
@@ -237,32 +1277,73 @@ class Images:
         :param image_margin: int: Margin around image border to reserve.
         :return: PIL.Image (modified base_image), int (new vertical offset).
         """
+        lines, pixels_from_top, overflows = Images._layout_text(
+            image_size=base_image.size, pixels_from_top=pixels_from_top,
+            pixels_before=pixels_before, pixels_between=pixels_between,
+            font=font, text=text, image_margin=image_margin)
+        drawer = ImageDraw.Draw(base_image)
+        for x, y, line in lines:
+            drawer.text((x, y), line, font=font, fill=font_color)
+        Images._log_overflows(image_name=image_name, overflows=overflows)
+        return base_image, pixels_from_top
+
+    @staticmethod
+    def _layout_text(image_size, pixels_from_top, pixels_before,
+                     pixels_between, font, text, image_margin=10):
+        """
+        Calculate the position of each line of text to draw onto an image.
+
+        Overflows are lines that exceed the image dimensions minus the
+        image_margin, described by a tuple of:
+        - dimension: 'width' or 'height',
+        - size: the size of the line in the above dimension,
+        - line: the line of text that was affected.
+
+        Parameters.
+        :param image_size: tuple. Width and height of the image to draw onto.
+        :param pixels_from_top: int. Current pixel vertical offset.
+        :param pixels_before: int. Pixel spacing from previous element.
+        :param pixels_between: int. Pixel spacing between text lines.
+        :param font: PIL.ImageFont. Font to use for drawing text.
+        :param text: list. Text to draw onto the image.
+        :param image_margin: int: Margin around image border to reserve.
+        :return: list (x, y, line), int (new vertical offset),
+            list (overflows).
+        """
         pixels_from_top += pixels_before
-        base_image_x, base_image_y = base_image.size
+        base_image_x, base_image_y = image_size
 
-        drawer = ImageDraw.Draw(base_image)
+        lines = list()
+        overflows = list()
         last_text_line = text[-1]
-        warn_fmt = "Text outside image margins." \
-                   " image name ({0}), dim ({1}), pos ({2}), text ({3})"
-
         for line in text:
-            text_x, text_y = drawer.textsize(line, font=font)
+            text_x, text_y = font.getsize(line)
             draw_position_x = int((base_image_x - text_x) / 2)
             draw_position_y = pixels_from_top
-            drawer.text((draw_position_x, draw_position_y), line, font=font,
-                        fill=font_color)
+            lines.append((draw_position_x, draw_position_y, line))
             pixels_from_top_add = text_y
             if line != last_text_line:
                 pixels_from_top_add += pixels_between
             pixels_from_top += pixels_from_top_add
             if text_x > (base_image_x - image_margin):
-                logger.warning(
-                    warn_fmt.format(image_name, 'width', text_x, line))
+                overflows.append(('width', text_x, line))
             if (draw_position_y + text_y) > (base_image_y - image_margin):
-                logger.warning(
-                    warn_fmt.format(image_name, 'height', text_y, line))
+                overflows.append(('height', text_y, line))
+        return lines, pixels_from_top, overflows
 
-        return base_image, pixels_from_top
+    @staticmethod
+    def _log_overflows(image_name, overflows):
+        """
+        Log a warning for each line of text that is outside the image margins.
+
+        Parameters.
+        :param image_name: str. Name of image the text is being drawn for.
+        :param overflows: list. Overflows found by _layout_text.
+        """
+        warn_fmt = "Text outside image margins." \
+                   " image name ({0}), dim ({1}), pos ({2}), text ({3})"
+        for dimension, size, line in overflows:
+            logger.warning(warn_fmt.format(image_name, dimension, size, line))
 
     @staticmethod
     def _locate_and_open_image(image_path, xlsform_path):
@@ -274,19 +1355,41 @@ class Images:
         :param xlsform_path: str. Path to xlsform.
         :return: PIL.Image The opened image.
         """
-        work_dir = os.path.dirname(xlsform_path)
-        try:
-            return Images._open_image(image_path=image_path)
-        except FileNotFoundError:
-            pass
-        try:
-            join_path = os.path.join(work_dir, image_path)
-            return Images._open_image(image_path=join_path)
-        except FileNotFoundError as fe:
-            msg = "Failed to open {0} as relative or absolute path. " \
-                  "Please check that the images exist in the locations that " \
-                  "are referred to in the xlsform.".format(image_path)
-            raise FileNotFoundError(msg, fe)
+        return Images._open_image(image_path=Images._locate_image_path(
+            image_path=image_path, xlsform_path=xlsform_path))
+
+    @staticmethod
+    def _locate_image_path(image_path, xlsform_path):
+        """
+        Find an image from the provided path, or as a path relative to xlsform.
+
+        Parameters.
+        :param image_path: str. Path to image to look for.
+        :param xlsform_path: str. Path to xlsform.
+        :return: str. Path to the existing image file.
+        """
+        if os.path.isfile(image_path):
+            return image_path
+        join_path = os.path.join(os.path.dirname(xlsform_path), image_path)
+        if os.path.isfile(join_path):
+            return join_path
+        msg = "Failed to open {0} as relative or absolute path. " \
+              "Please check that the images exist in the locations that " \
+              "are referred to in the xlsform.".format(image_path)
+        raise FileNotFoundError(msg)
+
+    @staticmethod
+    def _read_image_size(image_path):
+        """
+        Read the dimensions of an image from the file header only.
+
+        Parameters.
+        :param image_path: str. Path to image.
+        :return: tuple. Width and height of the image.
+        """
+        with open(image_path, 'rb') as image_file:
+            with Image.open(image_file) as image:
+                return image.size
 
     @staticmethod
     def _open_image(image_path):
@@ -313,12 +1416,14 @@ class ImageSettings:
     """Reads the image settings."""
 
     @staticmethod
-    def read(xlsform_workbook):
+    def read(xlsform_workbook, fonts=True):
         """
         Read image settings for each language from the xlsform workbook.
 
         Parameters.
         :param xlsform_workbook: xlrd workbook. XLSForm workbook object.
+        :param fonts: bool. If False, the fonts aren't loaded, for reading
+            settings that aren't used to draw the images.
         :return: dict[dict]. Key is column index, value is dict of settings.
         """
         sheet = xlsform_workbook.sheet_by_name(sheet_name='image_settings')
@@ -328,14 +1433,47 @@ class ImageSettings:
             settings.update(ImageSettings._read_language_settings_values(
                 image_settings_sheet=sheet, column_index=column_index,
                 settings=settings))
+            for name, (_, default) in \
+                    ImageSettings._optional_settings().items():
+                settings.setdefault(name, default)
+            ImageSettings._parse_profiles(settings['image_profiles'])
+            ImageSettings._check_image_format(settings['image_format'])
             settings['type_ignore_list'] = ImageSettings._csv_to_list(
                 settings['type_ignore_list'])
+            if not fonts:
+                continue
             settings['label_font_kwargs'] = ImageSettings._get_font_kwargs(
                 settings, 'label')
             settings['hint_font_kwargs'] = ImageSettings._get_font_kwargs(
                 settings, 'hint')
         return all_settings
 
+    @staticmethod
+    def read_image_formats(xlsform_workbook):
+        """
+        Read only the image_format setting for each language.
+
+        Parameters.
+        :param xlsform_workbook: xlrd workbook. XLSForm workbook object.
+        :return: dict. Key is column index, value is the image format.
+        """
+        if 'image_settings' not in xlsform_workbook.sheet_names():
+            return dict()
+        sheet = xlsform_workbook.sheet_by_name(sheet_name='image_settings')
+        columns = ImageSettings._locate_language_settings_columns(
+            image_settings_sheet=sheet)
+        image_formats = {x: 'png' for x in columns}
+        for i in range(1, sheet.nrows):
+            if sheet.cell_value(rowx=i, colx=0) != 'image_format':
+                continue
+            for column_index in columns:
+                value = str(sheet.cell_value(rowx=i, colx=column_index))
+                if value != '':
+                    image_formats[column_index] = value
+        for image_format in image_formats.values():
+            ImageSettings._check_image_format(image_format)
+        return image_formats
+
     @staticmethod
     def _csv_to_list(csv):
         """
@@ -371,18 +1509,22 @@ class ImageSettings:
         Read the image settings for each language in the image_settings sheet.
 
         Only supported settings are included, and the values are explicitly
-        cast to the expected type.
+        cast to the expected type. Optional settings are included if they
+        have a value.
 
         Parameters.
         :param image_settings_sheet: xlrd sheet. Image settings worksheet.
         :return: dict. Image settings for a language.
         """
         valid_names = ImageSettings._supported_settings()
+        optional_names = ImageSettings._optional_settings()
         for i in range(1, image_settings_sheet.nrows):
             name = image_settings_sheet.cell_value(rowx=i, colx=0)
             value = image_settings_sheet.cell_value(rowx=i, colx=column_index)
             if name in valid_names.keys():
                 settings[name] = valid_names[name](value)
+            elif name in optional_names.keys() and value != '':
+                settings[name] = optional_names[name][0](value)
         return settings
 
     @staticmethod
@@ -405,6 +1547,60 @@ class ImageSettings:
         all_kw = {**general, **logo, **label, **hint, **nest_image}
         return all_kw
 
+    @staticmethod
+    def _optional_settings():
+        """
+        A dictionary of optional image setting names, their types and default.
+
+        Settings that are not in the sheet, or are blank, get the default.
+        """
+        crop = {'image_crop': (int, 0), 'image_crop_margin': (int, 0),
+                'image_crop_min_height': (int, 0)}
+        profiles = {'image_profiles': (str, '')}
+        image_format = {'image_format': (str, 'png')}
+        return {**crop, **profiles, **image_format}
+
+    @staticmethod
+    def _check_image_format(image_format):
+        """
+        Check that the image_format setting is one that can be written.
+
+        Parameters.
+        :param image_format: str. One of IMAGE_FORMATS.
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(
+                "Expected image format to be one of {0}, got '{1}'.".format(
+                    ", ".join(IMAGE_FORMATS), image_format))
+        if image_format == 'webp' and not features.check('webp'):
+            raise ValueError("The image format 'webp' needs Pillow with WebP "
+                             "support, which is not installed.")
+
+    @staticmethod
+    def _parse_profiles(profiles):
+        """
+        Parse the image_profiles setting into the output profiles.
+
+        Each profile is a name and an image width in pixels, like "phone:720",
+        separated by commas. The profile images are scaled from the layout
+        for the image_width, so the height and font sizes are in proportion.
+
+        Parameters.
+        :param profiles: str. Comma separated "name:width" profiles.
+        :return: list. Tuples of (name, width).
+        """
+        parsed = list()
+        for profile in ImageSettings._csv_to_list(profiles):
+            if len(profile) == 0:
+                continue
+            name, _, width = (x.strip() for x in profile.partition(':'))
+            if len(name) == 0 or not width.isdigit() or int(width) == 0:
+                raise ValueError(
+                    "Expected image profiles like 'phone:720, tablet:1536', "
+                    "got '{0}'.".format(profiles))
+            parsed.append((name, int(width)))
+        return parsed
+
     @staticmethod
     def _get_font_kwargs(settings, label_or_hint):
         """
@@ -416,19 +1612,32 @@ class ImageSettings:
         :return: dict. Font kwargs.
         """
         font_kwargs = {
-            'font': ImageFont.truetype(
+            'font': ImageSettings._load_font(
                 font=settings['text_{0}_font_name'.format(label_or_hint)],
                 size=settings['text_{0}_font_size'.format(label_or_hint)]),
             'font_color': settings['text_{0}_font_color'.format(label_or_hint)]
         }
         return font_kwargs
 
+    @staticmethod
+    @functools.lru_cache(maxsize=64)
+    def _load_font(font, size):
+        """
+        Load a font, re-using it for all languages and forms in the process.
+
+        Parameters.
+        :param font: str. Font file name or path.
+        :param size: int. Font size.
+        :return: PIL.ImageFont.FreeTypeFont.
+        """
+        return ImageFont.truetype(font=font, size=size)
+
 
 class ImageContent:
     """Reads the image content for a given language's settings."""
 
     @staticmethod
-    def read(xlsform_workbook, settings):
+    def read(xlsform_workbook, settings, stream=False):
         """
         Read image content values for each language from the xlsform workbook.
 
@@ -436,28 +1645,59 @@ class ImageContent:
         - identify the content columns specified in the language settings.
         - read item content values for all settings columns.
 
+        If stream is True, the image content is a generator which reads and
+        wraps each question's content when it's reached, instead of a list.
+        So memory use for the content is independent of the number of
+        questions, but the content can only be iterated once. If the workbook
+        is an XlsxRows, the survey rows are also parsed as they're reached.
+
         Parameters.
-        :param xlsform_workbook: xlrd workbook. XLSForm workbook object.
+        :param xlsform_workbook: xlrd workbook, or XlsxRows. XLSForm workbook
+            object.
         :param settings: dict. Image settings for a language.
+        :param stream: bool. If True, read the content lazily.
         :return: dict[dict]. Key is column index, value is dict of settings.
         """
-        sheet = xlsform_workbook.sheet_by_name(sheet_name='survey')
+        rows = None
+        if isinstance(xlsform_workbook, XlsxRows):
+            rows = xlsform_workbook.iter_rows(sheet_name='survey')
+            sheet = RowsSheet(rows=[next(rows, list())])
+        else:
+            sheet = xlsform_workbook.sheet_by_name(sheet_name='survey')
         column_locations = ImageContent._locate_image_content_columns(
             survey_sheet=sheet, settings_values=settings)
-        raw_image_content = ImageContent._read_survey_image_content_values(
-            survey_sheet=sheet, column_locations=column_locations)
+        if rows is None:
+            raw_image_content = \
+                ImageContent._iter_survey_image_content_values(
+                    survey_sheet=sheet, column_locations=column_locations)
+        else:
+            raw_image_content = ImageContent._iter_row_image_content_values(
+                rows=rows, column_locations=column_locations)
+        image_content = ImageContent._iter_image_content(
+            raw_image_content=raw_image_content, settings=settings)
+        if not stream:
+            image_content = list(image_content)
+        settings['image_content'] = image_content
+        return settings
 
-        image_content = list()
+    @staticmethod
+    def _iter_image_content(raw_image_content, settings):
+        """
+        Yield the wrapped image content of each question that isn't ignored.
+
+        Parameters.
+        :param raw_image_content: iterable. Image content values of each
+            survey row, as per _iter_survey_image_content_values.
+        :param settings: dict. Image settings for a language.
+        :return: generator. Image content values.
+        """
         for i in raw_image_content:
             if i['item_type'] not in settings['type_ignore_list']:
                 i['text_label_column'] = ImageContent._wrap_text(
                     i['text_label_column'], settings['text_label_wrap_char'])
                 i['text_hint_column'] = ImageContent._wrap_text(
                     i['text_hint_column'], settings['text_hint_wrap_char'])
-                image_content.append(i)
-
-        settings['image_content'] = image_content
-        return settings
+                yield i
 
     @staticmethod
     def _locate_image_content_columns(survey_sheet, settings_values):
@@ -501,13 +1741,41 @@ class ImageContent:
         :param column_locations: dict. Column locations of image content.
         :return: list. Image content values.
         """
-        all_image_content = list()
+        return list(ImageContent._iter_survey_image_content_values(
+            survey_sheet=survey_sheet, column_locations=column_locations))
+
+    @staticmethod
+    def _iter_survey_image_content_values(survey_sheet, column_locations):
+        """
+        Yield the image content in the specified locations, row by row.
+
+        Parameters.
+        :param survey_sheet: xlrd sheet. Survey worksheet.
+        :param column_locations: dict. Column locations of image content.
+        :return: generator. Image content values.
+        """
         for row_index in range(1, survey_sheet.nrows):
             content = dict()
             for n, i in column_locations.items():
                 content[n] = survey_sheet.cell_value(rowx=row_index, colx=i)
-            all_image_content.append(content)
-        return all_image_content
+            yield content
+
+    @staticmethod
+    def _iter_row_image_content_values(rows, column_locations):
+        """
+        Yield the image content in the specified locations of each row.
+
+        Parameters.
+        :param rows: iterable. Cell values of each survey row, after the
+            header row, as per XlsxRows.iter_rows.
+        :param column_locations: dict. Column locations of image content.
+        :return: generator. Image content values.
+        """
+        for row in rows:
+            content = dict()
+            for n, i in column_locations.items():
+                content[n] = row[i] if i < len(row) else ''
+            yield content
 
     @staticmethod
     def _wrap_text(text, wrap_characters):
@@ -539,25 +1807,222 @@ class ImageContent:
         return flatten_paragraphs
 
 
-def write_images(xlsform_path):
+def _read_languages(xlsform_path, xlsform_workbook=None, image_settings=None,
+                    stream=False):
+    """
+    Yield the image settings of each language, with its image content.
+
+    The content of each language is read when it's reached. If stream is
+    True, each question's content is read as it's reached too, and if the
+    xlsform is a .xlsx file opened here, it's read with XlsxRows instead of
+    xlrd, so the survey rows are parsed as they're reached instead of all
+    being loaded when it's opened. So memory use doesn't depend on the
+    number of questions. The survey sheet is parsed again for each language.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform to process.
+    :param xlsform_workbook: xlrd workbook. As per write_images.
+    :param image_settings: dict[dict]. As per write_images.
+    :param stream: bool. If True, read the content as per ImageContent.read.
+    :return: generator. Image settings and content of each language.
+    """
+    opened = xlsform_workbook is None
+    if opened and stream and xlsform_path.endswith('.xlsx'):
+        xlsform_workbook = XlsxRows(file_path=xlsform_path)
+    elif opened:
+        xlsform_workbook = xlrd.open_workbook(filename=xlsform_path)
+    try:
+        settings = image_settings
+        if settings is None:
+            settings = ImageSettings.read(xlsform_workbook=xlsform_workbook)
+        for language in settings.values():
+            yield ImageContent.read(
+                xlsform_workbook=xlsform_workbook, settings=language,
+                stream=stream)
+    finally:
+        if isinstance(xlsform_workbook, XlsxRows) and opened:
+            xlsform_workbook.close()
+
+
+def write_images(xlsform_path, cache=None, stream=False,
+                 xlsform_workbook=None, image_settings=None):
     """
     Creates images for all languages and questions in the given xlsform.
 
     Parameters.
     :param xlsform_path: str. Path to xlsform to process.
+    :param cache: ImageCache. Optional cache of rendered images.
+    :param stream: bool. If True, each question's content is wrapped,
+        rendered and saved in turn, instead of wrapping all the content for a
+        language first. See _read_languages.
+    :param xlsform_workbook: xlrd workbook. The parsed xlsform, if already
+        open. If None, the xlsform is opened from xlsform_path.
+    :param image_settings: dict[dict]. The image settings of the xlsform, if
+        already read. If None, they are read with ImageSettings.read.
     """
-    xlsform_workbook = open_workbook(filename=xlsform_path)
-    settings = ImageSettings.read(xlsform_workbook=xlsform_workbook)
+    languages = _read_languages(
+        xlsform_path=xlsform_path, xlsform_workbook=xlsform_workbook,
+        image_settings=image_settings, stream=stream)
+    for language in languages:
+        try:
+            Images.write(xlsform_path=xlsform_path, settings=language,
+                         cache=cache)
+        except FileNotFoundError as fe:
+            logger.error(fe)
+        else:
+            msg = "Wrote images for language: {0}.".format(language['language'])
+            logger.info(msg=msg)
+        finally:
+            language.pop('image_content', None)
+
+
+def update_xform_images(xform_path, xlsform_path, xlsform_workbook=None):
+    """
+    Point the XForm's question image references at the written image files.
+
+    The XForm refers to the image names in the XLSForm, e.g. "q1_english.png",
+    but for languages with an image_format other than png, write_images saves
+    the image with that format's extension. Each "jr://images/" reference with
+    the same name stem as a question image is changed to the image file name.
+    The XForm is only written if any reference was changed. Only the
+    image_format settings are read until a language needs its references
+    changed, and the fonts are not loaded.
+
+    Parameters.
+    :param xform_path: str. Path to the XForm generated from the xlsform.
+    :param xlsform_path: str. Path to xlsform.
+    :param xlsform_workbook: xlrd workbook. As per write_images.
+    :return: int. Number of references changed.
+    """
+    if xlsform_workbook is None:
+        xlsform_workbook = xlrd.open_workbook(filename=xlsform_path)
+    image_formats = ImageSettings.read_image_formats(
+        xlsform_workbook=xlsform_workbook)
+    if all(IMAGE_FORMATS[x] == '.png' for x in image_formats.values()):
+        return 0
+    image_names = dict()
+    settings = ImageSettings.read(
+        xlsform_workbook=xlsform_workbook, fonts=False)
     for index, language in settings.items():
+        if IMAGE_FORMATS[image_formats[index]] == '.png':
+            continue
         language = ImageContent.read(
             xlsform_workbook=xlsform_workbook, settings=language)
+        for question in language.pop('image_content'):
+            image_name = os.path.basename(Images._get_image_path(
+                output_path='', settings=language, question=question))
+            image_names[os.path.splitext(image_name)[0]] = image_name
+    if len(image_names) == 0:
+        return 0
+    document = etree.parse(xform_path)
+    updated = 0
+    for node in document.iter():
+        if not isinstance(node.text, str) or \
+                not node.text.startswith(IMAGE_URI_PREFIX):
+            continue
+        name = node.text[len(IMAGE_URI_PREFIX):]
+        image_name = image_names.get(os.path.splitext(name)[0], name)
+        if image_name != name:
+            node.text = IMAGE_URI_PREFIX + image_name
+            updated += 1
+    if updated > 0:
+        document.write(xform_path, encoding='UTF-8', xml_declaration=True)
+    return updated
+
+
+def render_images(xlsform_path, output_path=None, write_media=False,
+                  stream=False, xlsform_workbook=None, profiles=True):
+    """
+    Creates images for all languages and questions in memory.
+
+    Each image is yielded as it is rendered and encoded, for adding to other
+    outputs such as the language edition zip files, so the images don't have
+    to be saved and read back. Optionally, the images are also saved.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform to process.
+    :param output_path: str. Path of the folder the images are named for. If
+        None, the "[xlsform]-media" folder next to the xlsform.
+    :param write_media: bool. If True, the images are also saved to the
+        output_path folder, as write_images would save them.
+    :param stream: bool. As per write_images.
+    :param xlsform_workbook: xlrd workbook. As per write_images.
+    :param profiles: bool. If False, the images of any output profiles in
+        the settings are not rendered.
+    :return: generator. Tuples of (image path, image data).
+    """
+    if output_path is None:
+        output_path = Images._get_output_directory(xlsform_path)
+    if write_media:
+        os.makedirs(output_path, exist_ok=True)
+    languages = _read_languages(
+        xlsform_path=xlsform_path, xlsform_workbook=xlsform_workbook,
+        stream=stream)
+    for language in languages:
+        if not profiles:
+            language['image_profiles'] = ''
         try:
-            Images.write(xlsform_path=xlsform_path, settings=language)
+            if write_media:
+                Images._create_profile_directories(
+                    output_path=output_path, settings=language)
+            images = Images.render(xlsform_path=xlsform_path,
+                                   settings=language, output_path=output_path)
+            for image_path, data in images:
+                if write_media:
+                    Images._save_image_data(data=data, image_path=image_path)
+                yield image_path, data
         except FileNotFoundError as fe:
             logger.error(fe)
         else:
-            msg = "Wrote images for language: {0}.".format(language['language'])
+            msg = "Rendered images for language: {0}.".format(
+                language['language'])
             logger.info(msg=msg)
+        finally:
+            language.pop('image_content', None)
+
+
+def plan_images(xlsform_path, cache=None):
+    """
+    Calculate the layout of all images in the xlsform, without writing any.
+
+    Text overflow warnings are logged as they would be by write_images, and
+    a summary is logged for each language of how many images would be written
+    (including the images of any output profiles), and how many of those
+    would be new files, change existing files, or leave them unchanged. See
+    Images.plan.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform to process.
+    :param cache: ImageCache. Optional cache of rendered images, used to
+        check existing images that have no recorded digest.
+    :return: dict. Key is language name, value is list of image layouts.
+    """
+    xlsform_workbook = xlrd.open_workbook(filename=xlsform_path)
+    settings = ImageSettings.read(xlsform_workbook=xlsform_workbook)
+    plans = dict()
+    summary_fmt = "Planned images for language: {0}. Images: {1}, " \
+                  "new: {2}, changed: {3}, unchanged: {4}, " \
+                  "with overflows: {5}."
+    for index, language in settings.items():
+        language = ImageContent.read(
+            xlsform_workbook=xlsform_workbook, settings=language)
+        try:
+            layouts = Images.plan(
+                xlsform_path=xlsform_path, settings=language, cache=cache)
+        except FileNotFoundError as fe:
+            logger.error(fe)
+            continue
+        for layout in layouts:
+            Images._log_overflows(
+                image_name=layout['image_path'], overflows=layout['overflows'])
+        statuses = [y for x in layouts for y in x['images'].values()]
+        overflowed = len([x for x in layouts if len(x['overflows']) > 0])
+        logger.info(summary_fmt.format(
+            language['language'], len(statuses), statuses.count('new'),
+            statuses.count('changed'), statuses.count('unchanged'),
+            overflowed))
+        plans[language['language']] = layouts
+    return plans
 
 
 def _create_parser():
@@ -570,6 +2035,31 @@ def _create_parser():
         help="Path to the Excel XSLX file with the XLSForm definition. "
              "The a folder with the name [XFormName]-media will be created "
              "in the same folder, which will contain the image files.")
+    parser.add_argument(
+        "--plan", dest="plan", action="store_true", default=False,
+        help="Only calculate the image layouts and report text overflows, "
+             "and which images would be new, changed or unchanged. No images "
+             "are saved.")
+    parser.add_argument(
+        "--cache", dest="cache", action="store_true", default=False,
+        help="Re-use identical images rendered before, for any form, from a "
+             "cache folder in the user's cache directory, or the folder given "
+             "with --cache-dir.")
+    parser.add_argument(
+        "--cache-dir", dest="cache_dir", default=None,
+        help="Folder for the image cache. Implies --cache.")
+    parser.add_argument(
+        "--cache-size", dest="cache_size", type=int, default=512,
+        help="Size cap for the image cache in MB. When exceeded, the least "
+             "recently used images are removed.")
+    parser.add_argument(
+        "--cache-link", dest="cache_link", action="store_true", default=False,
+        help="Hard link images from the cache instead of copying them.")
+    parser.add_argument(
+        "--stream", dest="stream", action="store_true", default=False,
+        help="Read, render and save each question's image in turn, so that "
+             "memory use doesn't grow with the number of questions. Useful "
+             "for very large forms.")
     return parser
 
 
@@ -580,7 +2070,17 @@ def main_cli():
     parser = _create_parser()
     args = parser.parse_args()
     logger.addHandler(logging.StreamHandler())
-    write_images(xlsform_path=args.xlsform)
+    cache = None
+    if args.cache or args.cache_dir is not None:
+        cache = ImageCache(
+            cache_path=args.cache_dir,
+            max_size=args.cache_size * 1024 ** 2, link=args.cache_link)
+    if args.plan:
+        logger.setLevel(logging.INFO)
+        plan_images(xlsform_path=args.xlsform, cache=cache)
+    else:
+        write_images(xlsform_path=args.xlsform, cache=cache,
+                     stream=args.stream)
 
 
 if __name__ == '__main__':
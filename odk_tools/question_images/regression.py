@@ -0,0 +1,469 @@
+import io
+import os
+import sys
+import html
+import shutil
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from odk_tools.lazy import lazy_import
+from odk_tools.question_images.images import Images, ImageSettings, \
+    write_images, IMAGE_FORMATS
+
+Image = lazy_import('PIL.Image')
+xlrd = lazy_import('xlrd')
+ImageChops = lazy_import('PIL.ImageChops')
+np = lazy_import('numpy')
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Pixels are put in a bucket by the largest difference of their RGB channels:
+# tiny is 1-2, minor is 3-14, and large is 15 or more.
+MINOR_FROM = 3
+LARGE_FROM = 15
+DEFAULT_THRESHOLDS = {'tiny': 0.01, 'minor': 0.001, 'large': 0.0}
+HIGHLIGHT_COLORS = {'tiny': (0, 160, 255), 'minor': (255, 165, 0),
+                    'large': (255, 0, 0)}
+
+
+class GoldenImages:
+    """
+    Compares rendered question images with a golden set of images.
+
+    Each pair of images is compared pixel by pixel, with NumPy arrays, and
+    the differing pixels are counted in tiny, minor and large buckets (see
+    MINOR_FROM and LARGE_FROM). An image passes if the count for each bucket,
+    as a fraction of all pixels, is within its threshold. The defaults
+    tolerate the slight anti-aliasing differences seen between platforms.
+
+    NumPy is only needed for this module, so it's the optional "regression"
+    extra in setup.py rather than an install requirement. It's also in
+    requirements.txt, so the development environment can run the tests.
+    """
+
+    @staticmethod
+    def difference_counts(observed, golden):
+        """
+        Count the pixels in each difference bucket for two same size images.
+
+        Parameters.
+        :param observed: PIL.Image. Rendered image.
+        :param golden: PIL.Image. Golden image.
+        :return: dict (pixel count per bucket, and total "pixels"),
+            numpy.ndarray (largest channel difference of each pixel).
+        """
+        diff = ImageChops.difference(
+            observed.convert('RGB'), golden.convert('RGB'))
+        channels = np.asarray(diff)
+        largest = np.maximum(np.maximum(
+            channels[:, :, 0], channels[:, :, 1]), channels[:, :, 2])
+        histogram = np.bincount(largest.ravel(), minlength=256)
+        counts = {'pixels': int(largest.size),
+                  'tiny': int(histogram[1:MINOR_FROM].sum()),
+                  'minor': int(histogram[MINOR_FROM:LARGE_FROM].sum()),
+                  'large': int(histogram[LARGE_FROM:].sum())}
+        return counts, largest
+
+    @staticmethod
+    def within_thresholds(counts, thresholds):
+        """
+        Check if the difference counts are within the thresholds.
+
+        Parameters.
+        :param counts: dict. Output of difference_counts.
+        :param thresholds: dict. Maximum fraction of pixels for each bucket.
+        :return: bool. True if all buckets are within their threshold.
+        """
+        return all(counts[x] <= counts['pixels'] * thresholds[x]
+                   for x in ('tiny', 'minor', 'large'))
+
+    @staticmethod
+    def compare(name, observed_path, golden_path, thresholds,
+                report_path=None):
+        """
+        Compare an image with its golden image.
+
+        Files with identical content pass without being decoded. If the
+        images differ by more than the thresholds and a report_path is given,
+        a diff image is written there (see _write_diff_image).
+
+        Parameters.
+        :param name: str. Path of the image within the folders, e.g.
+            "phone/q1.png" for an output profile's image.
+        :param observed_path: str. Path to the rendered image, or None.
+        :param golden_path: str. Path to the golden image, or None.
+        :param thresholds: dict. Maximum fraction of pixels for each bucket.
+        :param report_path: str. Folder to write the diff image to.
+        :return: dict. Result with the name, status ("pass", "fail", "new"
+            or "missing"), reason, difference counts and diff image name.
+        """
+        result = {'name': name, 'status': 'pass', 'reason': '',
+                  'pixels': 0, 'tiny': 0, 'minor': 0, 'large': 0,
+                  'diff_image': None}
+        if golden_path is None:
+            result.update(status='new', reason='No golden image.')
+            return result
+        if observed_path is None:
+            result.update(status='missing', reason='Image was not rendered.')
+            return result
+        observed_data = GoldenImages._read_file(observed_path)
+        golden_data = GoldenImages._read_file(golden_path)
+        if observed_data == golden_data:
+            return result
+        observed = GoldenImages._decode_image(observed_data)
+        golden = GoldenImages._decode_image(golden_data)
+        if observed.size != golden.size:
+            result.update(status='fail', reason='Size {0} != golden {1}.'
+                          .format(observed.size, golden.size))
+            return result
+        counts, largest = GoldenImages.difference_counts(
+            observed=observed, golden=golden)
+        result.update(counts)
+        if not GoldenImages.within_thresholds(counts, thresholds):
+            result.update(status='fail', reason='Over threshold.')
+            if report_path is not None:
+                result['diff_image'] = GoldenImages._write_diff_image(
+                    name=name, observed=observed, golden=golden,
+                    largest=largest, report_path=report_path)
+        return result
+
+    @staticmethod
+    def _read_file(file_path):
+        """
+        Read the content of a file.
+
+        Parameters.
+        :param file_path: str. Path to the file.
+        :return: bytes. File content.
+        """
+        with open(file_path, 'rb') as image_file:
+            return image_file.read()
+
+    @staticmethod
+    def _decode_image(data):
+        """
+        Decode an image from the file content.
+
+        Parameters.
+        :param data: bytes. Image file content.
+        :return: PIL.Image. Decoded image.
+        """
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    @staticmethod
+    def _write_diff_image(name, observed, golden, largest, report_path):
+        """
+        Write the golden image, observed image and highlighted differences
+        side by side, for the report.
+
+        Differing pixels are coloured by bucket (see HIGHLIGHT_COLORS) over a
+        faded copy of the observed image.
+
+        Parameters.
+        :param name: str. Path of the image within the folders.
+        :param observed: PIL.Image. Rendered image.
+        :param golden: PIL.Image. Golden image.
+        :param largest: numpy.ndarray. Largest channel difference per pixel.
+        :param report_path: str. Folder to write the diff image to.
+        :return: str. File name of the diff image.
+        """
+        faded = np.asarray(observed.convert('L')) // 4 + 191
+        highlight = np.repeat(faded[:, :, None], 3, axis=2).astype(np.uint8)
+        buckets = (('tiny', (largest > 0) & (largest < MINOR_FROM)),
+                   ('minor', (largest >= MINOR_FROM) & (largest < LARGE_FROM)),
+                   ('large', largest >= LARGE_FROM))
+        for bucket, mask in buckets:
+            highlight[mask] = HIGHLIGHT_COLORS[bucket]
+        width, height = observed.size
+        diff_image = Image.new('RGB', (width * 3, height), 'white')
+        diff_image.paste(golden.convert('RGB'), (0, 0))
+        diff_image.paste(observed.convert('RGB'), (width, 0))
+        diff_image.paste(Image.fromarray(highlight), (width * 2, 0))
+        diff_name = '{0}_diff.png'.format(os.path.splitext(name)[0])
+        diff_path = os.path.join(report_path, *diff_name.split('/'))
+        os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+        diff_image.save(diff_path, 'PNG')
+        return diff_name
+
+    @staticmethod
+    def compare_folders(observed_path, golden_path, thresholds=None,
+                        report_path=None, workers=None, profiles=()):
+        """
+        Compare every image in a folder with the golden image of the same
+        name, including the images in sub-folders, such as those of the
+        output profiles.
+
+        The images are compared concurrently, since decoding the images and
+        the NumPy operations mostly run without holding the GIL.
+
+        Parameters.
+        :param observed_path: str. Folder of rendered images.
+        :param golden_path: str. Folder of golden images.
+        :param thresholds: dict. Maximum fraction of pixels for each bucket.
+            If None, DEFAULT_THRESHOLDS is used.
+        :param report_path: str. Folder to write diff images to.
+        :param workers: int. Number of threads. If None, the number of CPUs.
+        :param profiles: list. Names of the output profiles. Each profile's
+            rendered images are compared with the golden images in the
+            profile's sub-folder, e.g. "phone/q1.png".
+        :return: list. Result for each image name, as per compare().
+        """
+        if thresholds is None:
+            thresholds = DEFAULT_THRESHOLDS
+        observed = GoldenImages._list_images(observed_path)
+        for profile in profiles:
+            profile_images = GoldenImages._list_images(
+                Images._get_profile_directory(
+                    output_path=observed_path, profile_name=profile))
+            observed.update(('{0}/{1}'.format(profile, k), v)
+                            for k, v in profile_images.items())
+        golden = GoldenImages._list_images(golden_path)
+        names = sorted(set(observed) | set(golden))
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) \
+                as executor:
+            results = list(executor.map(
+                lambda x: GoldenImages.compare(
+                    name=x, observed_path=observed.get(x),
+                    golden_path=golden.get(x), thresholds=thresholds,
+                    report_path=report_path), names))
+        return results
+
+    @staticmethod
+    def _list_images(folder_path):
+        """
+        List the images in a folder and its sub-folders, in any of the
+        IMAGE_FORMATS.
+
+        Parameters.
+        :param folder_path: str. Folder to list.
+        :return: dict. Key is the path within the folder, with "/" between
+            the folder names, value is the path.
+        """
+        if not os.path.isdir(folder_path):
+            return dict()
+        extensions = tuple(set(IMAGE_FORMATS.values()))
+        images = dict()
+        for base, dirs, files in os.walk(folder_path):
+            for file in files:
+                if file.lower().endswith(extensions):
+                    image_path = os.path.join(base, file)
+                    images[os.path.relpath(image_path, folder_path).replace(
+                        os.sep, '/')] = image_path
+        return images
+
+    @staticmethod
+    def write_report(results, report_path, thresholds=None):
+        """
+        Write an HTML report of the comparison results.
+
+        Failed, missing and new images are listed first, with the diff image
+        for each failed image.
+
+        Parameters.
+        :param results: list. Output of compare_folders.
+        :param report_path: str. Folder to write "index.html" to.
+        :param thresholds: dict. Thresholds used, to show in the report.
+        :return: str. Path to the report.
+        """
+        if thresholds is None:
+            thresholds = DEFAULT_THRESHOLDS
+        os.makedirs(report_path, exist_ok=True)
+        order = {'fail': 0, 'missing': 1, 'new': 2, 'pass': 3}
+        rows = list()
+        for result in sorted(results, key=lambda x: (order[x['status']],
+                                                     x['name'])):
+            diff = ''
+            if result['diff_image'] is not None:
+                diff = '<img src="{0}" alt="diff">'.format(
+                    html.escape(result['diff_image']))
+            rows.append(
+                '<tr class="{0}"><td>{1}</td><td>{0}</td><td>{2}</td>'
+                '<td>{3}</td><td>{4}</td><td>{5}</td><td>{6}</td></tr>'.format(
+                    result['status'], html.escape(result['name']),
+                    html.escape(result['reason']), result['tiny'],
+                    result['minor'], result['large'], diff))
+        summary = ', '.join('{0}: {1}'.format(
+            x, len([y for y in results if y['status'] == x])) for x in order)
+        limits = ', '.join('{0} &lt;= {1:.2%}'.format(x, thresholds[x])
+                           for x in ('tiny', 'minor', 'large'))
+        page = REPORT_TEMPLATE.format(
+            summary=summary, thresholds=limits, rows='\n'.join(rows))
+        index_path = os.path.join(report_path, 'index.html')
+        with open(index_path, 'w', encoding='utf-8') as index_file:
+            index_file.write(page)
+        return index_path
+
+    @staticmethod
+    def update_golden(observed_path, golden_path, profiles=()):
+        """
+        Replace the golden images with the rendered images.
+
+        Parameters.
+        :param observed_path: str. Folder of rendered images.
+        :param golden_path: str. Folder of golden images.
+        :param profiles: list. Names of the output profiles, as per
+            compare_folders.
+        """
+        if os.path.isdir(golden_path):
+            shutil.rmtree(golden_path)
+        shutil.copytree(observed_path, golden_path)
+        for profile in profiles:
+            profile_path = Images._get_profile_directory(
+                output_path=observed_path, profile_name=profile)
+            if os.path.isdir(profile_path):
+                shutil.copytree(
+                    profile_path, os.path.join(golden_path, profile))
+
+    @staticmethod
+    def read_profiles(xlsform_path):
+        """
+        Read the names of the output profiles of all languages in the xlsform.
+
+        Parameters.
+        :param xlsform_path: str. Path to xlsform.
+        :return: list. Profile names, in order of first use.
+        """
+        workbook = xlrd.open_workbook(filename=xlsform_path)
+        settings = ImageSettings.read(xlsform_workbook=workbook, fonts=False)
+        profiles = list()
+        for language in settings.values():
+            for name, _ in ImageSettings._parse_profiles(
+                    language['image_profiles']):
+                if name not in profiles:
+                    profiles.append(name)
+        return profiles
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Question image regression report</title>
+<style>
+body {{font-family: sans-serif;}}
+table {{border-collapse: collapse;}}
+td, th {{border: 1px solid #ccc; padding: 4px; vertical-align: top;}}
+tr.fail td {{background: #fdd;}}
+tr.missing td, tr.new td {{background: #ffd;}}
+img {{max-width: 1200px;}}
+</style>
+</head>
+<body>
+<h1>Question image regression report</h1>
+<p>{summary}</p>
+<p>Thresholds (fraction of pixels): {thresholds}. Diff images show the golden
+image, the rendered image, then the differences: tiny (blue), minor (orange)
+and large (red).</p>
+<table>
+<tr><th>image</th><th>status</th><th>reason</th><th>tiny</th><th>minor</th>
+<th>large</th><th>diff</th></tr>
+{rows}
+</table>
+</body>
+</html>
+"""
+
+
+def check_images(xlsform_path, golden_path, report_path=None, render=True,
+                 update=False, thresholds=None, workers=None):
+    """
+    Compare the images for an xlsform with a golden set of images.
+
+    The images of any output profiles in the image settings are compared
+    with the golden images in the profile's sub-folder of golden_path.
+
+    Parameters.
+    :param xlsform_path: str. Path to xlsform.
+    :param golden_path: str. Folder of golden images.
+    :param report_path: str. Folder to write the HTML report and diff images
+        to. If None, no report is written.
+    :param render: bool. If True, write the images first, otherwise compare
+        the images already in the xlsform's media folder.
+    :param update: bool. If True, replace the golden images with the
+        rendered images instead of comparing them.
+    :param thresholds: dict. Maximum fraction of pixels for each bucket.
+    :param workers: int. Number of threads for comparing images.
+    :return: list. Result for each image name, as per GoldenImages.compare.
+    """
+    if render:
+        write_images(xlsform_path=xlsform_path)
+    observed_path = Images._get_output_directory(xlsform_path)
+    profiles = GoldenImages.read_profiles(xlsform_path=xlsform_path)
+    if update:
+        GoldenImages.update_golden(
+            observed_path=observed_path, golden_path=golden_path,
+            profiles=profiles)
+        logger.info("Updated golden images in: {0}".format(golden_path))
+        return list()
+    results = GoldenImages.compare_folders(
+        observed_path=observed_path, golden_path=golden_path,
+        thresholds=thresholds, report_path=report_path, workers=workers,
+        profiles=profiles)
+    if report_path is not None:
+        index_path = GoldenImages.write_report(
+            results=results, report_path=report_path, thresholds=thresholds)
+        logger.info("Wrote report: {0}".format(index_path))
+    for result in results:
+        if result['status'] != 'pass':
+            logger.warning("{0}: {1}. {2}".format(
+                result['name'], result['status'], result['reason']))
+    return results
+
+
+def _create_parser():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare question images with a golden set of images.")
+    parser.add_argument(
+        "xlsform", help="Path to the XLSForm to write images for.")
+    parser.add_argument(
+        "golden", help="Path to the folder of golden images.")
+    parser.add_argument(
+        "--report", dest="report", default=None,
+        help="Folder to write an HTML report and diff images to.")
+    parser.add_argument(
+        "--no-render", dest="render", action="store_false", default=True,
+        help="Compare the images already in the XLSForm's media folder.")
+    parser.add_argument(
+        "--update", dest="update", action="store_true", default=False,
+        help="Replace the golden images with the rendered images.")
+    for bucket, value in sorted(DEFAULT_THRESHOLDS.items()):
+        parser.add_argument(
+            "--{0}".format(bucket), dest=bucket, type=float, default=value,
+            help="Maximum fraction of pixels with {0} differences. Default: "
+                 "{1}.".format(bucket, value))
+    parser.add_argument(
+        "--workers", dest="workers", type=int, default=None,
+        help="Number of threads for comparing images.")
+    return parser
+
+
+def main_cli():
+    """
+    Collect script arguments from stdin and run check_images.
+
+    The exit code is 1 if any image was not a pass.
+    """
+    parser = _create_parser()
+    args = parser.parse_args()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    thresholds = {x: getattr(args, x) for x in DEFAULT_THRESHOLDS}
+    results = check_images(
+        xlsform_path=args.xlsform, golden_path=args.golden,
+        report_path=args.report, render=args.render, update=args.update,
+        thresholds=thresholds, workers=args.workers)
+    failed = [x for x in results if x['status'] != 'pass']
+    logger.info("Compared {0} images, {1} not passed.".format(
+        len(results), len(failed)))
+    sys.exit(1 if len(failed) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,267 @@
+import array
+import posixpath
+import re
+import tempfile
+import zipfile
+from collections import OrderedDict
+from odk_tools.lazy import lazy_import
+
+etree = lazy_import('lxml.etree')
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS_NS = \
+    '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+CELL_REFERENCE = re.compile('^([A-Z]+)')
+
+
+class RowsSheet:
+    """
+    A sheet of rows already read, with the xlrd sheet methods used here.
+
+    Cells past the end of a row are blank, as xlrd gives them.
+    """
+
+    def __init__(self, rows):
+        """
+        Parameters.
+        :param rows: list[list]. Cell values of each row.
+        """
+        self.rows = rows
+        self.nrows = len(rows)
+        self.ncols = max((len(x) for x in rows), default=0)
+
+    def cell_value(self, rowx, colx):
+        """
+        Get the value of a cell, or '' if it's blank.
+
+        Parameters.
+        :param rowx: int. Row index.
+        :param colx: int. Column index.
+        """
+        row = self.rows[rowx]
+        if colx < len(row):
+            return row[colx]
+        return ''
+
+
+class XlsxRows:
+    """
+    Reads the rows of a .xlsx workbook's sheets lazily, one row at a time.
+
+    xlrd parses every sheet of a .xlsx file when it's opened, so memory use
+    grows with the size of the XLSForm. Here, each sheet's XML is parsed
+    incrementally from the zip file as its rows are iterated, and each row
+    is dropped once read. The shared strings, which the cells refer to by
+    index, are copied to a temporary file once, so only their offsets are
+    kept in memory. Cell values are as xlrd gives them: text as str, numbers
+    as float, booleans as int, and blank cells as ''.
+
+    Usage:
+    with XlsxRows(file_path="Q1302_BEHAVE.xlsx") as workbook:
+        for row in workbook.iter_rows(sheet_name="survey"):
+            print(row)
+    """
+
+    def __init__(self, file_path):
+        """
+        Parameters.
+        :param file_path: str. Path to the .xlsx file.
+        """
+        self.zip_file = zipfile.ZipFile(file_path)
+        self.strings = None
+        self.string_offsets = array.array('q', [0])
+        try:
+            self.sheet_paths = self._read_sheet_paths()
+            self.strings = tempfile.TemporaryFile()
+            self._spool_shared_strings()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Close the zip file and remove the shared strings file."""
+        if self.strings is not None:
+            self.strings.close()
+            self.strings = None
+        self.zip_file.close()
+
+    def sheet_names(self):
+        """
+        Get the sheet names, in workbook order.
+
+        :return: list. Sheet names.
+        """
+        return list(self.sheet_paths)
+
+    def sheet_by_name(self, sheet_name):
+        """
+        Read all the rows of a sheet, for small sheets like image_settings.
+
+        Parameters.
+        :param sheet_name: str. Name of the sheet.
+        :return: RowsSheet.
+        """
+        return RowsSheet(rows=list(self.iter_rows(sheet_name=sheet_name)))
+
+    def iter_rows(self, sheet_name):
+        """
+        Yield the cell values of each row of a sheet, as the XML is parsed.
+
+        Blank rows, which may be missing from the XML, are yielded as empty
+        lists, so the row positions match the sheet, except after the last
+        row with a value, since xlrd doesn't count those rows either.
+
+        Parameters.
+        :param sheet_name: str. Name of the sheet.
+        :return: generator. List of cell values of each row.
+        """
+        sheet_path = self.sheet_paths.get(sheet_name)
+        if sheet_path is None:
+            raise KeyError("No sheet named <'{0}'>".format(sheet_name))
+        row_index = 0
+        with self.zip_file.open(sheet_path) as sheet_xml:
+            for _, row in etree.iterparse(
+                    sheet_xml, events=('end',), tag=MAIN_NS + 'row'):
+                position = int(row.get('r', row_index + 1)) - 1
+                values = self._row_values(row=row)
+                XlsxRows._drop_element(element=row)
+                if all(x == '' for x in values):
+                    continue
+                while row_index < position:
+                    yield list()
+                    row_index += 1
+                yield values
+                row_index += 1
+
+    def _row_values(self, row):
+        """
+        Read the cell values of a row element.
+
+        Parameters.
+        :param row: lxml element. A worksheet "row" element.
+        :return: list. Cell values, with blank cells as ''.
+        """
+        values = list()
+        for cell in row.iterchildren(MAIN_NS + 'c'):
+            reference = CELL_REFERENCE.match(cell.get('r', ''))
+            if reference is not None:
+                column_index = XlsxRows._column_index(reference.group(1))
+                values.extend([''] * (column_index - len(values)))
+            values.append(self._cell_value(cell=cell))
+        return values
+
+    def _cell_value(self, cell):
+        """
+        Read the value of a cell element, as xlrd would.
+
+        Parameters.
+        :param cell: lxml element. A worksheet "c" element.
+        :return: str, float or int.
+        """
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            return XlsxRows._text(cell.find(MAIN_NS + 'is'))
+        value = cell.findtext(MAIN_NS + 'v')
+        if value is None:
+            return ''
+        if cell_type == 's':
+            return self._shared_string(index=int(value))
+        if cell_type == 'b':
+            return int(value)
+        if cell_type in ('str', 'e'):
+            return value
+        return float(value)
+
+    @staticmethod
+    def _column_index(letters):
+        """
+        Convert column letters to a column index, e.g. "A" is 0, "AA" is 26.
+
+        Parameters.
+        :param letters: str. Column letters of a cell reference.
+        """
+        index = 0
+        for letter in letters:
+            index = index * 26 + ord(letter) - ord('A') + 1
+        return index - 1
+
+    @staticmethod
+    def _text(element):
+        """
+        Get the text of a string item, joining its runs, without phonetics.
+
+        Parameters.
+        :param element: lxml element. An "si" or "is" element, or None.
+        :return: str.
+        """
+        if element is None:
+            return ''
+        text = element.findtext(MAIN_NS + 't')
+        if text is not None:
+            return text
+        return ''.join(x.findtext(MAIN_NS + 't', default='')
+                       for x in element.iterchildren(MAIN_NS + 'r'))
+
+    @staticmethod
+    def _drop_element(element):
+        """
+        Clear a parsed element, and drop its earlier siblings from the tree.
+
+        Parameters.
+        :param element: lxml element. Element that has been read.
+        """
+        element.clear()
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+    def _read_sheet_paths(self):
+        """
+        Read the zip file path of each sheet, in workbook order.
+
+        :return: OrderedDict. Key is sheet name, value is the XML file path.
+        """
+        with self.zip_file.open('xl/_rels/workbook.xml.rels') as rels_xml:
+            targets = {x.get('Id'): x.get('Target') for x in etree.parse(
+                rels_xml).iter(PACKAGE_NS + 'Relationship')}
+        with self.zip_file.open('xl/workbook.xml') as workbook_xml:
+            sheets = etree.parse(workbook_xml).iter(MAIN_NS + 'sheet')
+            sheet_paths = [(x.get('name'), targets[x.get(
+                RELATIONSHIPS_NS + 'id')]) for x in sheets]
+        return OrderedDict(
+            (name, target.lstrip('/') if target.startswith('/') else
+             posixpath.normpath(posixpath.join('xl', target)))
+            for name, target in sheet_paths)
+
+    def _spool_shared_strings(self):
+        """
+        Copy the shared strings to the temporary file, noting their offsets.
+        """
+        if 'xl/sharedStrings.xml' not in self.zip_file.namelist():
+            return
+        with self.zip_file.open('xl/sharedStrings.xml') as strings_xml:
+            for _, item in etree.iterparse(
+                    strings_xml, events=('end',), tag=MAIN_NS + 'si'):
+                self.strings.write(XlsxRows._text(item).encode('utf-8'))
+                self.string_offsets.append(self.strings.tell())
+                XlsxRows._drop_element(element=item)
+
+    def _shared_string(self, index):
+        """
+        Read a shared string from the temporary file.
+
+        Parameters.
+        :param index: int. Index of the string in the shared strings.
+        :return: str.
+        """
+        start = self.string_offsets[index]
+        self.strings.seek(start)
+        return self.strings.read(
+            self.string_offsets[index + 1] - start).decode('utf-8')
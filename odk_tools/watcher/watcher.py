@@ -0,0 +1,324 @@
+import argparse
+import os
+import time
+import logging
+from odk_tools.lazy import lazy_import
+from odk_tools.question_images.images import Images, ImageSettings, \
+    ImageContent, update_xform_images
+
+xlrd = lazy_import('xlrd')
+xls2xform = lazy_import('pyxform.xls2xform')
+
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class Watcher:
+    """
+    Regenerates the XForm and question images when the XLSForm inputs change.
+
+    The XLSForm, logo images and nested images are polled for changes to their
+    modification time or size. Once the files have stopped changing for the
+    debounce period, one rebuild is run. This is so that a burst of saves,
+    such as Excel writing a temporary file then replacing the XLSForm, only
+    triggers one rebuild.
+
+    On each rebuild, only the outputs that are affected by the change are
+    regenerated:
+    - The XForm, if the XLSForm content changed.
+    - All images for a language, if that language's image settings or logo
+      changed.
+    - The images for questions with changed text or nested image content.
+
+    The images of questions that are no longer in the XLSForm are deleted,
+    including the images in any output profile folders.
+    """
+
+    def __init__(self, xlsform_path, images=True, xform=True, debounce=2.0):
+        """
+        Parameters.
+        :param xlsform_path: str. Path to the XLSForm to watch.
+        :param images: bool. If True, regenerate the question images.
+        :param xform: bool. If True, regenerate the XForm.
+        :param debounce: float. Seconds without changes before rebuilding.
+        """
+        self.xlsform_path = os.path.abspath(xlsform_path)
+        self.images = images
+        self.xform = xform
+        self.debounce = debounce
+        self.xlsform_digest = None
+        self.image_digests = dict()
+        self.image_files = dict()
+        self.watched = {self.xlsform_path: None}
+        self.last_change = None
+
+    @staticmethod
+    def _stat_signature(file_path):
+        """
+        Get the modification time and size of a file, or None if missing.
+
+        Parameters.
+        :param file_path: str. Path to the file.
+        :return: tuple (mtime, size) or None.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def poll(self):
+        """
+        Check whether any watched file has changed since the last poll.
+
+        :return: bool. True if any watched file changed.
+        """
+        changed = False
+        for file_path, signature in self.watched.items():
+            current = Watcher._stat_signature(file_path)
+            if current != signature:
+                self.watched[file_path] = current
+                changed = True
+        return changed
+
+    def step(self, now):
+        """
+        Poll for changes, and rebuild if the debounce period has passed.
+
+        Parameters.
+        :param now: float. Current time in seconds, e.g. time.monotonic().
+        :return: bool. True if a rebuild was run.
+        """
+        if self.poll():
+            self.last_change = now
+        if self.last_change is not None:
+            if now - self.last_change >= self.debounce:
+                self.last_change = None
+                self.rebuild()
+                return True
+        return False
+
+    def rebuild(self):
+        """
+        Regenerate the outputs affected by changes since the last rebuild.
+
+        Errors are logged instead of raised, since the XLSForm may be
+        mid-save or otherwise broken. The next change will trigger a retry.
+        """
+        try:
+            xlsform_digest = Images._file_digest(self.xlsform_path)
+            if self.xform and xlsform_digest != self.xlsform_digest:
+                Watcher._write_xform(xlsform_path=self.xlsform_path)
+            if self.images:
+                self._write_changed_images()
+        except Exception as e:
+            logger.error("Rebuild failed: {0}".format(e))
+        else:
+            self.xlsform_digest = xlsform_digest
+        self.poll()
+
+    @staticmethod
+    def _write_xform(xlsform_path):
+        """
+        Convert the XLSForm to an XForm next to it, and log any warnings.
+
+        As with the Generate XForm task, the question image references are
+        changed to match the image_format setting. See update_xform_images.
+
+        Parameters.
+        :param xlsform_path: str. Path to the XLSForm to convert.
+        """
+        xform_path = '{0}.xml'.format(os.path.splitext(xlsform_path)[0])
+        warnings = xls2xform.xls2xform_convert(
+            xlsform_path=xlsform_path, xform_path=xform_path, validate=False)
+        for warning in warnings:
+            logger.warning(warning)
+        update_xform_images(xform_path=xform_path, xlsform_path=xlsform_path)
+        logger.info("Wrote XForm: {0}".format(xform_path))
+
+    def _write_changed_images(self):
+        """
+        Write the images that have changed content or settings.
+
+        Also updates the list of watched files to include the logo and nested
+        images currently referred to in the XLSForm, and deletes the images
+        that were written for questions no longer in the XLSForm.
+        """
+        xlsform_workbook = xlrd.open_workbook(filename=self.xlsform_path)
+        settings = ImageSettings.read(xlsform_workbook=xlsform_workbook)
+        image_digests = dict()
+        image_files = dict()
+        watched = {self.xlsform_path}
+        msg = "Wrote {0} of {1} images for language: {2}."
+        for language in settings.values():
+            language = ImageContent.read(
+                xlsform_workbook=xlsform_workbook, settings=language)
+            digests = Watcher._image_digests(
+                xlsform_path=self.xlsform_path, settings=language)
+            changed = [question for question, key, digest in digests
+                       if self.image_digests.get(key) != digest]
+            watched.update(Watcher._image_paths(
+                xlsform_path=self.xlsform_path, settings=language))
+            if len(changed) > 0:
+                all_content = language['image_content']
+                language['image_content'] = changed
+                Images.write(xlsform_path=self.xlsform_path, settings=language)
+                language['image_content'] = all_content
+            image_digests.update({k: d for _, k, d in digests})
+            image_files.update({k: Watcher._image_files(
+                xlsform_path=self.xlsform_path, settings=language, question=q)
+                for q, k, _ in digests})
+            logger.info(msg.format(
+                len(changed), len(digests), language['language']))
+        self.image_digests = image_digests
+        Watcher._remove_images(old=self.image_files, new=image_files)
+        self.image_files = image_files
+        for file_path in watched - set(self.watched.keys()):
+            self.watched[file_path] = Watcher._stat_signature(file_path)
+        for file_path in set(self.watched.keys()) - watched:
+            del self.watched[file_path]
+
+    @staticmethod
+    def _image_digests(xlsform_path, settings):
+        """
+        Hash the render inputs of each question image for a language.
+
+        The output profiles are part of each digest, since they aren't in the
+        settings digest, so that adding or changing a profile writes the
+        images again, including to the profile's folder.
+
+        Parameters.
+        :param xlsform_path: str. Path to the XLSForm.
+        :param settings: dict. Image settings and content for a language.
+        :return: list. Tuples of (question, image key, digest).
+        """
+        settings_digest = Images._settings_digest(
+            settings=settings, xlsform_path=xlsform_path)
+        profiles = tuple(ImageSettings._parse_profiles(
+            settings.get('image_profiles', '')))
+        digests = list()
+        for question in settings['image_content']:
+            key = (settings['language'], question['file_name_column'])
+            digest = (settings_digest, profiles, Images._question_digest(
+                question=question, xlsform_path=xlsform_path))
+            digests.append((question, key, digest))
+        return digests
+
+    @staticmethod
+    def _image_files(xlsform_path, settings, question):
+        """
+        Get the paths that Images.write saves a question's image to.
+
+        Parameters.
+        :param xlsform_path: str. Path to the XLSForm.
+        :param settings: dict. Image settings for a language.
+        :param question: dict. Image content for a question.
+        :return: set. Paths of the question image and its profile copies.
+        """
+        image_path = Images._get_image_path(
+            output_path=Images._get_output_directory(xlsform_path),
+            settings=settings, question=question)
+        image_files = {image_path}
+        image_files.update(
+            Images._get_profile_path(image_path=image_path, profile_name=x)
+            for x, _ in ImageSettings._parse_profiles(
+                settings.get('image_profiles', '')))
+        return image_files
+
+    @staticmethod
+    def _remove_images(old, new):
+        """
+        Delete the image files that are no longer written for the XLSForm.
+
+        Parameters.
+        :param old: dict. Image paths from the last rebuild, by image key.
+        :param new: dict. Image paths from this rebuild, by image key.
+        """
+        removed = 0
+        for key, file_paths in old.items():
+            for file_path in file_paths - new.get(key, set()):
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+                    removed += 1
+        if removed > 0:
+            logger.info("Removed {0} images no longer in the XLSForm.".format(
+                removed))
+
+    @staticmethod
+    def _image_paths(xlsform_path, settings):
+        """
+        Get the paths of the logo and nested images used for a language.
+
+        Parameters.
+        :param xlsform_path: str. Path to the XLSForm.
+        :param settings: dict. Image settings and content for a language.
+        :return: set. Paths of the images.
+        """
+        image_paths = [settings['logo_image_path']]
+        image_paths.extend(
+            x['nest_image_column'] for x in settings['image_content'])
+        return {os.path.abspath(Images._locate_image_path(
+                    image_path=x, xlsform_path=xlsform_path))
+                for x in image_paths if len(x) > 0}
+
+    def run(self, interval=1.0):
+        """
+        Build all outputs, then poll and rebuild until interrupted.
+
+        Parameters.
+        :param interval: float. Seconds to wait between polls.
+        """
+        self.poll()
+        self.rebuild()
+        logger.info("Watching for changes to: {0}".format(self.xlsform_path))
+        try:
+            while True:
+                time.sleep(interval)
+                self.step(now=time.monotonic())
+        except KeyboardInterrupt:
+            logger.info("Stopped watching.")
+
+
+def _create_parser():
+    """
+    Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "xlsform",
+        help="Path to the Excel XLSX file with the XLSForm definition to "
+             "watch. The XForm and images are written next to it, as per "
+             "the Generate XForm and Generate Images tasks.")
+    parser.add_argument(
+        "--no-images", dest="images", action="store_false", default=True,
+        help="Don't regenerate question images.")
+    parser.add_argument(
+        "--no-xform", dest="xform", action="store_false", default=True,
+        help="Don't regenerate the XForm.")
+    parser.add_argument(
+        "--interval", dest="interval", type=float, default=1.0,
+        help="Seconds to wait between checking for changes.")
+    parser.add_argument(
+        "--debounce", dest="debounce", type=float, default=2.0,
+        help="Seconds without further changes before rebuilding.")
+    return parser
+
+
+def main_cli():
+    """
+    Collect script arguments from stdin and run the Watcher.
+    """
+    parser = _create_parser()
+    args = parser.parse_args()
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    images_logger = logging.getLogger('odk_tools.question_images.images')
+    images_logger.addHandler(logging.StreamHandler())
+    watcher = Watcher(xlsform_path=args.xlsform, images=args.images,
+                      xform=args.xform, debounce=args.debounce)
+    watcher.run(interval=args.interval)
+
+
+if __name__ == '__main__':
+    main_cli()
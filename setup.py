@@ -15,6 +15,9 @@ setup(
     install_requires=[
         # see requirements.txt
     ],
+    extras_require={
+        'regression': ['numpy'],
+    },
     keywords="odk",
     classifiers=[
         "Development Status :: 5 - Production/Stable",
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import xlrd
+from odk_tools.gui.workbook_cache import WorkbookCache, WORKBOOKS
+from odk_tools.conversion_to_docx import to_docx
+from odk_tools.gui.wrappers import generate_images, generate_xform
+from odk_tools.question_images import images
+from tests.gui import FixturePaths
+
+
+class TestWorkbookCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fixtures = FixturePaths()
+        self.temp_dir = tempfile.mkdtemp()
+        self.xlsform_path = os.path.join(self.temp_dir, "Q1302_BEHAVE.xlsx")
+        shutil.copy(self.fixtures.files["Q1302_BEHAVE.xlsx"],
+                    self.xlsform_path)
+        self.cache = WorkbookCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_get_reuses_unchanged_workbook(self):
+        """Should parse the workbook once if the file hasn't changed."""
+        with patch('xlrd.open_workbook', wraps=xlrd.open_workbook) as opened:
+            first = self.cache.get(file_path=self.xlsform_path)
+            second = self.cache.get(file_path=self.xlsform_path)
+        self.assertIs(first, second)
+        self.assertEqual(1, opened.call_count)
+
+    def test_get_parses_changed_workbook(self):
+        """Should parse the workbook again if the modification time changed,
+        and drop the workbook for the old version of the file."""
+        first = self.cache.get(file_path=self.xlsform_path)
+        stat = os.stat(self.xlsform_path)
+        os.utime(self.xlsform_path, (stat.st_atime, stat.st_mtime + 10))
+        second = self.cache.get(file_path=self.xlsform_path)
+        self.assertIsNot(first, second)
+        self.assertEqual(1, len(self.cache.workbooks))
+
+    def test_get_drops_least_recently_used(self):
+        """Should keep at most max_entries workbooks."""
+        self.cache.max_entries = 1
+        other_path = os.path.join(self.temp_dir, "other.xlsx")
+        shutil.copy(self.xlsform_path, other_path)
+        self.cache.get(file_path=self.xlsform_path)
+        self.cache.get(file_path=other_path)
+        self.assertEqual([os.path.abspath(other_path)],
+                         [x[0] for x in self.cache.workbooks])
+
+    def test_get_image_settings_reuses_unchanged_settings(self):
+        """Should read the image settings once, and return copies of them."""
+        patch_read = 'odk_tools.question_images.images.ImageSettings.read'
+        with patch(patch_read, wraps=images.ImageSettings.read) as read:
+            first = self.cache.get_image_settings(file_path=self.xlsform_path)
+            first[2]['image_content'] = []
+            second = self.cache.get_image_settings(
+                file_path=self.xlsform_path)
+        self.assertEqual(1, read.call_count)
+        self.assertNotIn('image_content', second[2])
+        self.assertIs(first[2]['label_font_kwargs'],
+                      second[2]['label_font_kwargs'])
+
+    def test_get_image_settings_reads_changed_workbook(self):
+        """Should read the image settings again if the file changed."""
+        self.cache.get_image_settings(file_path=self.xlsform_path)
+        stat = os.stat(self.xlsform_path)
+        os.utime(self.xlsform_path, (stat.st_atime, stat.st_mtime + 10))
+        patch_read = 'odk_tools.question_images.images.ImageSettings.read'
+        with patch(patch_read, wraps=images.ImageSettings.read) as read:
+            self.cache.get_image_settings(file_path=self.xlsform_path)
+        self.assertEqual(1, read.call_count)
+        self.assertEqual(1, len(self.cache.image_settings))
+
+    def test_generate_images_uses_cached_workbook(self):
+        """Should pass the cached workbook to write_images."""
+        WORKBOOKS.clear()
+        patch_write = 'odk_tools.question_images.images.write_images'
+        with patch(patch_write, MagicMock()) as write_images:
+            generate_images.wrapper(xlsform_path=self.xlsform_path)
+        workbook = write_images.call_args[1]['xlsform_workbook']
+        self.assertIs(WORKBOOKS.get(file_path=self.xlsform_path), workbook)
+        image_settings = write_images.call_args[1]['image_settings']
+        self.assertEqual(
+            WORKBOOKS.get_image_settings(file_path=self.xlsform_path),
+            image_settings)
+        WORKBOOKS.clear()
+
+    def test_task_chain_loads_workbook_once(self):
+        """Should parse the xlsform once for Generate XForm, Generate Images
+        (for each of its 5 languages) and the docx export, with pyxform's own
+        read of it mocked."""
+        WORKBOOKS.clear()
+        self.addCleanup(WORKBOOKS.clear)
+        xlsform_path = os.path.join(self.temp_dir, "Q1309_BEHAVE.xlsx")
+        shutil.copy(os.path.join(
+            os.path.dirname(self.fixtures.gui_tests), "conversion_to_docx",
+            "Q1309_BEHAVE.xlsx"), xlsform_path)
+        patch_convert = 'pyxform.xls2xform.xls2xform_convert'
+        patch_patch = 'odk_tools.gui.xform_patch.' \
+                      'xform_empty_question_label_patch'
+        patch_write = 'odk_tools.question_images.images.Images.write'
+        patch_docx = 'odk_tools.conversion_to_docx.to_docx.' \
+                     'write_language_to_docx'
+        with patch('xlrd.open_workbook', wraps=xlrd.open_workbook) as opened, \
+                patch(patch_convert, MagicMock(return_value=[])), \
+                patch(patch_patch, MagicMock(return_value="")), \
+                patch(patch_write, MagicMock()) as write, \
+                patch(patch_docx, MagicMock()):
+            generate_xform.wrapper(xlsform_path=xlsform_path)
+            generate_images.wrapper(xlsform_path=xlsform_path)
+            to_docx.read_xlsform(filepath=xlsform_path)
+        self.assertEqual(1, opened.call_count)
+        self.assertEqual(5, write.call_count)
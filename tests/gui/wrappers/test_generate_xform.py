@@ -1,4 +1,5 @@
 from odk_tools.gui.wrappers import generate_xform
+from odk_tools.gui.workbook_cache import WORKBOOKS
 from tests.gui import FixturePaths
 import unittest
 from unittest.mock import MagicMock, patch
@@ -12,7 +13,8 @@ class TestGenerateXForm(unittest.TestCase):
         self.clean_up_file = None
 
     def tearDown(self):
-        if self.clean_up_file is not None:
+        if self.clean_up_file is not None and \
+                os.path.isfile(self.clean_up_file):
             os.remove(self.clean_up_file)
 
     def test_run_generate_xform_all_valid_args(self):
@@ -35,6 +37,21 @@ class TestGenerateXForm(unittest.TestCase):
         for message in expected:
             self.assertIn(message, observed)
 
+    def test_run_generate_xform_updates_images_with_cached_workbook(self):
+        """Should pass the cached workbook to update_xform_images."""
+        xlsform_path = self.fixtures.files["Q1302_BEHAVE.xlsx"]
+        self.addCleanup(WORKBOOKS.clear)
+        patch_convert = 'pyxform.xls2xform.xls2xform_convert'
+        patch_patch = 'odk_tools.gui.xform_patch.' \
+                      'xform_empty_question_label_patch'
+        patch_update = 'odk_tools.question_images.images.update_xform_images'
+        with patch(patch_convert, MagicMock(return_value=[])), \
+                patch(patch_patch, MagicMock(return_value="")), \
+                patch(patch_update, MagicMock(return_value=0)) as update:
+            generate_xform.wrapper(xlsform_path=xlsform_path)
+        self.assertIs(WORKBOOKS.get(file_path=xlsform_path),
+                      update.call_args[1]['xlsform_workbook'])
+
     def test_run_generate_xform_invalid_args(self):
         """Should return output text indicating validate not run."""
         expected = "task not run"
@@ -2,6 +2,9 @@ from odk_tools.gui.wrappers import validate_xform
 from tests.gui import FixturePaths
 import unittest
 import os
+import json
+import shutil
+import tempfile
 from unittest.mock import MagicMock, patch
 
 
@@ -9,6 +12,13 @@ class TestValidateXForm(unittest.TestCase):
 
     def setUp(self):
         self.fixtures = FixturePaths()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        cache_path = patch(
+            'odk_tools.gui.wrappers.validate_xform._preflight_cache_path',
+            MagicMock(return_value=os.path.join(self.temp_dir, "pre.json")))
+        cache_path.start()
+        self.addCleanup(cache_path.stop)
 
     @unittest.skipIf(os.environ.get('JAVA_HOME') is None, "JAVA_HOME not set.")
     def test_is_java_callable_with_java_home_set(self):
@@ -43,7 +53,8 @@ class TestValidateXForm(unittest.TestCase):
         java_path = ''
         xform_path = self.fixtures.files["R1309 BEHAVE.xml"]
         patch_call = 'odk_tools.gui.wrappers.validate_xform._call_odk_validate'
-        with patch(patch_call, MagicMock()):
+        output = ['', '>> Xform is valid! See above for any warnings.']
+        with patch(patch_call, MagicMock(return_value=output)):
             observed = validate_xform.wrapper(
                 java_path=java_path, validate_path=validate_path,
                 xform_path=xform_path)
@@ -56,3 +67,177 @@ class TestValidateXForm(unittest.TestCase):
         observed = validate_xform.wrapper(
             java_path='spam', validate_path='eggs', xform_path='ham')
         self.assertIn(expected, observed)
+
+    def test_run_validate_invalid_args_json(self):
+        """Should return a JSON result with the input errors."""
+        observed = json.loads(validate_xform.wrapper(
+            java_path='spam', validate_path='eggs', xform_path='ham',
+            output_format='json'))
+        self.assertEqual('not run', observed['status'])
+        self.assertIn('Java path', observed['errors'][0])
+
+    def test_run_validate_summary(self):
+        """Should include the parsed summary and the raw output."""
+        temp_dir = tempfile.mkdtemp()
+        java_path = os.path.join(temp_dir, "java.exe")
+        open(java_path, 'w').close()
+        output = [VALIDATE_INVALID, '']
+        patch_call = 'odk_tools.gui.wrappers.validate_xform._call_odk_validate'
+        try:
+            with patch(patch_call, MagicMock(return_value=output)):
+                observed = validate_xform.wrapper(
+                    java_path=java_path,
+                    validate_path=validate_xform._locate_odk_validate(),
+                    xform_path=self.fixtures.files["R1309 BEHAVE.xml"])
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertIn("Status: invalid", observed)
+        self.assertIn("Errors (2):", observed)
+        self.assertIn(VALIDATE_INVALID, observed)
+
+    def test_create_parser(self):
+        """Should parse many xforms and the json flag."""
+        parser = validate_xform._create_parser()
+        args = parser.parse_args(["a.xml", "b.xml", "--json"])
+        self.assertEqual(["a.xml", "b.xml"], args.xform)
+        self.assertTrue(args.json)
+        self.assertEqual("", args.java_path)
+
+
+class TestPreflightCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, "cache", "pre.json")
+        self.java_home = os.path.join(self.temp_dir, "java")
+        os.makedirs(os.path.join(self.java_home, "bin"))
+        self.java_path = os.path.join(self.java_home, "bin", "java.exe")
+        open(self.java_path, 'w').close()
+        self.environ = patch.dict(os.environ, {'JAVA_HOME': self.java_home})
+        self.environ.start()
+        self.os_name = patch.object(os, 'name', 'nt')
+        self.os_name.start()
+        self.version = patch(
+            'odk_tools.gui.wrappers.validate_xform._call_java_version',
+            MagicMock(return_value='java version "1.8.0_92"\nmore'))
+        self.call_java_version = self.version.start()
+
+    def tearDown(self):
+        self.version.stop()
+        self.os_name.stop()
+        self.environ.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_preflight_java_cached(self):
+        """Should run java -version once, then use the cached result."""
+        popen_kw = dict()
+        first = validate_xform.preflight_java(
+            popen_kwargs=popen_kw, cache_path=self.cache_path)
+        second = validate_xform.preflight_java(
+            popen_kwargs=popen_kw, cache_path=self.cache_path)
+        self.assertEqual((self.java_path, 'java version "1.8.0_92"'), first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.call_java_version.call_count)
+
+    def test_preflight_java_changed(self):
+        """Should check java again if JAVA_HOME or the binary changed."""
+        popen_kw = dict()
+        validate_xform.preflight_java(
+            popen_kwargs=popen_kw, cache_path=self.cache_path)
+        stat = os.stat(self.java_path)
+        os.utime(self.java_path, (stat.st_atime, stat.st_mtime + 10))
+        validate_xform.preflight_java(
+            popen_kwargs=popen_kw, cache_path=self.cache_path)
+        self.assertEqual(2, self.call_java_version.call_count)
+        os.environ['JAVA_HOME'] = os.path.join(self.temp_dir, "other")
+        with self.assertRaises(ValueError):
+            validate_xform.preflight_java(
+                popen_kwargs=popen_kw, cache_path=self.cache_path)
+
+    def test_preflight_odk_validate_cached(self):
+        """Should locate ODK_Validate once, then use the cached path."""
+        locate = 'odk_tools.gui.wrappers.validate_xform._locate_odk_validate'
+        with patch(locate, wraps=validate_xform._locate_odk_validate) as m:
+            first = validate_xform.preflight_odk_validate(
+                cache_path=self.cache_path)
+            second = validate_xform.preflight_odk_validate(
+                cache_path=self.cache_path)
+        self.assertEqual(validate_xform._locate_odk_validate(), first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, m.call_count)
+
+    def test_preflight_corrupt_cache(self):
+        """Should ignore an unreadable cache file, and replace it."""
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, 'w') as cache_file:
+            cache_file.write("not json")
+        observed = validate_xform.preflight_odk_validate(
+            cache_path=self.cache_path)
+        with open(self.cache_path) as cache_file:
+            entries = json.load(cache_file)
+        self.assertEqual(observed, entries['odk_validate']['path'])
+
+
+VALIDATE_VALID = """XForm Parse Warning: Unrecognized attribute
+    Problem found at nodeset: /html/head/model/bind
+    With element <bind nodeset="/a/b" relevant="true()"/>
+
+
+
+>> Xform is valid! See above for any warnings."""
+
+VALIDATE_INVALID = """Cycle detected in form's relevant and calculation logic!
+org.javarosa.xform.parse.XFormParseException: Cycle detected!
+\tat org.javarosa.core.model.FormDef.finalizeTriggerables(FormDef.java:1186)
+\tat org.odk.validate.FormValidator.validate(FormValidator.java:351)
+\t... 2 more
+XForm Parse Warning: Group has no label
+
+
+
+>> XForm is invalid. See above for the errors."""
+
+
+class TestParseValidateOutput(unittest.TestCase):
+
+    def test_valid_with_warning(self):
+        """Should find the valid status, and join the warning lines."""
+        observed = validate_xform.parse_validate_output(
+            stderr=VALIDATE_VALID, stdout='', seconds=1.5)
+        self.assertEqual("valid", observed["status"])
+        self.assertEqual([], observed["errors"])
+        self.assertEqual(
+            ['Unrecognized attribute Problem found at nodeset: '
+             '/html/head/model/bind With element '
+             '<bind nodeset="/a/b" relevant="true()"/>'],
+            observed["warnings"])
+        self.assertEqual(1.5, observed["seconds"])
+
+    def test_invalid_with_stack_trace(self):
+        """Should find the invalid status and errors, without stack frames."""
+        observed = validate_xform.parse_validate_output(
+            stderr=VALIDATE_INVALID, stdout='')
+        self.assertEqual("invalid", observed["status"])
+        self.assertEqual(
+            ["Cycle detected in form's relevant and calculation logic!",
+             "org.javarosa.xform.parse.XFormParseException: Cycle detected!"],
+            observed["errors"])
+        self.assertEqual(["Group has no label"], observed["warnings"])
+
+    def test_no_outcome(self):
+        """Should report an unknown status if there's no outcome message."""
+        observed = validate_xform.parse_validate_output(
+            stderr='Error: Unable to access jarfile x.jar', stdout='')
+        self.assertEqual("unknown", observed["status"])
+        self.assertEqual(
+            ["Error: Unable to access jarfile x.jar"], observed["errors"])
+
+    def test_format_result(self):
+        """Should list the status, time, errors and warnings."""
+        result = validate_xform.parse_validate_output(
+            stderr=VALIDATE_INVALID, stdout='', seconds=2)
+        observed = validate_xform.format_result(result).splitlines()
+        self.assertEqual(["Status: invalid", "Time: 2.00 seconds",
+                          "Errors (2):"], observed[:3])
+        self.assertEqual(["Warnings (1):", "- Group has no label"],
+                         observed[-2:])
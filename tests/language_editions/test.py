@@ -1,9 +1,17 @@
 import unittest
+import hashlib
 import os
 import shutil
+import tarfile
+import tempfile
 import zipfile
+import zlib
 from lxml import etree
-from odk_tools.language_editions.editions import Editions, _create_parser
+from odk_tools.language_editions.editions import Editions, EditionArchive, \
+    EditionDirectory, EditionDocument, EditionOutput, SpooledFile, \
+    _create_parser
+from odk_tools.question_images.images import Images, ImageContent
+from unittest.mock import patch
 import contextlib
 import io
 import warnings
@@ -89,6 +97,59 @@ class TestEditionsXML(TestEditionsBase):
         self.assertNotEqual(sid_start, sid_end)
         self.assertIn(site_code, sid_end)
 
+    def test_find_sid_direct_path_same_as_search(self):
+        """Should find the same SID element as the descendant search."""
+        doc = self.document2
+        ns = Editions._map_xf_to_xform_namespace(doc)
+        sid_xpath = './/xf:instance//xf:visit/xf:sid'
+        expected = doc.getroot().xpath(sid_xpath, namespaces=ns)
+        self.assertEqual(expected, Editions._find_sid(doc, ns))
+
+    def test_edition_document_same_as_updated_copy(self):
+        """Should serialize the same XML as updating a fresh parse, for
+        each site, leaving the document unchanged."""
+        sites = [('61200', ('german', 'french')), ('61201', ('english',)),
+                 ('61202', ('french', 'english', 'german'))]
+        for xform, document in ((self.xform1, self.document1),
+                                (self.xform2, self.document2)):
+            original = etree.tostring(document)
+            edition_document = EditionDocument(document=document)
+            self.assertEqual(original, etree.tostring(document))
+            for site_code, langs in sites:
+                doc = etree.parse(xform)
+                ns = Editions._map_xf_to_xform_namespace(doc)
+                doc = Editions._update_xform_languages(doc, ns, langs)
+                doc = Editions._add_site_to_default_sid(doc, ns, site_code)
+                observed = edition_document.serialize(
+                    site_code=site_code, languages=langs)
+                self.assertEqual(etree.tostring(doc), observed)
+
+    def test_edition_document_escapes_sid(self):
+        """Should escape the SID text the same way as lxml."""
+        doc = self.document2
+        ns = Editions._map_xf_to_xform_namespace(doc)
+        Editions._find_sid(doc, ns)[0].text = 'a<b&c\u00e9-'
+        edition_document = EditionDocument(document=doc)
+        doc = Editions._add_site_to_default_sid(doc, ns, '61200')
+        observed = edition_document.serialize(
+            site_code='61200', languages=('english',))
+        expected = etree.tostring(Editions._find_sid(doc, ns)[0]).split(
+            b'>', 1)[1].split(b'<', 1)[0]
+        self.assertIn(b'>' + expected + b'<', observed)
+        self.assertIn(b'a&lt;b&amp;c&#233;-61200-', observed)
+
+    def test_edition_document_logs_sid(self):
+        """Should log the SID result for each site, as for a tree update."""
+        edition_document = EditionDocument(document=self.document2)
+        with self.assertLogs(
+                'odk_tools.language_editions.editions', level='INFO') as logs:
+            edition_document.serialize(
+                site_code='61200', languages=('english',))
+        expected_log = ''.join([
+            'INFO:odk_tools.language_editions.editions:Add to sid. ',
+            'Site code: 61200, SIDs found: 1, Appended: True'])
+        self.assertEqual([expected_log], logs.output)
+
 
 class TestEditionsConfig(TestEditionsBase):
     """Configuration and setup related tests."""
@@ -120,7 +181,7 @@ class TestEditionsConfig(TestEditionsBase):
         sitelangs = 'site_languages.xlsx'
         args_list = [xform, sitelangs]
         args = _create_parser().parse_args(args_list)
-        self.assertEqual(xform, args.xform)
+        self.assertEqual([xform], args.xform)
         self.assertEqual(sitelangs, args.sitelangs)
         self.assertEqual(0, args.nested)
 
@@ -131,10 +192,52 @@ class TestEditionsConfig(TestEditionsBase):
         nested = '--nested'
         args_list = [nested, xform, sitelangs]
         args = _create_parser().parse_args(args_list)
-        self.assertEqual(xform, args.xform)
+        self.assertEqual([xform], args.xform)
         self.assertEqual(sitelangs, args.sitelangs)
         self.assertEqual(1, args.nested)
 
+    def test_create_parser_with_many_xforms(self):
+        """Should parse all the xforms before the site languages path."""
+        xforms = ['Q1302_BEHAVE.xml', 'R1302_BEHAVE.xml']
+        sitelangs = 'site_languages.xlsx'
+        args = _create_parser().parse_args(xforms + [sitelangs])
+        self.assertEqual(xforms, args.xform)
+        self.assertEqual(sitelangs, args.sitelangs)
+
+    def test_create_parser_rebuild(self):
+        """Should parse the rebuild flag, which is off by default."""
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx', '--rebuild'])
+        self.assertTrue(args.rebuild)
+        self.assertIsNone(args.delta_from)
+
+    def test_create_parser_output_format(self):
+        """Should parse the output format, which is zip by default."""
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx'])
+        self.assertEqual('zip', args.output_format)
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx', '--format', 'tar'])
+        self.assertEqual('tar', args.output_format)
+
+    def test_create_parser_images(self):
+        """Should parse the XLSForms to render images for."""
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx'])
+        self.assertIsNone(args.xlsform)
+        self.assertFalse(args.write_media)
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx', '--images',
+             'Q1302_BEHAVE.xlsx', '--write_media'])
+        self.assertEqual(['Q1302_BEHAVE.xlsx'], args.xlsform)
+        self.assertTrue(args.write_media)
+
+    def test_create_parser_delta(self):
+        """Should parse the previous deployment path for a delta."""
+        args = _create_parser().parse_args(
+            ['Q1302_BEHAVE.xml', 'site_languages.xlsx', '--delta', 'old'])
+        self.assertEqual('old', args.delta_from)
+
     def test_write_editions_validation_xform(self):
         """Should raise a ValueError if the XForm path ext is not XML."""
         xform_invalid = "Q1302_BEHAVE.abc"
@@ -225,7 +328,8 @@ class TestEditionsJobs(TestEditionsBase):
         Editions.write_language_editions(
             xform_path=self.xform2, site_languages=self.languages_two_only,
             nest_in_odk_folders=1, collect_settings=self.collect_settings)
-        output_files = os.listdir(self.test_output_path)
+        output_files = [x for x in os.listdir(self.test_output_path)
+                        if x.endswith('.zip')]
         first_zip = os.path.join(self.test_output_path, output_files[0])
         with zipfile.ZipFile(first_zip) as zip_out:
             zip_items = zip_out.namelist()
@@ -243,3 +347,672 @@ class TestEditionsJobs(TestEditionsBase):
                 xform_path=self.xform1, site_languages=self.languages_two_only,
                 nest_in_odk_folders=1, collect_settings=self.collect_settings)
         self.assertEqual(0, len(w))
+
+    def test_write_many_forms_in_one_call(self):
+        """Should write the same site zip files as one call per form."""
+        Editions.write_language_editions(
+            xform_path=[self.xform1, self.xform2],
+            site_languages=self.languages_two_only,
+            nest_in_odk_folders=1, collect_settings=self.collect_settings)
+        output_files = [x for x in os.listdir(self.test_output_path)
+                        if x.endswith('.zip')]
+        first_zip = os.path.join(self.test_output_path, output_files[0])
+        with zipfile.ZipFile(first_zip) as zip_out:
+            zip_items = zip_out.namelist()
+        self.assertEqual(387, len(zip_items))
+        self.assertEqual(2, len(output_files))
+
+    def test_write_many_forms_parses_each_form_once(self):
+        """Should parse each XForm once, rather than once per site."""
+        parse = 'odk_tools.language_editions.editions.etree.parse'
+        with patch(parse, wraps=etree.parse) as parse_mock:
+            Editions.write_language_editions(
+                xform_path=[self.xform1, self.xform2],
+                site_languages=self.languages_two_only)
+        self.assertEqual(2, parse_mock.call_count)
+
+    def test_group_sites_by_languages(self):
+        """Should group sites by languages, keeping the default first."""
+        settings = {'1': ('english', 'french'), '2': ('french', 'english'),
+                    '3': ('english', 'french')}
+        observed = Editions._group_sites(settings)
+        self.assertEqual({('english', 'french'): ['1', '3'],
+                          ('french', 'english'): ['2']}, dict(observed))
+
+    def iter_form_jobs(self, xform_path, settings, **kwargs):
+        """Prepare the editions of one XForm, and list its site jobs."""
+        form = Editions._prepare_form_editions(
+            xform_path=xform_path, settings=settings, **kwargs)
+        return list(Editions._iter_site_jobs(settings=settings, forms=[form]))
+
+    def test_form_editions_compress_once_per_file(self):
+        """Should compress each file once for all sites and language sets."""
+        settings = {str(x): ('english', 'french') for x in range(20)}
+        settings['99'] = ('french',)
+        compress = 'odk_tools.language_editions.editions.Editions.' \
+                   '_compress_file'
+        with patch(compress, wraps=Editions._compress_file) as compress_mock:
+            zip_jobs = self.iter_form_jobs(
+                xform_path=self.xform1, settings=settings,
+                nest_in_odk_folders=1, collect_settings=self.collect_settings)
+        jobs, _ = Editions._prepare_site_job(
+            xform_path=self.xform1, site_code="0",
+            languages=('english', 'french'), nest_in_odk_folders=1,
+            collect_settings=self.collect_settings)
+        self.assertEqual(len(jobs), compress_mock.call_count)
+        self.assertEqual(21, len(zip_jobs))
+        self.assertIs(zip_jobs[0][1], zip_jobs[19][1])
+        observed = [x.zinfo.filename for x in zip_jobs[0][1]]
+        expected = [x[1].replace(os.sep, '/') for x in jobs]
+        self.assertEqual(expected, observed)
+
+    def test_form_editions_spool_compressed_files(self):
+        """Should read the compressed files from the spool folder, giving
+        the same archive as keeping them in memory."""
+        settings = {'61221': ('english', 'french')}
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        spool_path = os.path.join(temp_dir, 'spool')
+        os.makedirs(spool_path)
+        spooled = self.iter_form_jobs(
+            xform_path=self.xform2, settings=settings, spool_path=spool_path)
+        jobs = spooled[0][1]
+        self.assertTrue(all(isinstance(x, SpooledFile) for x in jobs))
+        self.assertEqual(len(jobs), len(os.listdir(spool_path)))
+        observed = Editions._run_zip_jobs(
+            os.path.join(temp_dir, 'spooled'), spooled)
+        expected = Editions._run_zip_jobs(
+            os.path.join(temp_dir, 'memory'),
+            self.iter_form_jobs(xform_path=self.xform2, settings=settings))
+        self.assertEqual(expected, observed)
+
+    def test_form_editions_xform_matches_site_job(self):
+        """Should give the same site XForm as preparing the site alone."""
+        settings = {'61221': ('english', 'french'),
+                    '61222': ('english', 'french')}
+        zip_jobs = self.iter_form_jobs(
+            xform_path=self.xform2, settings=settings)
+        for site_code, _, xform in zip_jobs:
+            _, expected = Editions._prepare_site_job(
+                xform_path=self.xform2, site_code=site_code,
+                languages=('english', 'french'))
+            self.assertEqual(expected, xform)
+        self.assertNotEqual(zip_jobs[0][2], zip_jobs[1][2])
+
+
+
+class TestEditionsTempForm(TestEditionsBase):
+    """Base for tests that change a copy of the R1309 form and its media."""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        shutil.copy(self.xform2, self.temp_dir)
+        shutil.copytree(os.path.join(self.cwd, 'R1309_BEHAVE-media'),
+                        os.path.join(self.temp_dir, 'R1309_BEHAVE-media'))
+        self.xform = os.path.join(self.temp_dir, 'R1309_BEHAVE.xml')
+        self.output_path = os.path.join(self.temp_dir, 'editions')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class TestEditionsRebuild(TestEditionsTempForm):
+    """Incremental rebuild related tests."""
+
+    def rebuild(self):
+        """Run a rebuild, and return the site codes of the archives written."""
+        run_zip_jobs = Editions._run_zip_jobs
+        written = list()
+
+        def run_and_record(output_path, zip_jobs, output_format='zip'):
+            run_zip_jobs(output_path, (
+                written.append(x[0]) or x for x in zip_jobs), output_format)
+
+        with patch.object(Editions, '_run_zip_jobs', run_and_record):
+            Editions.write_language_editions(
+                xform_path=self.xform, site_languages=self.languages_two_only,
+                rebuild=True)
+        return written
+
+    def test_rebuild_skips_unchanged_sites(self):
+        """Should write all sites, then none if nothing has changed."""
+        self.assertEqual(['41101', '12501'], self.rebuild())
+        self.assertEqual([], self.rebuild())
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.output_path, 'manifest.json')))
+
+    def test_rebuild_changed_media_file(self):
+        """Should only replace the archives of sites using a changed file."""
+        self.rebuild()
+        media_file = os.path.join(
+            self.temp_dir, 'R1309_BEHAVE-media', 'cffl6m_german.png')
+        with open(media_file, 'wb') as changed:
+            changed.write(b'changed')
+        self.assertEqual(['41101'], self.rebuild())
+        zip_name = os.path.join(self.output_path, '41101.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            observed = zip_out.read('R1309_BEHAVE-media/cffl6m_german.png')
+            self.assertEqual(b'changed', observed)
+            self.assertEqual(94, len(zip_out.namelist()))
+
+    def test_rebuild_changed_language_text(self):
+        """Should only replace archives of sites with a changed language."""
+        self.rebuild()
+        with open(self.xform, 'rb') as xform_file:
+            xform = xform_file.read()
+        with open(self.xform, 'wb') as xform_file:
+            xform_file.write(xform.replace(
+                b'Ich habe etwas Schwierigkeiten beim Gehen',
+                b'Ich habe einige Schwierigkeiten beim Gehen'))
+        self.assertEqual(['41101'], self.rebuild())
+        zip_name = os.path.join(self.output_path, '41101.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            self.assertIn(b'Ich habe einige', zip_out.read('R1309_BEHAVE.xml'))
+
+    def test_rebuild_missing_archive(self):
+        """Should write a site archive again if it has been removed."""
+        self.rebuild()
+        os.remove(os.path.join(self.output_path, '12501.zip'))
+        self.assertEqual(['12501'], self.rebuild())
+
+    def test_file_digest_reuses_unchanged_entry(self):
+        """Should re-use the digest of a file with the same mtime and size."""
+        files = dict()
+        digest = Editions._file_digest(self.xform, files)
+        stat = os.stat(self.xform)
+        files[self.xform][2] = 'cached'
+        self.assertEqual('cached', Editions._file_digest(self.xform, files))
+        os.utime(self.xform, (stat.st_atime, stat.st_mtime + 1))
+        self.assertEqual(digest, Editions._file_digest(self.xform, files))
+
+
+class TestEditionsDelta(TestEditionsTempForm):
+    """Delta package related tests."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = os.path.join(self.temp_dir, 'R1309_BEHAVE-media')
+        self.delta_path = os.path.join(self.output_path, 'delta')
+        self.previous = os.path.join(self.temp_dir, 'previous')
+
+    def write(self, delta_from=None):
+        Editions.write_language_editions(
+            xform_path=self.xform, site_languages=self.languages_two_only,
+            rebuild=True, delta_from=delta_from)
+
+    def change_media(self):
+        """Change a German image and remove a French image."""
+        with open(os.path.join(self.media, 'cffl6m_german.png'), 'wb') as f:
+            f.write(b'changed')
+        os.remove(os.path.join(self.media, 'cffl6m_french.png'))
+
+    def test_delta_from_previous_archives(self):
+        """Should write the added or changed files, and the removed files."""
+        self.write()
+        shutil.copytree(self.output_path, self.previous)
+        self.change_media()
+        self.write(delta_from=self.previous)
+        with zipfile.ZipFile(os.path.join(self.delta_path, '41101.zip')) \
+                as zip_out:
+            self.assertEqual(['R1309_BEHAVE-media/cffl6m_german.png'],
+                             zip_out.namelist())
+            self.assertEqual(b'changed', zip_out.read(zip_out.namelist()[0]))
+        self.assertFalse(os.path.isfile(
+            os.path.join(self.delta_path, '12501.zip')))
+        removed = os.path.join(self.delta_path, '12501.removed.txt')
+        with open(removed, encoding='utf-8') as removed_file:
+            self.assertEqual('R1309_BEHAVE-media/cffl6m_french.png\n',
+                             removed_file.read())
+
+    def test_delta_from_deployment_file(self):
+        """Should add all files at first, then use the deployment file."""
+        self.write(delta_from=self.previous)
+        delta_files = sorted(os.listdir(self.delta_path))
+        self.assertIn('deployment.json', delta_files)
+        self.assertIn('12501.zip', delta_files)
+        deployment = os.path.join(self.temp_dir, 'deployment.json')
+        shutil.copy(os.path.join(self.delta_path, 'deployment.json'),
+                    deployment)
+        self.change_media()
+        self.write(delta_from=deployment)
+        self.assertEqual(
+            ['12501.removed.txt', '41101.zip', '41101.zip.sha256',
+             'deployment.json'],
+            sorted(os.listdir(self.delta_path)))
+
+    def test_delta_xform_changed_for_all_sites(self):
+        """Should add the XForm to every site's delta if it changes."""
+        self.write()
+        shutil.copytree(self.output_path, self.previous)
+        with open(self.xform, 'rb') as xform_file:
+            xform = xform_file.read()
+        with open(self.xform, 'wb') as xform_file:
+            xform_file.write(xform.replace(
+                b'<h:title>', b'<h:title>New '))
+        self.write(delta_from=self.previous)
+        for site_code in ('41101', '12501'):
+            delta = Editions._archive_files(os.path.join(
+                self.delta_path, '{0}.zip'.format(site_code)))
+            self.assertEqual(['R1309_BEHAVE.xml'], list(delta))
+
+    def test_delta_for_sites_not_rebuilt(self):
+        """Should write deltas for sites not rebuilt that differ from before."""
+        self.write()
+        shutil.copytree(self.output_path, self.previous)
+        os.remove(os.path.join(self.media, 'cffl6m_french.png'))
+        self.write()
+        with open(os.path.join(self.media, 'cffl6m_german.png'), 'wb') as f:
+            f.write(b'changed')
+        self.write(delta_from=self.previous)
+        self.assertEqual(
+            ['12501.removed.txt', '41101.zip', '41101.zip.sha256',
+             'deployment.json'],
+            sorted(os.listdir(self.delta_path)))
+
+
+class TestEditionsOutputFormats(TestEditionsTempForm):
+    """Tar and directory output related tests."""
+
+    def write(self, output_format, **kwargs):
+        Editions.write_language_editions(
+            xform_path=self.xform, site_languages=self.languages_two_only,
+            output_format=output_format, **kwargs)
+
+    def zip_content(self, site_code):
+        self.write('zip')
+        zip_name = os.path.join(self.output_path, site_code + '.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            return {x: zip_out.read(x) for x in zip_out.namelist()}
+
+    def test_tar_output_same_files_as_zip(self):
+        """Should write a tar file per site, with the same files as the zip."""
+        expected = self.zip_content('41101')
+        self.write('tar')
+        tar_name = os.path.join(self.output_path, '41101.tar')
+        with tarfile.open(tar_name) as tar_out:
+            names = tar_out.getnames()
+            observed = {x: tar_out.extractfile(x).read() for x in names}
+        self.assertEqual(sorted(names), names)
+        self.assertEqual(expected, observed)
+        self.assertTrue(os.path.isfile(tar_name + '.sha256'))
+
+    def test_rebuild_each_format_after_change(self):
+        """Should rebuild a zip file changed while writing tar files."""
+        self.write('zip', rebuild=True)
+        self.write('tar', rebuild=True)
+        media_file = os.path.join(
+            self.temp_dir, 'R1309_BEHAVE-media', 'cffl6m_german.png')
+        with open(media_file, 'wb') as changed:
+            changed.write(b'changed')
+        self.write('tar', rebuild=True)
+        self.write('zip', rebuild=True)
+        zip_name = os.path.join(self.output_path, '41101.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            self.assertEqual(b'changed', zip_out.read(
+                'R1309_BEHAVE-media/cffl6m_german.png'))
+
+    def test_directory_output_links_media(self):
+        """Should write a folder per site, with the media files linked."""
+        expected = self.zip_content('12501')
+        self.write('directory', nest_in_odk_folders=1)
+        site_path = os.path.join(self.output_path, '12501')
+        media_name = 'odk/forms/R1309_BEHAVE-media/cffl6m_french.png'
+        observed = dict()
+        for base, dirs, files in os.walk(site_path):
+            for file in files:
+                file_path = os.path.join(base, file)
+                with open(file_path, 'rb') as site_file:
+                    observed[os.path.relpath(file_path, site_path).replace(
+                        os.sep, '/')] = site_file.read()
+        self.assertEqual(len(expected), len(observed))
+        self.assertEqual(expected['R1309_BEHAVE.xml'],
+                         observed['odk/forms/R1309_BEHAVE.xml'])
+        source = os.path.join(self.temp_dir, 'R1309_BEHAVE-media',
+                              'cffl6m_french.png')
+        self.assertTrue(os.path.samefile(
+            source, os.path.join(site_path, *media_name.split('/'))))
+
+    def test_directory_digest_over_files(self):
+        """Should write the digests of the folder's files, in order, next to
+        it, and the folder digest, which doesn't depend on the write order."""
+        folder_path = os.path.join(self.test_output_path, "61221")
+        other_path = os.path.join(self.test_output_path, "61222")
+        with EditionDirectory(file_path=folder_path) as folder:
+            folder.writestr("b/c.xml", b"c")
+            folder.writestr("a.xml", b"a")
+        with EditionDirectory(file_path=other_path) as other:
+            other.writestr("a.xml", b"a")
+        with EditionDirectory(file_path=other_path) as other:
+            other.writestr("b/c.xml", b"c")
+        with open(folder_path + '.sha256', encoding='utf-8') as digest:
+            lines = digest.read()
+        self.assertEqual(['a.xml', 'b/c.xml'],
+                         [x.split('  ')[1] for x in lines.splitlines()])
+        self.assertEqual(hashlib.sha256(b"c").hexdigest(),
+                         lines.splitlines()[1].split('  ')[0])
+        self.assertEqual(
+            hashlib.sha256(lines.encode('utf-8')).hexdigest(), folder.digest)
+        self.assertEqual(folder.digest, other.digest)
+
+    def test_output_without_writestr_not_created(self):
+        """Should not create an output writer that is missing writestr."""
+        class PartialOutput(EditionOutput):
+            def write(self, source_file, archive_file):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialOutput(file_path=self.test_output_path)
+
+    def test_directory_rebuild_replaces_folder(self):
+        """Should replace a changed site's folder when rebuilding."""
+        self.write('directory', rebuild=True)
+        stale = os.path.join(self.output_path, '41101', 'stale.txt')
+        open(stale, 'w').close()
+        os.remove(os.path.join(
+            self.temp_dir, 'R1309_BEHAVE-media', 'cffl6m_german.png'))
+        self.write('directory', rebuild=True)
+        self.assertFalse(os.path.exists(stale))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.output_path, '41101', 'R1309_BEHAVE-media',
+            'cffl6m_german.png')))
+
+    def test_delta_needs_zip_output(self):
+        """Should raise a ValueError for a delta of tar files."""
+        with self.assertRaises(ValueError):
+            self.write('tar', delta_from=self.output_path)
+
+
+class TestEditionsImages(TestEditionsTempForm):
+    """Rendering images into the editions related tests."""
+
+    def setUp(self):
+        super().setUp()
+        images_path = os.path.join(os.path.dirname(self.cwd),
+                                   'question_images')
+        self.xlsform = os.path.join(self.temp_dir, 'R1309_BEHAVE.xlsx')
+        shutil.copy(os.path.join(images_path, 'Q1309_BEHAVE.xlsx'),
+                    self.xlsform)
+        shutil.copytree(os.path.join(images_path, 'nest_images'),
+                        os.path.join(self.temp_dir, 'nest_images'))
+        self.media = os.path.join(self.temp_dir, 'R1309_BEHAVE-media')
+        self.media_files = sorted(os.listdir(self.media))
+        read_content = ImageContent.read
+
+        def first_questions(**kwargs):
+            language = read_content(**kwargs)
+            language['image_content'] = language['image_content'][:2]
+            return language
+
+        patcher = patch(
+            'odk_tools.question_images.images.ImageContent.read',
+            side_effect=first_questions)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, **kwargs):
+        Editions.write_language_editions(
+            xform_path=self.xform, site_languages=self.languages_two_only,
+            xlsform_path=self.xlsform, **kwargs)
+
+    def test_images_added_for_site_languages(self):
+        """Should add the rendered images of the site's languages only."""
+        spool_path = os.path.join(self.temp_dir, 'spool')
+        rendered = Editions._render_images(
+            xform_paths=[self.xform], xlsform_paths=[self.xlsform],
+            spool_path=spool_path)
+        self.write()
+        zip_name = os.path.join(self.output_path, '12501.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            names = zip_out.namelist()
+            for image_path, image in rendered.items():
+                name = 'R1309_BEHAVE-media/' + os.path.basename(image_path)
+                self.assertEqual(name, image.compressed.zinfo.filename)
+                self.assertEqual(image.compressed.path, image.path)
+                if image_path.endswith(('_french.png', '_english.png')):
+                    with open(image.path, 'rb') as image_file:
+                        self.assertEqual(
+                            zlib.decompress(image_file.read(), -15),
+                            zip_out.read(name))
+                else:
+                    self.assertNotIn(name, names)
+        self.assertEqual(10, len(rendered))
+        self.assertEqual({'.deflate'}, {os.path.splitext(x)[1] for x in
+                                        os.listdir(os.path.join(
+                                            spool_path, 'R1309_BEHAVE-media'))})
+        self.assertEqual(self.media_files, sorted(os.listdir(self.media)))
+        self.assertEqual(['12501.zip', '12501.zip.sha256', '41101.zip',
+                          '41101.zip.sha256'],
+                         sorted(os.listdir(self.output_path)))
+
+    def test_images_rendered_once(self):
+        """Should render each image once, for all the sites that use it."""
+        shutil.rmtree(self.media)
+        with patch.object(Images, '_encode_image',
+                          side_effect=Images._encode_image) as encode:
+            self.write(output_format='tar')
+        self.assertEqual(10, encode.call_count)
+        with tarfile.open(os.path.join(self.output_path, '41101.tar')) as tar:
+            self.assertEqual(3, len(tar.getnames()))
+        self.assertFalse(os.path.exists(self.media))
+
+    def test_images_not_imported_without_xlsform(self):
+        """Should not use the images module if no XLSForm is given."""
+        with patch('odk_tools.language_editions.editions.images', object()):
+            Editions.write_language_editions(
+                xform_path=self.xform, site_languages=self.languages_two_only)
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.output_path, '41101.zip')))
+
+    def test_images_write_media(self):
+        """Should also save the rendered images to the media folder."""
+        shutil.rmtree(self.media)
+        self.write(write_media=True)
+        self.assertEqual(10, len(os.listdir(self.media)))
+
+    def test_webp_media_matched_and_referenced(self):
+        """Should add WebP images for the languages, and reference them."""
+        for name in os.listdir(self.media):
+            if name.endswith('_german.png'):
+                image_path = os.path.join(self.media, name)
+                os.rename(image_path, image_path[:-len('.png')] + '.webp')
+        Editions.write_language_editions(
+            xform_path=self.xform, site_languages=self.languages_two_only)
+        zip_name = os.path.join(self.output_path, '41101.zip')
+        with zipfile.ZipFile(zip_name) as zip_out:
+            names = zip_out.namelist()
+            xform = zip_out.read('R1309_BEHAVE.xml').decode('utf-8')
+        self.assertIn('R1309_BEHAVE-media/cffl6m_german.webp', names)
+        self.assertEqual({'.webp', '.xml'},
+                         set(os.path.splitext(x)[1] for x in names))
+        self.assertIn('jr://images/cffl6m_german.webp', xform)
+        self.assertNotIn('jr://images/cffl6m_german.png', xform)
+
+    def test_images_need_matching_xform(self):
+        """Should raise a ValueError for an XLSForm without an XForm."""
+        xlsform = os.path.join(self.temp_dir, 'Q1309_BEHAVE.xlsx')
+        shutil.copy(self.xlsform, xlsform)
+        with self.assertRaises(ValueError):
+            Editions.write_language_editions(
+                xform_path=self.xform, site_languages=self.languages_two_only,
+                xlsform_path=xlsform)
+
+
+class TestEditionArchive(TestEditionsBase):
+    """Edition archive writer related tests."""
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.test_output_path, exist_ok=True)
+        self.zip_name = os.path.join(self.test_output_path, "61221.zip")
+
+    def test_skips_files_already_in_archive(self):
+        """Should skip and log files that are already in the archive."""
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.writestr("odk/forms/a.xml", b"a")
+        editions_log = 'odk_tools.language_editions.editions'
+        with self.assertLogs(editions_log, level='WARNING') as logs:
+            with EditionArchive(file_path=self.zip_name) as archive:
+                archive.writestr("odk/forms/a.xml", b"b")
+                archive.writestr("odk/forms/b.xml", b"b")
+        self.assertEqual(1, len(logs.output))
+        self.assertIn(os.path.normpath("odk/forms/a.xml"), logs.output[0])
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertEqual(["odk/forms/a.xml", "odk/forms/b.xml"],
+                             zip_out.namelist())
+            self.assertEqual(b"a", zip_out.read("odk/forms/a.xml"))
+
+    def test_skips_files_duplicated_in_same_open(self):
+        """Should skip files that are written twice while open."""
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.write_jobs(
+                jobs=[(self.collect_settings, "odk/collect.settings")],
+                xform=("a.xml", b"a"))
+            archive.write_jobs(
+                jobs=[(self.collect_settings, "odk/collect.settings")],
+                xform=("b.xml", b"b"))
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertEqual(["a.xml", "b.xml", "odk/collect.settings"],
+                             zip_out.namelist())
+
+    def test_run_zip_jobs_opens_site_archive_once(self):
+        """Should merge the jobs for many forms into one archive open."""
+        zip_jobs = [("61221", [], ("a.xml", b"a")),
+                    ("61221", [], ("b.xml", b"b")),
+                    ("61222", [], ("a.xml", b"a"))]
+        write_archive = 'odk_tools.language_editions.editions.' \
+                        'EditionArchive._write_archive'
+        with patch(write_archive, autospec=True,
+                   side_effect=EditionArchive._write_archive) as write_mock:
+            Editions._run_zip_jobs(self.test_output_path, iter(zip_jobs))
+        self.assertEqual(2, write_mock.call_count)
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertEqual(["a.xml", "b.xml"], zip_out.namelist())
+
+    def test_run_zip_jobs_appends_sites_not_together(self):
+        """Should append to the site archive if its jobs are not together."""
+        zip_jobs = [("61221", [], ("a.xml", b"a")),
+                    ("61222", [], ("a.xml", b"a")),
+                    ("61221", [], ("b.xml", b"b"))]
+        Editions._run_zip_jobs(self.test_output_path, zip_jobs)
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertEqual(["a.xml", "b.xml"], zip_out.namelist())
+
+    def test_iter_site_jobs_serializes_when_reached(self):
+        """Should serialize a site's XForms only when the site is reached."""
+        settings = {'61221': ('english',), '61222': ('english',)}
+        form = Editions._prepare_form_editions(
+            xform_path=self.xform2, settings=settings)
+        serialize = 'odk_tools.language_editions.editions.EditionDocument.' \
+                    'serialize_split'
+        with patch(serialize, return_value=b"a") as serialize_mock:
+            site_jobs = Editions._iter_site_jobs(
+                settings=settings, forms=[form, form])
+            self.assertEqual(0, serialize_mock.call_count)
+            self.assertEqual('61221', next(site_jobs)[0])
+            self.assertEqual(1, serialize_mock.call_count)
+            self.assertEqual(['61221', '61222', '61222'],
+                             [x[0] for x in site_jobs])
+
+    def test_write_compressed_file(self):
+        """Should add compressed files as is, and skip duplicates."""
+        compressed = Editions._compress_file(
+            source_file=self.collect_settings,
+            archive_file=os.path.join("odk", "collect.settings"))
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.write_jobs(jobs=[compressed], xform=("b.xml", b"b"))
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.write_jobs(jobs=[compressed], xform=("a.xml", b"a"))
+        with open(self.collect_settings, 'rb') as settings:
+            expected = settings.read()
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertIsNone(zip_out.testzip())
+            self.assertEqual(["a.xml", "b.xml", "odk/collect.settings"],
+                             zip_out.namelist())
+            self.assertEqual(expected, zip_out.read("odk/collect.settings"))
+
+    def test_compressed_files_not_compressed_again(self):
+        """Should copy compressed files as is, with their CRC and sizes."""
+        compressed = Editions._compress_file(
+            source_file=self.collect_settings,
+            archive_file="odk/collect.settings")
+        compress = 'odk_tools.language_editions.editions.zlib.compressobj'
+        with patch(compress, wraps=zlib.compressobj) as compress_mock:
+            with EditionArchive(file_path=self.zip_name) as archive:
+                archive.write_compressed(compressed=compressed)
+        self.assertEqual(0, compress_mock.call_count)
+        with zipfile.ZipFile(self.zip_name) as zip_out:
+            self.assertIsNone(zip_out.testzip())
+            zinfo = zip_out.getinfo("odk/collect.settings")
+            self.assertEqual(compressed.zinfo.CRC, zinfo.CRC)
+            self.assertEqual(compressed.zinfo.compress_size,
+                             zinfo.compress_size)
+
+    def test_archive_bytes_same_as_zipfile(self):
+        """Should write the same bytes as zipfile, for non-ASCII names too."""
+        other_zip = os.path.join(self.test_output_path, "61222.zip")
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.writestr("a.xml", b"a")
+            archive.writestr("b\u00e9.xml", b"b")
+        with zipfile.ZipFile(other_zip, mode="w") as other:
+            for name, data in (("a.xml", b"a"), ("b\u00e9.xml", b"b")):
+                other.writestr(Editions._fixed_zinfo(name), data)
+        with open(self.zip_name, 'rb') as first, \
+                open(other_zip, 'rb') as second:
+            self.assertEqual(second.read(), first.read())
+
+    def test_spooled_files_read_when_written(self):
+        """Should only read a spooled file when the archive is written."""
+        spooled = Editions._spool_compressed(
+            compressed=Editions._compress_file(
+                source_file=self.collect_settings,
+                archive_file="odk/collect.settings"),
+            spool_path=self.test_output_path)
+        read_spooled = 'odk_tools.language_editions.editions.Editions.' \
+                       '_read_spooled'
+        with patch(read_spooled, wraps=Editions._read_spooled) as read_mock:
+            with EditionArchive(file_path=self.zip_name) as archive:
+                archive.write_jobs(jobs=[spooled], xform=("a.xml", b"a"))
+                self.assertEqual(0, read_mock.call_count)
+            self.assertEqual(1, read_mock.call_count)
+
+    def test_appends_files_that_sort_after_existing(self):
+        """Should append files after the existing ones, with the same bytes."""
+        other_zip = os.path.join(self.test_output_path, "61222.zip")
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.writestr("a.xml", b"a")
+        replace = 'odk_tools.language_editions.editions.os.replace'
+        with patch(replace) as replace_mock:
+            with EditionArchive(file_path=self.zip_name) as archive:
+                archive.writestr("b.xml", b"b")
+        self.assertEqual(0, replace_mock.call_count)
+        with EditionArchive(file_path=other_zip) as other:
+            other.writestr("b.xml", b"b")
+            other.writestr("a.xml", b"a")
+        with open(self.zip_name, 'rb') as first, \
+                open(other_zip, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+
+    def test_archive_bytes_do_not_depend_on_order_or_time(self):
+        """Should write the same bytes for the same content, with a digest."""
+        other_zip = os.path.join(self.test_output_path, "61222.zip")
+        jobs = [(self.collect_settings, "odk/collect.settings")]
+        with EditionArchive(file_path=self.zip_name) as archive:
+            archive.write_jobs(jobs=jobs, xform=("b.xml", b"b"))
+            archive.writestr("a.xml", b"a")
+        stat = os.stat(self.collect_settings)
+        self.addCleanup(os.utime, self.collect_settings,
+                        (stat.st_atime, stat.st_mtime))
+        os.utime(self.collect_settings, (stat.st_atime, stat.st_mtime + 10))
+        with EditionArchive(file_path=other_zip) as other:
+            other.writestr("a.xml", b"a")
+        with EditionArchive(file_path=other_zip) as other:
+            other.write_jobs(jobs=jobs, xform=("b.xml", b"b"))
+        with open(self.zip_name, 'rb') as first, \
+                open(other_zip, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+        self.assertEqual(archive.digest, other.digest)
+        with open(self.zip_name + '.sha256', encoding='utf-8') as digest:
+            self.assertEqual(
+                '{0}  61221.zip\n'.format(archive.digest), digest.read())
@@ -2,12 +2,19 @@ import contextlib
 import os
 import shutil
 import io
+import tempfile
+import time
+import threading
 import xlrd
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 from odk_tools.question_images.images import Images, ImageContent, \
-    ImageSettings, write_images, _create_parser
+    ImageSettings, write_images, render_images, plan_images, \
+    update_xform_images, _create_parser
+from odk_tools.question_images.cache import ImageCache
+from odk_tools.question_images.xlsx_rows import XlsxRows
 from PIL import Image, ImageChops
+from lxml import etree
 import logging
 
 
@@ -28,6 +35,8 @@ class _TestImagesBase(TestCase):
     def tearDown(self):
         if self.clean_test_output_folder:
             shutil.rmtree(self.test_output_folder, ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(Images._get_digests_path(self.test_output_folder))
 
 
 class TestImages(_TestImagesBase):
@@ -55,6 +64,35 @@ class TestImages(_TestImagesBase):
         output_files = os.listdir(self.test_output_folder)
         self.assertEqual(184, len(output_files))
 
+    def test_write_single_language_stream(self):
+        """Should create the same number of images when streaming content."""
+        self.clean_test_output_folder = True
+        write_images(xlsform_path=self.xlsform1, stream=True)
+        output_files = os.listdir(self.test_output_folder)
+        self.assertEqual(184, len(output_files))
+
+    def test_write_stream_reads_rows_lazily(self):
+        """Should read the xlsx survey rows as the questions are reached,
+        without opening the xlsform with xlrd."""
+        row_values = XlsxRows._row_values
+        read = list()
+
+        def write(**kwargs):
+            content = kwargs['settings']['image_content']
+            read.append(row_values_mock.call_count)
+            next(content)
+            read.append(row_values_mock.call_count)
+
+        with patch('xlrd.open_workbook') as opened, \
+                patch.object(XlsxRows, '_row_values', autospec=True,
+                             side_effect=row_values) as row_values_mock, \
+                patch.object(Images, 'write', side_effect=write):
+            write_images(xlsform_path=self.xlsform1, stream=True)
+        self.assertEqual(0, opened.call_count)
+        self.assertEqual(2, len(read))
+        self.assertLess(read[1] - read[0], 10)
+        self.assertEqual(read[1], row_values_mock.call_count)
+
     def test_create_parser_without_args(self):
         """Should exit when no args provided."""
         with contextlib.redirect_stderr(io.StringIO()):
@@ -68,6 +106,20 @@ class TestImages(_TestImagesBase):
         args = _create_parser().parse_args([input_arg])
         self.assertEqual(input_arg, args.xlsform)
 
+    def test_create_parser_with_plan(self):
+        """Should parse the plan flag, defaulting to False."""
+        input_arg = 'Q1302_BEHAVE.xlsx'
+        self.assertFalse(_create_parser().parse_args([input_arg]).plan)
+        args = _create_parser().parse_args(['--plan', input_arg])
+        self.assertTrue(args.plan)
+
+    def test_create_parser_with_stream(self):
+        """Should parse the stream flag, defaulting to False."""
+        input_arg = 'Q1302_BEHAVE.xlsx'
+        self.assertFalse(_create_parser().parse_args([input_arg]).stream)
+        args = _create_parser().parse_args(['--stream', input_arg])
+        self.assertTrue(args.stream)
+
     def test_open_image_bad_path(self):
         """Should raise a FileNotFoundError if the file doesn't exist."""
         image_path = "some_image.png"
@@ -319,6 +371,354 @@ class TestImagesPrepareQuestionImages(_TestImagesBase):
         self.assertTrue(diff_dict["minor"] <= pixel_count * 0.001, diff_dict)
         self.assertTrue(diff_dict["large"] == 0, diff_dict)
 
+    def render(self):
+        base_image, pixels_from_top = Images._prepare_base_image(
+            settings=self.settings, xlsform_path=self.xlsform1)
+        images = Images._prepare_question_images(
+            base_image=base_image, pixels_from_top=pixels_from_top,
+            settings=self.settings, output_path='',
+            xlsform_path=self.xlsform1)
+        return next(images)[0]
+
+    def test_crop_to_content(self):
+        """Should crop to the content plus margin, and draw the same pixels."""
+        self.settings['image_content'][0]['nest_image_column'] = ''
+        full = self.render()
+        self.settings.update(image_crop=1, image_crop_margin=15)
+        cropped = self.render()
+        _, pixels_from_top = Images._prepare_base_image(
+            settings=self.settings, xlsform_path=self.xlsform1)
+        layout = next(Images._layout_question_images(
+            image_size=full.size, pixels_from_top=pixels_from_top,
+            settings=self.settings, output_path='',
+            xlsform_path=self.xlsform1))
+        self.assertEqual(full.size[0], cropped.size[0])
+        self.assertEqual(layout['pixels_from_top'] + 15, cropped.size[1])
+        self.assertLess(cropped.size[1], full.size[1])
+        diff = ImageChops.difference(
+            full.crop((0, 0) + cropped.size), cropped)
+        self.assertIsNone(diff.getbbox())
+
+    def test_crop_size(self):
+        """Should keep the minimum height, and never make the image taller."""
+        settings = {'image_crop': 1, 'image_crop_margin': 10,
+                    'image_crop_min_height': 200}
+        self.assertEqual((700, 200), Images._crop_size(
+            image_size=(700, 600), pixels_from_top=50, settings=settings))
+        self.assertEqual((700, 310), Images._crop_size(
+            image_size=(700, 600), pixels_from_top=300, settings=settings))
+        self.assertEqual((700, 600), Images._crop_size(
+            image_size=(700, 600), pixels_from_top=650, settings=settings))
+        settings['image_crop'] = 0
+        self.assertEqual((700, 600), Images._crop_size(
+            image_size=(700, 600), pixels_from_top=50, settings=settings))
+
+
+class TestImagesPlan(_TestImagesBase):
+    """Tests for Images.plan() and plan_images()"""
+
+    def test_plan_single_language(self):
+        """Should plan the expected number of images without writing any."""
+        shutil.rmtree(self.test_output_folder, ignore_errors=True)
+        plans = plan_images(xlsform_path=self.xlsform1)
+        self.assertEqual(184, len(plans['english']))
+        self.assertFalse(os.path.isdir(self.test_output_folder))
+        self.assertEqual({'new'}, {y for x in plans['english']
+                                   for y in x['images'].values()})
+
+    def test_plan_compares_existing_images(self):
+        """Should report new, changed and unchanged images and profiles."""
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        xlsform = os.path.join(temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(self.xlsform1, xlsform)
+        shutil.copytree(os.path.join(self.cwd, 'nest_images'),
+                        os.path.join(temp_dir, 'nest_images'))
+        settings = ImageSettings.read(xlsform_workbook=self.xlsform1_workbook)
+        settings = ImageContent.read(
+            xlsform_workbook=self.xlsform1_workbook, settings=settings[2])
+        settings['image_content'] = settings['image_content'][:3]
+        settings['image_profiles'] = 'phone:350'
+        cache = ImageCache(cache_path=os.path.join(temp_dir, 'cache'))
+        Images.write(xlsform_path=xlsform, settings=settings, cache=cache)
+        planned = Images.plan(xlsform_path=xlsform, settings=settings)
+        changed = list(planned[0]['images'])[1]
+        with open(changed, 'wb') as image_file:
+            image_file.write(b'changed')
+        os.remove(planned[1]['image_path'])
+        with patch.object(Images, '_render_layout',
+                          wraps=Images._render_layout) as render_layout, \
+                patch.object(Images, '_save_image',
+                             wraps=Images._save_image) as save_image:
+            planned = Images.plan(xlsform_path=xlsform, settings=settings)
+            cached = Images.plan(
+                xlsform_path=xlsform, settings=settings, cache=cache)
+        self.assertEqual(0, render_layout.call_count)
+        self.assertEqual(0, save_image.call_count)
+        for plan in (planned, cached):
+            statuses = [list(x['images'].values()) for x in plan]
+            self.assertEqual([['unchanged', 'changed'], ['new', 'unchanged'],
+                              ['unchanged', 'unchanged']], statuses)
+            self.assertTrue(list(plan[0]['images'])[1].startswith(
+                os.path.join(temp_dir, 'phone')))
+        settings['image_color'] = 'red'
+        planned = Images.plan(xlsform_path=xlsform, settings=settings)
+        self.assertEqual({'new', 'changed'}, {
+            y for x in planned for y in x['images'].values()})
+
+    def test_plan_matches_rendered_layout(self):
+        """Should calculate the same final offset as rendering the image."""
+        settings = ImageSettings.read(xlsform_workbook=self.xlsform1_workbook)
+        settings = ImageContent.read(
+            xlsform_workbook=self.xlsform1_workbook, settings=settings[2])
+        settings['image_content'] = [x for x in settings['image_content']
+                                     if x['file_name_column'] == 'da2d10ye']
+        base_image, pixels_from_top = Images._prepare_base_image(
+            settings=settings, xlsform_path=self.xlsform1)
+        rendered = list(Images._layout_question_images(
+            image_size=base_image.size, pixels_from_top=pixels_from_top,
+            settings=settings, output_path='', xlsform_path=self.xlsform1))
+        planned = Images.plan(xlsform_path=self.xlsform1, settings=settings)
+        self.assertEqual(rendered[0]['pixels_from_top'],
+                         planned[0]['pixels_from_top'])
+        self.assertEqual(rendered[0]['elements'], planned[0]['elements'])
+        self.assertEqual(['text', 'text', 'image'],
+                         [x[0] for x in planned[0]['elements']])
+
+    def test_plan_reports_overflows(self):
+        """Should report lines outside of the image margins."""
+        settings = ImageSettings.read(xlsform_workbook=self.xlsform1_workbook)
+        settings = ImageContent.read(
+            xlsform_workbook=self.xlsform1_workbook, settings=settings[2])
+        settings['image_width'] = 100
+        settings['image_height'] = 100
+        planned = Images.plan(xlsform_path=self.xlsform1, settings=settings)
+        overflows = [y for x in planned for y in x['overflows']]
+        self.assertTrue(len(overflows) > 0)
+        self.assertEqual({'width', 'height'}, set(x[0] for x in overflows))
+
+    def test_layout_text_matches_draw_text(self):
+        """Should calculate the same offset as drawing the text."""
+        settings = {'text_label_font_name': 'arialbd.ttf',
+                    'text_label_font_size': 32,
+                    'text_label_font_color': 'red'}
+        font_kwargs = ImageSettings._get_font_kwargs(
+            settings=settings, label_or_hint='label')
+        text = ['This is some text', 'that is for a question']
+        base_image = Images._create_blank_image(500, 500, 'white')
+        _, expected = Images._draw_text(
+            base_image=base_image, pixels_from_top=0, pixels_before=10,
+            pixels_between=5, **font_kwargs, text=text, image_name='img')
+        _, observed, overflows = Images._layout_text(
+            image_size=(500, 500), pixels_from_top=0, pixels_before=10,
+            pixels_between=5, font=font_kwargs['font'], text=text)
+        self.assertEqual(expected, observed)
+        self.assertEqual([], overflows)
+
+
+class _TestImagesTempForm(_TestImagesBase):
+    """Base for tests that write the images for a copy of a form."""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(self.xlsform1, self.xlsform)
+        shutil.copytree(os.path.join(self.cwd, 'nest_images'),
+                        os.path.join(self.temp_dir, 'nest_images'))
+        self.media = os.path.join(self.temp_dir, 'Q1302_BEHAVE-media')
+        self.phone_media = os.path.join(
+            self.temp_dir, 'phone', 'Q1302_BEHAVE-media')
+        read_settings = ImageSettings.read
+        read_content = ImageContent.read
+
+        def with_profiles(**kwargs):
+            all_settings = read_settings(**kwargs)
+            for settings in all_settings.values():
+                settings['image_profiles'] = self.profiles
+            return all_settings
+
+        def first_questions(**kwargs):
+            language = read_content(**kwargs)
+            language['image_content'] = language['image_content'][:3]
+            return language
+
+        self.profiles = 'phone:350'
+        images_module = 'odk_tools.question_images.images.{0}'
+        for name, side_effect in (('ImageSettings.read', with_profiles),
+                                  ('ImageContent.read', first_questions)):
+            patcher = patch(images_module.format(name),
+                            side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestImagesProfiles(_TestImagesTempForm):
+    """Tests for writing images for output profiles."""
+
+    def test_parse_profiles(self):
+        """Should parse the names and widths, and reject other values."""
+        self.assertEqual([], ImageSettings._parse_profiles(''))
+        self.assertEqual(
+            [('phone', 720), ('tablet', 1536)],
+            ImageSettings._parse_profiles('phone:720, tablet: 1536'))
+        for profiles in ('phone', 'phone:wide', ':720', 'phone:0'):
+            with self.assertRaises(ValueError):
+                ImageSettings._parse_profiles(profiles)
+
+    def test_settings_digest_ignores_profiles(self):
+        """Should not change the settings digest if the profiles change."""
+        settings = list(ImageSettings.read(
+            xlsform_workbook=self.xlsform1_workbook).values())[0]
+        expected = Images._settings_digest(
+            settings=settings, xlsform_path=self.xlsform)
+        settings['image_profiles'] = 'phone:350, tablet:700'
+        self.assertEqual(expected, Images._settings_digest(
+            settings=settings, xlsform_path=self.xlsform))
+
+    def test_write_profiles_from_one_layout(self):
+        """Should write scaled images for the profile, laying out once."""
+        with patch.object(Images, '_layout_text',
+                          side_effect=Images._layout_text) as layout_text:
+            write_images(xlsform_path=self.xlsform)
+        names = sorted(os.listdir(self.media))
+        self.assertEqual(3, len(names))
+        self.assertEqual(names, sorted(os.listdir(self.phone_media)))
+        self.profiles = ''
+        with patch.object(Images, '_layout_text',
+                          side_effect=Images._layout_text) as expected:
+            write_images(xlsform_path=self.xlsform)
+        self.assertEqual(expected.call_count, layout_text.call_count)
+        for name in names:
+            full = Images._open_image(os.path.join(self.media, name))
+            phone = Images._open_image(os.path.join(self.phone_media, name))
+            self.assertEqual((350, 300), phone.size)
+            diff = ImageChops.difference(
+                phone.convert('L'), full.resize(phone.size).convert('L'))
+            self.assertLess(sum(diff.histogram()[64:]), 350 * 300 * 0.05)
+
+    def test_write_profiles_with_cache(self):
+        """Should cache the profile images, and re-use them."""
+        cache = ImageCache(cache_path=os.path.join(self.temp_dir, 'cache'))
+        first = Images.write
+        counts = list()
+
+        def write_and_count(**kwargs):
+            counts.append(first(**kwargs))
+            return counts[-1]
+
+        with patch.object(Images, 'write', side_effect=write_and_count):
+            write_images(xlsform_path=self.xlsform, cache=cache)
+            shutil.rmtree(self.phone_media)
+            write_images(xlsform_path=self.xlsform, cache=cache)
+        self.assertEqual(6, counts[0]['written'])
+        self.assertEqual(0, counts[1]['written'])
+        self.assertEqual(3, counts[1]['cached'])
+        self.assertEqual(3, len(os.listdir(self.phone_media)))
+
+
+class TestImagesFormats(_TestImagesTempForm):
+    """Tests for writing images in other image formats."""
+
+    def patch_format(self, image_format):
+        """Patch the image settings to use the format."""
+        read_settings = ImageSettings.read
+        read_formats = ImageSettings.read_image_formats
+
+        def with_format(**kwargs):
+            all_settings = read_settings(**kwargs)
+            for settings in all_settings.values():
+                settings['image_format'] = image_format
+            return all_settings
+
+        def formats(**kwargs):
+            return {x: image_format for x in read_formats(**kwargs)}
+
+        return patch.multiple(
+            'odk_tools.question_images.images.ImageSettings',
+            read=MagicMock(side_effect=with_format),
+            read_image_formats=MagicMock(side_effect=formats))
+
+    def write_format(self, image_format):
+        """Write the images in the format, and return the file names."""
+        shutil.rmtree(self.media, ignore_errors=True)
+        with self.patch_format(image_format):
+            write_images(xlsform_path=self.xlsform)
+        return sorted(os.listdir(self.media))
+
+    def test_check_image_format(self):
+        """Should accept the supported formats, and reject others."""
+        ImageSettings._check_image_format('png8')
+        with self.assertRaises(ValueError):
+            ImageSettings._check_image_format('gif')
+
+    def test_write_webp_lossless(self):
+        """Should write WebP images with the same pixels as the PNG images."""
+        self.profiles = ''
+        expected = [Images._open_image(os.path.join(self.media, x))
+                    for x in self.write_format('png')]
+        observed = self.write_format('webp')
+        self.assertEqual(3, len(observed))
+        for name, png in zip(observed, expected):
+            self.assertTrue(name.endswith('.webp'))
+            with Image.open(os.path.join(self.media, name)) as image:
+                self.assertEqual('WEBP', image.format)
+                diff = ImageChops.difference(
+                    png.convert('RGB'), image.convert('RGB'))
+            self.assertIsNone(diff.getbbox())
+
+    def test_write_png8_with_profiles(self):
+        """Should write palette PNG images, for the profiles too."""
+        observed = self.write_format('png8')
+        self.assertEqual(3, len(observed))
+        for name in observed:
+            for folder in (self.media, self.phone_media):
+                with Image.open(os.path.join(folder, name)) as image:
+                    self.assertEqual(('PNG', 'P'), (image.format, image.mode))
+
+    def test_update_xform_images(self):
+        """Should point the XForm image references at the WebP images."""
+        names = self.write_format('webp')
+        stems = [os.path.splitext(x)[0] for x in names]
+        xform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xml')
+        values = ['<value form="image">jr://images/{0}.png</value>'.format(x)
+                  for x in stems + ['logo']]
+        with open(xform, 'w', encoding='UTF-8') as xform_file:
+            xform_file.write('<html><text>{0}</text></html>'.format(
+                ''.join(values)))
+        with self.patch_format('webp'):
+            observed = update_xform_images(
+                xform_path=xform, xlsform_path=self.xlsform)
+        self.assertEqual(3, observed)
+        document = etree.parse(xform)
+        expected = ['jr://images/{0}'.format(x) for x in names]
+        expected.append('jr://images/logo.png')
+        self.assertEqual(expected, [x.text for x in document.iter('value')])
+        with self.patch_format('png'):
+            self.assertEqual(0, update_xform_images(
+                xform_path=xform, xlsform_path=self.xlsform))
+
+    def test_update_xform_images_reads_formats_only(self):
+        """Should not load fonts, and only read image_format if it's png."""
+        xform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xml')
+        with open(xform, 'w', encoding='UTF-8') as xform_file:
+            xform_file.write('<html><value>jr://images/a.png</value></html>')
+        get_font_kwargs = 'odk_tools.question_images.images.ImageSettings.' \
+                          '_get_font_kwargs'
+        with patch(get_font_kwargs) as font_mock:
+            self.assertEqual(0, update_xform_images(
+                xform_path=xform, xlsform_path=self.xlsform))
+            with self.patch_format('webp'):
+                self.assertEqual(0, update_xform_images(
+                    xform_path=xform, xlsform_path=self.xlsform))
+        self.assertEqual(0, font_mock.call_count)
+        read = 'odk_tools.question_images.images.ImageSettings.read'
+        with patch(read) as read_mock:
+            self.assertEqual(0, update_xform_images(
+                xform_path=xform, xlsform_path=self.xlsform))
+        self.assertEqual(0, read_mock.call_count)
+
 
 class TestImagesPasteImage(TestCase):
     """Tests for Images._paste_image()"""
@@ -403,6 +803,12 @@ class TestImagesPasteImage(TestCase):
             max_height=None)
         self.assertEqual(expected, observed)
 
+    def test_fit_size_same_as_thumbnail(self):
+        """Should shrink to the box preserving aspect ratio, never enlarge."""
+        self.assertEqual((480, 384), Images._fit_size((750, 600), (480, 485)))
+        self.assertEqual((388, 485), Images._fit_size((600, 750), (480, 485)))
+        self.assertEqual((100, 50), Images._fit_size((100, 50), (480, 485)))
+
     def test_doesnt_alter_input_paste_image(self):
         """Resizing should be done on a copy, not the original."""
         base_image = Images._create_blank_image(500, 500, 'red')
@@ -514,6 +920,141 @@ class TestImagesDrawText(_TestImagesBase):
         self.assertEqual(expected, len(logs.output))
 
 
+class TestImagesSave(TestCase):
+    """Tests for the image saving pipeline."""
+
+    def setUp(self):
+        self.patch_save = 'odk_tools.question_images.images.Images._save_image'
+
+    @staticmethod
+    def _images(count, rendered):
+        for i in range(count):
+            rendered.append(i)
+            yield MagicMock(), 'image_{0}.png'.format(i)
+
+    def test_save_images_saves_all(self):
+        """Should save every image from the generator."""
+        rendered = list()
+        saved_paths = list()
+        with patch(self.patch_save) as save_image:
+            saved = Images._save_images(
+                images=self._images(20, rendered), writers=3, queue_size=2,
+                on_saved=saved_paths.append)
+        self.assertEqual(20, save_image.call_count)
+        self.assertEqual(20, saved)
+        self.assertEqual(20, len(set(saved_paths)))
+
+    def test_save_images_limits_images_waiting(self):
+        """Should pause rendering while the queue of images is full."""
+        rendered = list()
+        save_started = threading.Event()
+        release = threading.Event()
+
+        def slow_save(image, image_path):
+            save_started.set()
+            release.wait(timeout=10)
+
+        result = list()
+        with patch(self.patch_save, side_effect=slow_save):
+            thread = threading.Thread(target=lambda: result.append(
+                Images._save_images(images=self._images(50, rendered),
+                                    writers=2, queue_size=3)))
+            thread.start()
+            save_started.wait(timeout=10)
+            time.sleep(0.2)
+            waiting = len(rendered)
+            release.set()
+            thread.join(timeout=10)
+        self.assertLessEqual(waiting, 3 + 2 + 1)
+        self.assertEqual([50], result)
+
+    def test_save_images_error_includes_image_name(self):
+        """Should stop, and raise an error naming the image that failed."""
+        rendered = list()
+
+        def failing_save(image, image_path):
+            if image_path == 'image_3.png':
+                raise OSError("disk full")
+
+        with patch(self.patch_save, side_effect=failing_save):
+            with self.assertRaises(OSError) as ar_context:
+                Images._save_images(
+                    images=self._images(100, rendered), writers=2,
+                    queue_size=2)
+        self.assertIn('image_3.png', str(ar_context.exception))
+        self.assertIn('disk full', str(ar_context.exception))
+        self.assertLess(len(rendered), 100)
+
+    def test_encode_images_in_order(self):
+        """Should yield the encoded images in the order they were rendered."""
+        rendered = list()
+        patch_encode = 'odk_tools.question_images.images.Images._encode_image'
+
+        def slow_encode(image, image_path):
+            time.sleep(0.01 * (len(rendered) % 3))
+            return image
+
+        with patch(patch_encode, side_effect=slow_encode):
+            observed = [x[0] for x in Images._encode_images(
+                images=self._images(20, rendered), writers=3, queue_size=2)]
+        self.assertEqual(['image_{0}.png'.format(x) for x in range(20)],
+                         observed)
+
+    def test_render_images_same_as_saved(self):
+        """Should yield the same data as write_images saves, for each image."""
+        xlsform = os.path.join(os.path.dirname(__file__), 'Q1302_BEHAVE.xlsx')
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        saved_path = os.path.join(temp_dir, 'saved')
+        media_path = os.path.join(temp_dir, 'media')
+        os.makedirs(saved_path)
+        read_content = ImageContent.read
+
+        def first_questions(**kwargs):
+            language = read_content(**kwargs)
+            language['image_content'] = language['image_content'][:5]
+            return language
+
+        read_settings = ImageSettings.read
+
+        def with_profiles(**kwargs):
+            all_settings = read_settings(**kwargs)
+            for settings in all_settings.values():
+                settings['image_profiles'] = 'phone:350'
+            return all_settings
+
+        with patch('odk_tools.question_images.images.ImageContent.read',
+                   side_effect=first_questions), \
+                patch('odk_tools.question_images.images.Images.'
+                      '_create_output_directory', return_value=saved_path):
+            write_images(xlsform_path=xlsform)
+            rendered = list(render_images(
+                xlsform_path=xlsform, output_path=media_path))
+            self.assertFalse(os.path.exists(media_path))
+            written = list(render_images(
+                xlsform_path=xlsform, output_path=media_path,
+                write_media=True))
+        self.assertEqual(5, len(rendered))
+        self.assertEqual(rendered, written)
+        with patch('odk_tools.question_images.images.ImageContent.read',
+                   side_effect=first_questions), \
+                patch.object(ImageSettings, 'read',
+                             side_effect=with_profiles):
+            profiled = list(render_images(
+                xlsform_path=xlsform, output_path=media_path))
+            unprofiled = list(render_images(
+                xlsform_path=xlsform, output_path=media_path,
+                profiles=False))
+        self.assertEqual(10, len(profiled))
+        self.assertEqual(rendered, unprofiled)
+        for image_path, data in rendered:
+            self.assertEqual(media_path, os.path.dirname(image_path))
+            for folder in (saved_path, media_path):
+                with open(os.path.join(folder, os.path.basename(
+                        image_path)), 'rb') as image_file:
+                    self.assertEqual(data, image_file.read())
+
+
 class TestImageSettings(_TestImagesBase):
     """Tests for ImageSettings class."""
 
@@ -551,6 +1092,8 @@ class TestImageSettings(_TestImagesBase):
         self.assertEqual(observed['text_label_font_name'], 'arialbd.ttf')
         self.assertIsInstance(observed['text_hint_pixels_line'], int)
         self.assertIsInstance(observed['nest_image_column'], str)
+        self.assertEqual(0, observed['image_crop'])
+        self.assertEqual('png', observed['image_format'])
 
     def test_get_font_kwargs_label(self):
         """Should return label font kwargs dict with expected values."""
@@ -628,6 +1171,19 @@ class TestImageContent(_TestImagesBase):
         self.assertEqual('nl_visit', image_content[0]['file_name_column'])
         self.assertEqual(['Subject ID'], image_content[2]['text_label_column'])
 
+    def test_read_stream_same_as_list(self):
+        """Should lazily yield the same image content as the list."""
+        settings = ImageSettings.read(
+            xlsform_workbook=self.xlsform1_workbook)
+        expected = ImageContent.read(
+            xlsform_workbook=self.xlsform1_workbook,
+            settings=dict(settings[2]))['image_content']
+        observed = ImageContent.read(
+            xlsform_workbook=self.xlsform1_workbook,
+            settings=dict(settings[2]), stream=True)['image_content']
+        self.assertNotIsInstance(observed, list)
+        self.assertEqual(expected, list(observed))
+
 
 class TestImageContentWrapText(TestCase):
     """Tests for ImageContent._wrap_text()"""
@@ -0,0 +1,158 @@
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import TestCase
+from unittest.mock import patch
+from odk_tools.question_images import batch, images
+from odk_tools.question_images.images import Images
+
+
+class TestBatch(TestCase):
+    """Tests for writing images for many XLSForms."""
+
+    def setUp(self):
+        source = os.path.dirname(__file__)
+        self.temp_dir = tempfile.mkdtemp()
+        self.xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(os.path.join(source, 'Q1302_BEHAVE.xlsx'), self.xlsform)
+        shutil.copytree(os.path.join(source, 'nest_images'),
+                        os.path.join(self.temp_dir, 'nest_images'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_find_xlsforms(self):
+        """Should find forms in folders and globs, without lock files."""
+        other = os.path.join(self.temp_dir, 'Q1309.xlsx')
+        for name in (other, os.path.join(self.temp_dir, '~$Q1309.xlsx'),
+                     os.path.join(self.temp_dir, 'notes.txt')):
+            open(name, 'w').close()
+        observed = batch.find_xlsforms(paths=[
+            self.temp_dir, os.path.join(self.temp_dir, 'Q13*.xlsx'),
+            self.xlsform])
+        self.assertEqual([self.xlsform, other], observed)
+
+    def test_prepare_form_tasks(self):
+        """Should split each language's questions into picklable chunks."""
+        tasks = batch._prepare_form_tasks(
+            xlsform_path=self.xlsform, chunk_size=50)
+        self.assertEqual(184, sum(len(x['image_content']) for x in tasks))
+        self.assertTrue(all(len(x['image_content']) <= 50 for x in tasks))
+        self.assertNotIn('label_font_kwargs', tasks[0])
+        self.assertEqual(tasks, pickle.loads(pickle.dumps(tasks)))
+
+    def test_write_many_images_in_process(self):
+        """Should write chunks in this process, and report unreadable forms."""
+        missing = os.path.join(self.temp_dir, 'missing.xlsx')
+        prepare = batch._prepare_form_tasks
+
+        def first_tasks(xlsform_path, chunk_size):
+            return prepare(xlsform_path, chunk_size)[:2]
+
+        with patch('odk_tools.question_images.batch._prepare_form_tasks',
+                   side_effect=first_tasks):
+            summary = batch.write_many_images(
+                xlsform_paths=[self.xlsform, missing], workers=0,
+                chunk_size=5)
+        self.assertEqual(10, summary[self.xlsform]['images'])
+        self.assertEqual(10, summary[self.xlsform]['written'])
+        self.assertEqual([], summary[self.xlsform]['errors'])
+        self.assertEqual(0, summary[missing]['images'])
+        self.assertIn('Could not read XLSForm', summary[missing]['errors'][0])
+
+    def test_write_many_images_records_chunk_errors(self):
+        """Should count a chunk's images as failed if it raises any error."""
+        write = 'odk_tools.question_images.batch.Images.write'
+        with patch(write, side_effect=KeyError('text_label_font_name')):
+            summary = batch.write_many_images(
+                xlsform_paths=[self.xlsform], workers=0, chunk_size=100)
+        self.assertEqual(184, summary[self.xlsform]['failed'])
+        self.assertEqual(0, summary[self.xlsform]['written'])
+        self.assertEqual(["'text_label_font_name'"],
+                         summary[self.xlsform]['errors'])
+
+    def test_render_chunk_counts_image_files(self):
+        """Should count the profile images, and return the warnings."""
+        settings = batch._prepare_form_tasks(
+            xlsform_path=self.xlsform, chunk_size=3)[0]
+        settings['image_profiles'] = 'phone:350'
+
+        def write(**kwargs):
+            images.logger.warning('Text outside image margins.')
+            return {'written': 2, 'cached': 2, 'overflowed': 1}
+
+        with patch('odk_tools.question_images.batch.Images.write',
+                   side_effect=write):
+            result = batch._render_chunk(
+                xlsform_path=self.xlsform, settings=settings)
+        self.assertEqual(6, result['images'])
+        self.assertEqual(2, result['written'])
+        self.assertEqual(4, result['skipped'])
+        self.assertEqual(2, result['overflowed'])
+        self.assertEqual(['Text outside image margins.'], result['warnings'])
+        with self.assertLogs('odk_tools.question_images.batch',
+                             level='WARNING') as logs:
+            batch._add_result(dict(), self.xlsform, result)
+        self.assertIn('Text outside image margins.', logs.output[0])
+
+    def test_write_many_images_records_broken_pool(self):
+        """Should count a chunk's images as failed if its worker crashed."""
+        def submit(*args):
+            future = Future()
+            future.set_exception(BrokenProcessPool('terminated abruptly'))
+            return future
+
+        executor = 'odk_tools.question_images.batch.ProcessPoolExecutor'
+        with patch(executor) as executor_mock:
+            executor_mock.return_value.__enter__.return_value.submit \
+                .side_effect = submit
+            summary = batch.write_many_images(
+                xlsform_paths=[self.xlsform], workers=2, chunk_size=100)
+        self.assertEqual(184, summary[self.xlsform]['failed'])
+        self.assertEqual(["Worker process failed: terminated abruptly"],
+                         summary[self.xlsform]['errors'])
+
+    def test_write_many_images_process_pool(self):
+        """Should write all images on the pool, then skip cached images."""
+        cache_options = {'cache_path': os.path.join(self.temp_dir, 'cache')}
+        first = batch.write_many_images(
+            xlsform_paths=[self.xlsform], workers=2, chunk_size=50,
+            cache_options=cache_options)
+        self.assertEqual(184, first[self.xlsform]['written'] +
+                         first[self.xlsform]['skipped'])
+        self.assertEqual(184, len(os.listdir(
+            Images._get_output_directory(self.xlsform))))
+        self.assertEqual(184, len(Images._read_digests(
+            Images._get_output_directory(self.xlsform))))
+        second = batch.write_many_images(
+            xlsform_paths=[self.xlsform], workers=0, chunk_size=50,
+            cache_options=cache_options)
+        self.assertEqual(0, second[self.xlsform]['written'])
+        self.assertEqual(184, second[self.xlsform]['skipped'])
+
+    def test_format_summary(self):
+        """Should show a row per form and a total row."""
+        counts = dict(images=3, written=2, skipped=1, overflowed=1, failed=0)
+        summary = {'a/Q1.xlsx': dict(counts, errors=[]),
+                   'b/Q2.xlsx': dict(counts, errors=['bad'])}
+        observed = batch.format_summary(summary=summary).splitlines()
+        self.assertEqual(4, len(observed))
+        self.assertTrue(observed[2].startswith('Q2.xlsx (errors: 1)'))
+        self.assertEqual(['total', '(2', 'forms)', '6', '4', '2', '2', '0'],
+                         observed[3].split())
+
+    def test_create_parser(self):
+        """Should parse many paths and the pool options."""
+        args = batch._create_parser().parse_args(
+            ['--cache', 'forms', 'Q13*.xlsx', '--workers', '4'])
+        self.assertEqual(['forms', 'Q13*.xlsx'], args.xlsforms)
+        self.assertEqual(4, args.workers)
+        self.assertTrue(args.cache)
+        self.assertIsNone(args.cache_dir)
+        args = batch._create_parser().parse_args(
+            ['--cache-dir', 'cache', 'forms'])
+        self.assertEqual(['forms'], args.xlsforms)
+        self.assertEqual('cache', args.cache_dir)
@@ -0,0 +1,210 @@
+import os
+import shutil
+import tempfile
+import time
+import xlrd
+from unittest import TestCase
+from unittest.mock import patch
+from odk_tools.question_images.cache import ImageCache
+from odk_tools.question_images.images import Images, ImageSettings, \
+    ImageContent, _create_parser
+
+
+class TestImageCache(TestCase):
+    """Tests for the ImageCache class."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.temp_dir, 'cache')
+        self.cache = ImageCache(cache_path=self.cache_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write_file(self, name, content):
+        file_path = os.path.join(self.temp_dir, name)
+        with open(file_path, mode='wb') as out_file:
+            out_file.write(content)
+        return file_path
+
+    def test_render_key_differs_by_digest(self):
+        """Should return a different key for different inputs."""
+        self.assertEqual(ImageCache.render_key('a', 'b'),
+                         ImageCache.render_key('a', 'b'))
+        self.assertNotEqual(ImageCache.render_key('a', 'b'),
+                            ImageCache.render_key('ab', ''))
+
+    def test_render_key_differs_by_pillow_version(self):
+        """Should return a different key for a different Pillow version."""
+        key = ImageCache.render_key('a', 'b')
+        with patch('odk_tools.question_images.cache.PIL.__version__', '0.1'):
+            self.assertNotEqual(key, ImageCache.render_key('a', 'b'))
+
+    def test_fetch_missing(self):
+        """Should return False and not create a file if not cached."""
+        image_path = os.path.join(self.temp_dir, 'out.png')
+        self.assertFalse(self.cache.fetch(key='abc', image_path=image_path))
+        self.assertFalse(os.path.isfile(image_path))
+
+    def test_store_then_fetch(self):
+        """Should copy the stored image to the fetch path."""
+        source = self.write_file('source.png', b'image data')
+        self.cache.store(key='abc', image_path=source)
+        image_path = os.path.join(self.temp_dir, 'out.png')
+        self.assertTrue(self.cache.fetch(key='abc', image_path=image_path))
+        with open(image_path, mode='rb') as observed:
+            self.assertEqual(b'image data', observed.read())
+
+    def test_fetch_with_link(self):
+        """Should hard link the cached image to the fetch path."""
+        self.cache.link = True
+        source = self.write_file('source.png', b'image data')
+        self.cache.store(key='abc', image_path=source)
+        image_path = os.path.join(self.temp_dir, 'out.png')
+        self.cache.fetch(key='abc', image_path=image_path)
+        self.assertEqual(2, os.stat(image_path).st_nlink)
+
+    def test_fetch_with_link_keeps_modified_time(self):
+        """Should not touch a linked entry, so the output image's modified
+        time is still the time it was stored."""
+        self.cache.link = True
+        source = self.write_file('source.png', b'image data')
+        self.cache.store(key='abc', image_path=source)
+        old_time = time.time() - 100
+        entry_path = self.cache._entry_path(key='abc')
+        os.utime(entry_path, (old_time, old_time))
+        image_path = os.path.join(self.temp_dir, 'out.png')
+        self.cache.fetch(key='abc', image_path=image_path)
+        self.assertEqual(old_time, os.stat(image_path).st_mtime)
+
+    def test_evict_to_low_watermark(self):
+        """Should evict below the cap, so the next stores don't list the
+        cache again."""
+        self.cache.max_size = 100
+        for index in range(11):
+            source = self.write_file(str(index), b'0123456789')
+            self.cache.store(key='k{0}'.format(index), image_path=source)
+        self.assertEqual(90, self.cache.total_size)
+        with patch.object(ImageCache, '_entries',
+                          wraps=self.cache._entries) as entries:
+            source = self.write_file('last', b'0123456789')
+            self.cache.store(key='last', image_path=source)
+        self.assertEqual(0, entries.call_count)
+        self.assertEqual(100, self.cache.total_size)
+
+    def test_evict_linked_entries_last(self):
+        """Should remove entries linked to an output image after others."""
+        self.cache.link = True
+        self.cache.max_size = 25
+        for key in ('aaa', 'bbb'):
+            source = self.write_file(key, b'0123456789')
+            self.cache.store(key=key, image_path=source)
+        self.cache.fetch(
+            key='aaa', image_path=os.path.join(self.temp_dir, 'linked'))
+        old_time = time.time() - 100
+        os.utime(self.cache._entry_path(key='aaa', extension=''),
+                 (old_time, old_time))
+        source = self.write_file('ccc', b'0123456789')
+        self.cache.store(key='ccc', image_path=source)
+        remaining = {os.path.basename(x[3]) for x in self.cache._entries()}
+        self.assertEqual({'aaa', 'ccc'}, remaining)
+
+    def test_evict_least_recently_used(self):
+        """Should remove the least recently used images when over the cap."""
+        self.cache.max_size = 25
+        for key in ('aaa', 'bbb'):
+            source = self.write_file(key, b'0123456789')
+            self.cache.store(key=key, image_path=source)
+        old_time = time.time() - 100
+        os.utime(self.cache._entry_path(key='aaa', extension=''),
+                 (old_time, old_time))
+        os.utime(self.cache._entry_path(key='bbb', extension=''),
+                 (old_time + 10, old_time + 10))
+        self.cache.fetch(
+            key='aaa', image_path=os.path.join(self.temp_dir, 'fetched'))
+        source = self.write_file('ccc', b'0123456789')
+        self.cache.store(key='ccc', image_path=source)
+        remaining = {os.path.basename(x[3]) for x in self.cache._entries()}
+        self.assertEqual({'aaa', 'ccc'}, remaining)
+        self.assertEqual(20, self.cache.total_size)
+
+
+class TestImagesWriteCache(TestCase):
+    """Tests for Images.write() with an ImageCache."""
+
+    def setUp(self):
+        source = os.path.dirname(__file__)
+        self.temp_dir = tempfile.mkdtemp()
+        self.xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(os.path.join(source, 'Q1302_BEHAVE.xlsx'), self.xlsform)
+        shutil.copytree(os.path.join(source, 'nest_images'),
+                        os.path.join(self.temp_dir, 'nest_images'))
+        workbook = xlrd.open_workbook(filename=self.xlsform)
+        settings = ImageSettings.read(xlsform_workbook=workbook)
+        self.settings = ImageContent.read(
+            xlsform_workbook=workbook, settings=settings[2])
+        self.settings['image_content'] = self.settings['image_content'][:10]
+        self.cache = ImageCache(
+            cache_path=os.path.join(self.temp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_write_stores_then_reuses_images(self):
+        """Should render images once, then copy them from the cache."""
+        first = Images.write(xlsform_path=self.xlsform, settings=self.settings,
+                             cache=self.cache)
+        self.assertEqual(10, len(self.cache._entries()))
+        self.assertEqual((10, 0), (first['written'], first['cached']))
+        output_path = Images._get_output_directory(self.xlsform)
+        shutil.rmtree(output_path)
+        patch_save = 'odk_tools.question_images.images.Images._save_image'
+        with patch(patch_save) as save_image:
+            second = Images.write(
+                xlsform_path=self.xlsform, settings=self.settings,
+                cache=self.cache)
+        self.assertEqual(0, save_image.call_count)
+        self.assertEqual((0, 10), (second['written'], second['cached']))
+        self.assertEqual(10, len(os.listdir(output_path)))
+
+    def test_write_renders_changed_images(self):
+        """Should render images again if the settings change."""
+        Images.write(xlsform_path=self.xlsform, settings=self.settings,
+                     cache=self.cache)
+        self.settings['image_color'] = 'lavender'
+        patch_save = 'odk_tools.question_images.images.Images._save_image'
+        with patch(patch_save) as save_image:
+            Images.write(xlsform_path=self.xlsform, settings=self.settings,
+                         cache=self.cache)
+        self.assertEqual(10, save_image.call_count)
+
+    def test_save_image_unlinks_hard_link(self):
+        """Should not overwrite the cached image when saving over a link."""
+        self.cache.link = True
+        Images.write(xlsform_path=self.xlsform, settings=self.settings,
+                     cache=self.cache)
+        output_path = Images._get_output_directory(self.xlsform)
+        shutil.rmtree(output_path)
+        Images.write(xlsform_path=self.xlsform, settings=self.settings,
+                     cache=self.cache)
+        image_path = os.path.join(output_path, os.listdir(output_path)[0])
+        self.assertEqual(2, os.stat(image_path).st_nlink)
+        Images._save_image(
+            image=Images._create_blank_image(10, 10, 'red'),
+            image_path=image_path)
+        self.assertEqual(1, os.stat(image_path).st_nlink)
+
+    def test_create_parser_with_cache(self):
+        """Should parse the cache arguments."""
+        args = _create_parser().parse_args(['Q1302_BEHAVE.xlsx'])
+        self.assertFalse(args.cache)
+        self.assertIsNone(args.cache_dir)
+        args = _create_parser().parse_args(
+            ['--cache', 'Q1302_BEHAVE.xlsx', '--cache-size', '10'])
+        self.assertTrue(args.cache)
+        self.assertEqual('Q1302_BEHAVE.xlsx', args.xlsform)
+        self.assertEqual(10, args.cache_size)
+        args = _create_parser().parse_args(
+            ['--cache-dir', 'image_cache', 'Q1302_BEHAVE.xlsx'])
+        self.assertEqual('image_cache', args.cache_dir)
+        self.assertEqual('Q1302_BEHAVE.xlsx', args.xlsform)
@@ -0,0 +1,193 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+from odk_tools.question_images.images import Images
+from odk_tools.question_images import regression
+from odk_tools.question_images.regression import GoldenImages, \
+    DEFAULT_THRESHOLDS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "NumPy not installed.")
+class TestGoldenImages(TestCase):
+    """Tests for comparing question images with golden images."""
+
+    def setUp(self):
+        self.ref_images = os.path.join(
+            os.path.dirname(__file__), 'reference_images')
+        self.temp_dir = tempfile.mkdtemp()
+        self.observed = os.path.join(self.temp_dir, 'observed')
+        self.golden = os.path.join(self.temp_dir, 'golden')
+        self.report = os.path.join(self.temp_dir, 'report')
+        os.makedirs(self.observed)
+        os.makedirs(self.golden)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def add_pair(self, name, observed_ref, golden_ref):
+        if observed_ref is not None:
+            shutil.copy(os.path.join(self.ref_images, observed_ref),
+                        os.path.join(self.observed, name))
+        if golden_ref is not None:
+            shutil.copy(os.path.join(self.ref_images, golden_ref),
+                        os.path.join(self.golden, name))
+
+    def compare(self, name):
+        return GoldenImages.compare(
+            name=name, observed_path=os.path.join(self.observed, name),
+            golden_path=os.path.join(self.golden, name),
+            thresholds=DEFAULT_THRESHOLDS, report_path=self.report)
+
+    def test_counts_match_per_pixel_count(self):
+        """Should count the same pixels as a per pixel loop in Python."""
+        observed = Images._open_image(os.path.join(
+            self.ref_images, 'da2d10ye_english_all.png'))
+        golden = Images._open_image(os.path.join(
+            self.ref_images, 'da2d10ye_english_all_almost_identical.png'))
+        counts, _ = GoldenImages.difference_counts(
+            observed=observed, golden=golden)
+        expected = {'tiny': 0, 'minor': 0, 'large': 0}
+        for pixels in zip(observed.getdata(), golden.getdata()):
+            largest = max(abs(a - b) for a, b in zip(*pixels))
+            if largest == 0:
+                continue
+            elif largest < 3:
+                expected['tiny'] += 1
+            elif largest < 15:
+                expected['minor'] += 1
+            else:
+                expected['large'] += 1
+        self.assertEqual(dict(expected, pixels=700 * 600), counts)
+
+    def test_compare_identical(self):
+        """Should pass identical images without counting differences."""
+        self.add_pair('a.png', 'da2d10ye_english_all.png',
+                      'da2d10ye_english_all.png')
+        observed = self.compare('a.png')
+        self.assertEqual('pass', observed['status'])
+        self.assertEqual(0, observed['tiny'])
+
+    def test_compare_almost_identical(self):
+        """Should pass images with only tiny differences."""
+        self.add_pair('a.png', 'da2d10ye_english_all.png',
+                      'da2d10ye_english_all_almost_identical.png')
+        observed = self.compare('a.png')
+        self.assertEqual('pass', observed['status'])
+        self.assertGreater(observed['tiny'], 0)
+        self.assertIsNone(observed['diff_image'])
+
+    def test_compare_different(self):
+        """Should fail different images, and write a diff image."""
+        self.add_pair('a.png', 'da2d10ye_english_all.png',
+                      'da2d10ye_english_label.png')
+        observed = self.compare('a.png')
+        self.assertEqual('fail', observed['status'])
+        self.assertGreater(observed['large'], 0)
+        diff = Images._open_image(
+            os.path.join(self.report, observed['diff_image']))
+        self.assertEqual((700 * 3, 600), diff.size)
+
+    def test_compare_size_mismatch(self):
+        """Should fail images of a different size."""
+        self.add_pair('a.png', 'da2d10ye_english_all.png', 'base_logo.png')
+        observed = self.compare('a.png')
+        self.assertEqual('fail', observed['status'])
+        self.assertIn('Size', observed['reason'])
+
+    def test_compare_folders_and_report(self):
+        """Should report new, missing and failed images first."""
+        self.add_pair('a.png', 'da2d10ye_english_all.png',
+                      'da2d10ye_english_all.png')
+        self.add_pair('b.png', 'da2d10ye_english_all.png',
+                      'da2d10ye_english_label.png')
+        self.add_pair('c.png', 'da2d10ye_english_all.png', None)
+        self.add_pair('d.png', None, 'da2d10ye_english_all.png')
+        results = GoldenImages.compare_folders(
+            observed_path=self.observed, golden_path=self.golden,
+            report_path=self.report, workers=2)
+        observed = [(x['name'], x['status']) for x in results]
+        self.assertEqual(
+            [('a.png', 'pass'), ('b.png', 'fail'), ('c.png', 'new'),
+             ('d.png', 'missing')], observed)
+        index_path = GoldenImages.write_report(
+            results=results, report_path=self.report)
+        with open(index_path, encoding='utf-8') as index_file:
+            page = index_file.read()
+        self.assertIn('fail: 1, missing: 1, new: 1, pass: 1', page)
+        self.assertIn('<img src="b_diff.png"', page)
+        self.assertLess(page.index('b.png'), page.index('<td>a.png'))
+
+    def test_check_images_update_then_compare(self):
+        """Should copy the images to the golden folder, then pass them."""
+        xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(os.path.join(os.path.dirname(__file__),
+                                 'Q1302_BEHAVE.xlsx'), xlsform)
+        media = Images._get_output_directory(xlsform)
+        shutil.copytree(self.observed, media)
+        self.add_pair('a.png', 'da2d10ye_english_all.png', None)
+        shutil.copy(os.path.join(self.observed, 'a.png'), media)
+        regression.check_images(
+            xlsform_path=xlsform, golden_path=self.golden, render=False,
+            update=True)
+        results = regression.check_images(
+            xlsform_path=xlsform, golden_path=self.golden, render=False)
+        self.assertEqual([('a.png', 'pass')],
+                         [(x['name'], x['status']) for x in results])
+
+    def test_check_images_compares_profiles(self):
+        """Should copy and compare the images of each output profile."""
+        xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        media = Images._get_output_directory(xlsform)
+        phone_media = Images._get_profile_directory(
+            output_path=media, profile_name='phone')
+        for folder in (media, phone_media):
+            os.makedirs(folder)
+            shutil.copy(os.path.join(
+                self.ref_images, 'da2d10ye_english_all.png'),
+                os.path.join(folder, 'a.png'))
+        read_profiles = 'odk_tools.question_images.regression.GoldenImages.' \
+                        'read_profiles'
+        with patch(read_profiles, return_value=['phone']):
+            regression.check_images(
+                xlsform_path=xlsform, golden_path=self.golden, render=False,
+                update=True)
+            self.assertTrue(os.path.isfile(
+                os.path.join(self.golden, 'phone', 'a.png')))
+            shutil.copy(os.path.join(
+                self.ref_images, 'da2d10ye_english_label.png'),
+                os.path.join(phone_media, 'a.png'))
+            results = regression.check_images(
+                xlsform_path=xlsform, golden_path=self.golden, render=False,
+                report_path=self.report)
+        self.assertEqual([('a.png', 'pass'), ('phone/a.png', 'fail')],
+                         [(x['name'], x['status']) for x in results])
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.report, 'phone', 'a_diff.png')))
+
+    def test_read_profiles(self):
+        """Should read the profile names of all languages, once each."""
+        xlsform = os.path.join(os.path.dirname(__file__), 'Q1302_BEHAVE.xlsx')
+        settings = {1: {'image_profiles': 'phone:350, tablet:700'},
+                    2: {'image_profiles': 'phone:350'}}
+        read = 'odk_tools.question_images.regression.ImageSettings.read'
+        with patch(read, return_value=settings) as read_mock:
+            self.assertEqual(['phone', 'tablet'],
+                             GoldenImages.read_profiles(xlsform_path=xlsform))
+        self.assertFalse(read_mock.call_args[1]['fonts'])
+
+    def test_create_parser(self):
+        """Should parse the thresholds and options."""
+        args = regression._create_parser().parse_args(
+            ['Q1302_BEHAVE.xlsx', 'golden', '--minor', '0.01',
+             '--no-render'])
+        self.assertEqual(0.01, args.minor)
+        self.assertEqual(0.0, args.large)
+        self.assertFalse(args.render)
@@ -0,0 +1,54 @@
+import os
+import xlrd
+from unittest import TestCase
+from odk_tools.question_images.xlsx_rows import XlsxRows
+
+
+class TestXlsxRows(TestCase):
+    """Tests for the XlsxRows class."""
+
+    def setUp(self):
+        self.xlsform = os.path.join(
+            os.path.dirname(__file__), 'Q1302_BEHAVE.xlsx')
+        self.workbook = xlrd.open_workbook(self.xlsform)
+
+    def test_rows_same_as_xlrd(self):
+        """Should read the same sheets and cell values as xlrd."""
+        with XlsxRows(file_path=self.xlsform) as observed:
+            self.assertEqual(self.workbook.sheet_names(),
+                             observed.sheet_names())
+            for sheet_name in self.workbook.sheet_names():
+                sheet = self.workbook.sheet_by_name(sheet_name)
+                expected = [sheet.row_values(x) for x in range(sheet.nrows)]
+                rows = [x + [''] * (sheet.ncols - len(x))
+                        for x in observed.iter_rows(sheet_name=sheet_name)]
+                self.assertEqual(expected, rows)
+
+    def test_sheet_by_name_cell_values(self):
+        """Should read a whole sheet, with the xlrd sheet size and cells."""
+        expected = self.workbook.sheet_by_name('image_settings')
+        with XlsxRows(file_path=self.xlsform) as workbook:
+            observed = workbook.sheet_by_name('image_settings')
+        self.assertEqual((expected.nrows, expected.ncols),
+                         (observed.nrows, observed.ncols))
+        self.assertEqual(expected.cell_value(1, 1), observed.cell_value(1, 1))
+        self.assertEqual('', observed.cell_value(0, observed.ncols + 1))
+
+    def test_rows_read_lazily(self):
+        """Should read each row when it's reached."""
+        with XlsxRows(file_path=self.xlsform) as workbook:
+            rows = workbook.iter_rows(sheet_name='survey')
+            self.assertEqual('type', next(rows)[0])
+            self.assertEqual(self.workbook.sheet_by_name('survey').row_values(
+                1)[:2], next(rows)[:2])
+
+    def test_missing_sheet(self):
+        """Should raise a KeyError for a sheet that isn't in the workbook."""
+        with XlsxRows(file_path=self.xlsform) as workbook:
+            with self.assertRaises(KeyError):
+                next(workbook.iter_rows(sheet_name='spam'))
+
+    def test_column_index(self):
+        """Should convert the column letters of a cell reference."""
+        self.assertEqual([0, 25, 26, 701, 702], [XlsxRows._column_index(x)
+                         for x in ('A', 'Z', 'AA', 'ZZ', 'AAA')])
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+from odk_tools.lazy import LazyModule, lazy_import
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_imports_on_attribute_use(self):
+        """Should import the module when an attribute is first used."""
+        lazy = lazy_import('json.decoder')
+        self.assertIsInstance(lazy, LazyModule)
+        self.assertIsNone(lazy._lazy_module)
+        self.assertEqual('JSONDecoder', lazy.JSONDecoder.__name__)
+        self.assertIs(sys.modules['json.decoder'], lazy._lazy_module)
+
+    def test_patch_attribute(self):
+        """Should use and then remove attributes patched on the stand-in."""
+        lazy = lazy_import('json')
+        with patch.object(lazy, 'dumps', return_value='patched'):
+            self.assertEqual('patched', lazy.dumps({}))
+        self.assertEqual('{}', lazy.dumps({}))
+
+    def test_entry_points_skip_heavy_imports(self):
+        """Should not import heavy libraries when importing entry points."""
+        code = "import sys; import odk_tools.gui.gui, " \
+               "odk_tools.question_images.images, " \
+               "odk_tools.language_editions.editions; " \
+               "print([x for x in ('pyxform', 'lxml.etree', 'PIL.Image', " \
+               "'xlrd', 'xmltodict') if x in sys.modules])"
+        output = subprocess.check_output(
+            [sys.executable, "-c", code], universal_newlines=True)
+        self.assertEqual("[]", output.strip())
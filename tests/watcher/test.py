@@ -0,0 +1,182 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from odk_tools.question_images.images import ImageContent, ImageSettings
+from odk_tools.watcher.watcher import Watcher, _create_parser
+
+
+class TestWatcher(TestCase):
+    """Tests for the Watcher class."""
+
+    def setUp(self):
+        source = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'question_images')
+        self.temp_dir = tempfile.mkdtemp()
+        self.xlsform = os.path.join(self.temp_dir, 'Q1302_BEHAVE.xlsx')
+        shutil.copy(os.path.join(source, 'Q1302_BEHAVE.xlsx'), self.xlsform)
+        shutil.copytree(os.path.join(source, 'nest_images'),
+                        os.path.join(self.temp_dir, 'nest_images'))
+        self.watcher = Watcher(xlsform_path=self.xlsform, xform=False)
+        patch_save_path = \
+            'odk_tools.question_images.images.Images._save_image'
+        self.patch_save = patch(patch_save_path, MagicMock())
+        self.save_image = self.patch_save.start()
+
+    def tearDown(self):
+        self.patch_save.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_rebuild_writes_all_images_first(self):
+        """Should write all images on the first rebuild."""
+        self.watcher.rebuild()
+        self.assertEqual(184, self.save_image.call_count)
+
+    def test_rebuild_skips_unchanged_images(self):
+        """Should not write any images if nothing changed."""
+        self.watcher.rebuild()
+        self.save_image.reset_mock()
+        self.watcher.rebuild()
+        self.assertEqual(0, self.save_image.call_count)
+
+    def test_rebuild_only_changed_nest_image(self):
+        """Should only write the images that use a changed nested image."""
+        self.watcher.rebuild()
+        self.save_image.reset_mock()
+        nest_image = os.path.join(self.temp_dir, 'nest_images', 'spnl.png')
+        shutil.copy(os.path.join(self.temp_dir, 'nest_images', 'spgtf.png'),
+                    nest_image)
+        self.watcher.rebuild()
+        written = [os.path.basename(x[1]['image_path'])
+                   for x in self.save_image.call_args_list]
+        self.assertTrue(0 < len(written) < 184)
+
+    def test_rebuild_all_images_on_logo_change(self):
+        """Should write all images for a language if the logo changed."""
+        self.watcher.rebuild()
+        self.save_image.reset_mock()
+        logo = os.path.join(self.temp_dir, 'nest_images', 'stopc-logo.png')
+        shutil.copy(os.path.join(self.temp_dir, 'nest_images', 'spgtf.png'),
+                    logo)
+        self.watcher.rebuild()
+        self.assertEqual(184, self.save_image.call_count)
+
+    def test_rebuild_all_images_on_profile_change(self):
+        """Should write all images for each profile if the profiles changed."""
+        self.watcher.rebuild()
+        self.save_image.reset_mock()
+        read_settings = ImageSettings.read
+
+        def with_profiles(**kwargs):
+            all_settings = read_settings(**kwargs)
+            for settings in all_settings.values():
+                settings['image_profiles'] = 'phone:350'
+            return all_settings
+
+        with patch.object(ImageSettings, 'read', side_effect=with_profiles):
+            self.watcher.rebuild()
+            written = [x[1]['image_path']
+                       for x in self.save_image.call_args_list]
+            self.assertEqual(184 * 2, len(written))
+            phone = os.path.join(self.temp_dir, 'phone')
+            self.assertEqual(184, len(
+                [x for x in written if x.startswith(phone)]))
+            self.save_image.reset_mock()
+            self.watcher.rebuild()
+            self.assertEqual(0, self.save_image.call_count)
+
+    def test_rebuild_removes_images_of_removed_questions(self):
+        """Should delete the images and digests of questions removed."""
+        self.watcher.rebuild()
+        for file_paths in self.watcher.image_files.values():
+            for file_path in file_paths:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                open(file_path, mode='wb').close()
+        read_content = ImageContent.read
+
+        def without_first(**kwargs):
+            language = read_content(**kwargs)
+            language['image_content'] = language['image_content'][1:]
+            return language
+
+        keys = set(self.watcher.image_files.keys())
+        self.save_image.reset_mock()
+        with patch.object(ImageContent, 'read', side_effect=without_first):
+            self.watcher.rebuild()
+        removed = keys - set(self.watcher.image_files.keys())
+        self.assertEqual(1, len(removed))
+        self.assertEqual(removed, keys - set(self.watcher.image_digests))
+        media = os.path.join(self.temp_dir, 'Q1302_BEHAVE-media')
+        self.assertEqual(183, len(os.listdir(media)))
+        self.assertEqual(0, self.save_image.call_count)
+
+    def test_write_xform_converts_with_pyxform(self):
+        """Should convert the XLSForm to an XForm next to it."""
+        patch_convert = 'pyxform.xls2xform.xls2xform_convert'
+        with patch(patch_convert, MagicMock(return_value=[])) as convert:
+            Watcher._write_xform(xlsform_path=self.xlsform)
+        convert.assert_called_once_with(
+            xlsform_path=self.xlsform,
+            xform_path=os.path.join(self.temp_dir, 'Q1302_BEHAVE.xml'),
+            validate=False)
+
+    def test_watches_xlsform_and_images(self):
+        """Should watch the xlsform, the logo and the nested images."""
+        self.watcher.rebuild()
+        observed = {os.path.basename(x) for x in self.watcher.watched}
+        self.assertIn('Q1302_BEHAVE.xlsx', observed)
+        self.assertIn('stopc-logo.png', observed)
+        self.assertIn('spnl.png', observed)
+
+    def test_step_debounces_changes(self):
+        """Should rebuild once, after the changes stop for the debounce time."""
+        self.watcher.debounce = 2.0
+        self.watcher.poll()
+        with patch.object(self.watcher, 'rebuild') as rebuild:
+            self.assertFalse(self.watcher.step(now=0.0))
+            os.utime(self.xlsform, (1, 1))
+            self.assertFalse(self.watcher.step(now=1.0))
+            os.utime(self.xlsform, (2, 2))
+            self.assertFalse(self.watcher.step(now=2.0))
+            self.assertFalse(self.watcher.step(now=3.5))
+            self.assertTrue(self.watcher.step(now=4.0))
+            self.assertFalse(self.watcher.step(now=9.0))
+        self.assertEqual(1, rebuild.call_count)
+
+    def test_rebuild_xform_only_when_xlsform_changed(self):
+        """Should regenerate the XForm only if the XLSForm content changed."""
+        self.watcher.xform = True
+        self.watcher.images = False
+        patch_xform = 'odk_tools.watcher.watcher.Watcher._write_xform'
+        with patch(patch_xform, MagicMock()) as write_xform:
+            self.watcher.rebuild()
+            os.utime(self.xlsform, (1, 1))
+            self.watcher.rebuild()
+        self.assertEqual(1, write_xform.call_count)
+
+    def test_rebuild_logs_errors(self):
+        """Should log rather than raise errors, e.g. from a broken XLSForm."""
+        with open(self.xlsform, mode='wb') as xlsform:
+            xlsform.write(b'not an xlsx file')
+        watcher_log = 'odk_tools.watcher.watcher'
+        with self.assertLogs(watcher_log, level='ERROR') as logs:
+            self.watcher.rebuild()
+        self.assertIn('Rebuild failed', logs.output[0])
+
+    def test_create_parser_without_args(self):
+        """Should exit when no args provided."""
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                _create_parser().parse_args([])
+
+    def test_create_parser_with_args(self):
+        """Should parse the provided arguments and set defaults."""
+        args = _create_parser().parse_args(
+            ['--no-xform', '--debounce', '5', 'Q1302_BEHAVE.xlsx'])
+        self.assertEqual('Q1302_BEHAVE.xlsx', args.xlsform)
+        self.assertFalse(args.xform)
+        self.assertTrue(args.images)
+        self.assertEqual(5.0, args.debounce)